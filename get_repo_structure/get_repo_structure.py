@@ -1,10 +1,37 @@
 import ast
+import atexit
+import concurrent.futures
+import functools
+import io
+import multiprocessing
 import os
+import re
 import subprocess
+import threading
 import uuid
 import sys
+
+from get_repo_structure import git_objects
+from get_repo_structure.repo_mirror import (
+    REPO_MIRROR_DIR,
+    checkout_from_mirror,
+    ensure_mirror,
+)
+
 sys.setrecursionlimit(10000)
 
+# "checkout" builds structures from a working tree, "git" reads the files straight from the
+# object database of the mirror in REPO_MIRROR_DIR without writing anything to disk
+STRUCTURE_BACKEND = os.environ.get("STRUCTURE_BACKEND", "checkout")
+# SET THIS TO "1" TO PARSE EACH FILE ONLY WHEN IT IS FIRST USED, see LazyFileEntry
+STRUCTURE_LAZY = os.environ.get("STRUCTURE_LAZY", "0") == "1"
+
+# number of processes parsing files in create_structure, 1 parses in the calling thread. The
+# callers already build structures from several threads or processes, so it is off by default
+STRUCTURE_NUM_WORKERS = int(os.environ.get("STRUCTURE_NUM_WORKERS", 1))
+# below this many Python files starting the worker processes costs more than it saves
+MIN_FILES_PER_WORKER = 64
+
 repo_to_top_folder = {
     "django/django": "django",
     "sphinx-doc/sphinx": "sphinx",
@@ -84,6 +111,18 @@ def get_project_structure_from_scratch(
     repo_name, commit_id, instance_id, repo_playground, **kwargs
 ):
     model_patch = kwargs.get("model_patch", "")
+
+    if STRUCTURE_BACKEND == "git" and REPO_MIRROR_DIR is not None:
+        mirror_path = ensure_mirror(repo_name, commit_id)
+        if mirror_path is not None:
+            return {
+                "repo": repo_name,
+                "base_commit": commit_id,
+                "structure": create_patched_structure_from_git(
+                    mirror_path, repo_name, commit_id, model_patch
+                ),
+                "instance_id": instance_id,
+            }
     
     # Generate a temperary folder and add uuid to avoid collision
     repo_playground = os.path.join(repo_playground, str(uuid.uuid4()))
@@ -94,11 +133,19 @@ def get_project_structure_from_scratch(
     # create playground
     os.makedirs(repo_playground)
 
-    clone_repo(repo_name, repo_playground)
-    checkout_commit(f"{repo_playground}/{repo_to_top_folder[repo_name]}", commit_id)
+    if REPO_MIRROR_DIR is not None:
+        # check out from the local bare mirror instead of cloning the upstream repository
+        checkout_from_mirror(
+            repo_name, commit_id, f"{repo_playground}/{repo_to_top_folder[repo_name]}"
+        )
+    else:
+        clone_repo(repo_name, repo_playground)
+        checkout_commit(f"{repo_playground}/{repo_to_top_folder[repo_name]}", commit_id)
     if model_patch:
         apply_patch(f"{repo_playground}/{repo_to_top_folder[repo_name]}", model_patch)
-    structure = create_structure(f"{repo_playground}/{repo_to_top_folder[repo_name]}")
+    structure = create_structure(
+        f"{repo_playground}/{repo_to_top_folder[repo_name]}", lazy=STRUCTURE_LAZY
+    )
     # clean up
     subprocess.run(
         ["rm", "-rf", f"{repo_playground}/{repo_to_top_folder[repo_name]}"], check=True
@@ -112,35 +159,323 @@ def get_project_structure_from_scratch(
     return d
 
 
-# check whether the node is at global level by checking whether it is at module level
-def is_global_node(node, module):
-    for child in ast.iter_child_nodes(module):
-        if child == node:
-            return True
-    return False
+def create_patched_structure_from_git(git_dir, repo_name, commit_id, model_patch=""):
+    """Same structure as a checkout of the commit with model_patch applied by apply_patch,
+    but the patch is applied to a temporary index and the files are read from git_dir.
+    :param git_dir: Path to the (bare) repository containing the commit
+    :param repo_name: Upstream repository name, e.g. django/django
+    :param commit_id: Commit ID to build the structure of
+    :param model_patch: Patch to apply on top of the commit, if any
+    :return: A dictionary representing the structure.
+    """
+    tree_ish = commit_id
+    if model_patch:
+        print(f"Applying patch to the tree of {commit_id} in {git_dir}...")
+        patched_tree = git_objects.apply_patch_to_tree(git_dir, commit_id, model_patch)
+        if patched_tree is not None:
+            tree_ish = patched_tree
+            print("Patch applied successfully.")
+    top_folder = repo_to_top_folder[repo_name]
+    structure = create_structure_from_git(git_dir, tree_ish, top_folder, lazy=STRUCTURE_LAZY)
+    if model_patch:
+        # apply_patch leaves the patch file in the repository root
+        structure.setdefault(top_folder, {})["patch.diff"] = {}
+    return structure
+
+
+def parse_patch_files(patch_content):
+    """Split a unified diff into per-file changes.
+    :param patch_content: Patch content, as passed to git apply
+    :return: List of dicts with old_path, new_path and hunks, or None if the patch contains
+        changes that only git itself can reproduce (renames, copies, binary files)
+    """
+    file_patches = []
+    current = None
+    hunk = None
+    old_remaining = new_remaining = 0
+
+    for line in patch_content.split("\n"):
+        if hunk is not None and (old_remaining > 0 or new_remaining > 0):
+            tag = line[:1]
+            if tag == "\\":
+                continue  # "\ No newline at end of file"
+            if line[1:] and line[1:].splitlines() != [line[1:]]:
+                # the structure keeps str.splitlines() lines, which split on more than "\n"
+                return None
+            if tag in (" ", ""):
+                # an empty line is an empty context line whose leading space was stripped
+                hunk["old_lines"].append(line[1:])
+                hunk["new_lines"].append(line[1:])
+                hunk["trailing"] += 1
+                old_remaining -= 1
+                new_remaining -= 1
+            elif tag == "-":
+                hunk["old_lines"].append(line[1:])
+                hunk["trailing"] = 0
+                old_remaining -= 1
+            elif tag == "+":
+                hunk["new_lines"].append(line[1:])
+                hunk["trailing"] = 0
+                new_remaining -= 1
+            else:
+                return None  # malformed hunk, git apply would reject it
+            continue
+        hunk = None
+
+        if line.startswith("diff --git "):
+            current = {"old_path": None, "new_path": None, "hunks": [], "headers": True}
+            m = re.match(r"diff --git a/(.*) b/(.*)$", line)
+            if m:
+                current["old_path"], current["new_path"] = m.group(1), m.group(2)
+            file_patches.append(current)
+        elif line.startswith(("rename from", "copy from", "GIT binary patch", "Binary files")):
+            return None
+        elif line.startswith("new file mode") and current is not None:
+            current["old_path"] = None
+        elif line.startswith("deleted file mode") and current is not None:
+            current["new_path"] = None
+        elif line.startswith("--- "):
+            if current is None or current["hunks"] or not current.pop("headers", False):
+                current = {"old_path": None, "new_path": None, "hunks": []}
+                file_patches.append(current)
+            current["old_path"] = _strip_patch_path(line[4:])
+        elif line.startswith("+++ ") and current is not None:
+            current["new_path"] = _strip_patch_path(line[4:])
+        elif line.startswith("@@") and current is not None:
+            m = re.match(r"@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@", line)
+            if not m:
+                return None
+            old_remaining = int(m.group(2)) if m.group(2) is not None else 1
+            new_remaining = int(m.group(4)) if m.group(4) is not None else 1
+            hunk = {
+                "old_start": int(m.group(1)),
+                "new_start": int(m.group(3)),
+                "old_lines": [],
+                "new_lines": [],
+                "trailing": 0,
+            }
+            current["hunks"].append(hunk)
+
+    if hunk is not None and (old_remaining > 0 or new_remaining > 0):
+        return None  # truncated hunk
+    for file_patch in file_patches:
+        file_patch.pop("headers", None)
+    return file_patches
+
+
+def _strip_patch_path(path):
+    path = path.split("\t")[0].strip()
+    if path == "/dev/null":
+        return None
+    # git apply strips one leading path component by default (-p1)
+    return path.split("/", 1)[1] if "/" in path else path
+
+
+def apply_hunks(lines, hunks):
+    """Apply the hunks of one file the way git apply does: context has to match exactly,
+    but a hunk may be found at an offset from the line number in its header.
+    :param lines: Lines of the original file
+    :param hunks: Hunks as returned by parse_patch_files
+    :return: Lines of the patched file, or None if a hunk does not apply
+    """
+    lines = list(lines)
+    for hunk in hunks:
+        old_lines = hunk["old_lines"]
+        match_beginning = hunk["old_start"] <= 1
+        match_end = hunk["trailing"] == 0
+        if len(old_lines) > len(lines):
+            return None
+        if match_beginning:
+            expected = 0
+        elif match_end:
+            expected = len(lines) - len(old_lines)
+        else:
+            expected = min(hunk["new_start"] - 1 if hunk["new_start"] else 0, len(lines))
+
+        # same search order as git: the expected line, then one after, one before, two after...
+        applied_pos = None
+        backwards = forwards = current = expected
+        i = 0
+        while True:
+            if (
+                lines[current : current + len(old_lines)] == old_lines
+                and (not match_beginning or current == 0)
+                and (not match_end or current + len(old_lines) == len(lines))
+            ):
+                applied_pos = current
+                break
+            while not (backwards == 0 and forwards == len(lines)):
+                if i % 2:
+                    if backwards == 0:
+                        i += 1
+                        continue
+                    backwards -= 1
+                    current = backwards
+                else:
+                    if forwards == len(lines):
+                        i += 1
+                        continue
+                    forwards += 1
+                    current = forwards
+                break
+            else:
+                break
+            i += 1
+        if applied_pos is None:
+            return None
+        lines[applied_pos : applied_pos + len(old_lines)] = hunk["new_lines"]
+    return lines
+
+
+def _get_structure_dir(structure, dir_parts, copied, create=False):
+    """Walk down to the directory dict, copying every dict on the way so that the
+    original structure is left untouched."""
+    curr_struct = structure
+    for part in dir_parts:
+        if part not in curr_struct:
+            if not create:
+                return None
+            curr_struct[part] = {}
+            copied.add(id(curr_struct[part]))
+        elif id(curr_struct[part]) not in copied:
+            curr_struct[part] = dict(curr_struct[part])
+            copied.add(id(curr_struct[part]))
+        curr_struct = curr_struct[part]
+    return curr_struct
+
+
+def update_structure_with_patch(structure, repo_name, model_patch):
+    """Derive the structure of the patched repository from the structure of the base commit,
+    re-parsing only the files touched by the patch. Produces the same structure as applying the
+    patch to a checkout and running create_structure on it.
+    :param structure: Structure of the base commit (left unmodified)
+    :param repo_name: Upstream repository name, e.g. django/django
+    :param model_patch: Unified diff to apply
+    :return: The patched structure, or None if the patch has to be applied by git
+    """
+    file_patches = parse_patch_files(model_patch)
+    if file_patches is None:
+        return None
+
+    top_folder = repo_to_top_folder[repo_name]
+
+    def split_path(path):
+        parts = path.split("/")
+        # files at the repository root live under the top folder, see create_structure
+        return ([top_folder] if len(parts) == 1 else parts[:-1]), parts[-1]
+
+    def get_entry(path):
+        curr_struct = structure
+        dir_parts, file_name = split_path(path)
+        for part in dir_parts:
+            curr_struct = curr_struct.get(part)
+            if not isinstance(curr_struct, dict):
+                return None
+        return curr_struct.get(file_name)
+
+    # replay the file patches in order, a file may be patched several times
+    new_contents = {}
+    for file_patch in file_patches:
+        old_path, new_path = file_patch["old_path"], file_patch["new_path"]
+        if old_path is not None and new_path is not None and old_path != new_path:
+            return None
+        path = new_path if new_path is not None else old_path
+        if path is None:
+            return None
+
+        if path in new_contents:
+            old_lines = new_contents[path]
+        elif old_path is None:
+            old_lines = None
+        else:
+            entry = get_entry(path)
+            if entry is None:
+                return None
+            old_lines = entry.get("text") if path.endswith(".py") else []
+            if not isinstance(old_lines, list):
+                return None  # the base file could not be parsed, its text is unknown
+
+        if old_path is None:
+            if old_lines is not None or get_entry(path) is not None:
+                return None  # git apply refuses to create an existing file
+            old_lines = []
+        elif old_lines is None:
+            return None
+
+        if not path.endswith(".py") and path not in new_contents and old_path is not None:
+            # the content of other files is not kept, only git apply can check these hunks
+            return None
+
+        new_lines = apply_hunks(old_lines, file_patch["hunks"])
+        if new_lines is None:
+            return None
+        if new_path is None:
+            if new_lines:
+                return None  # a removal patch has to remove everything
+            new_contents[path] = None
+        else:
+            new_contents[path] = new_lines
+
+    structure = dict(structure)
+    copied = set()
+    for path, new_lines in new_contents.items():
+        dir_parts, file_name = split_path(path)
+        if new_lines is None:
+            curr_struct = _get_structure_dir(structure, dir_parts, copied)
+            curr_struct.pop(file_name, None)
+            # git removes directories left empty by a deletion
+            for depth in range(len(dir_parts), 0, -1):
+                parent = _get_structure_dir(structure, dir_parts[: depth - 1], copied)
+                if parent.get(dir_parts[depth - 1]) == {}:
+                    del parent[dir_parts[depth - 1]]
+                else:
+                    break
+            continue
+
+        curr_struct = _get_structure_dir(structure, dir_parts, copied, create=True)
+        if file_name.endswith(".py"):
+            class_info, function_names, file_lines, imports, import_interval = parse_python_file(
+                path, "".join(line + "\n" for line in new_lines), with_text=False
+            )
+            curr_struct[file_name] = {
+                "classes": class_info,
+                "functions": function_names,
+                "text": file_lines,
+                "imports": imports,
+                "import_interval": import_interval,
+            }
+        elif file_name not in curr_struct:
+            curr_struct[file_name] = {}
+
+    # apply_patch leaves the patch file in the repository root
+    _get_structure_dir(structure, [top_folder], copied, create=True)["patch.diff"] = {}
+    return structure
 
 
 def find_global_vars_in_function(function_node, global_vars):
     used_globals = []
+    if not global_vars:
+        return used_globals
 
-    # Collect all local variables in the function (assignments)
+    # Collect all local variables in the function (assignments) and all global variable uses
+    # in a single walk, the uses shadowed by a local variable are dropped afterwards
     local_vars = set()
+    global_uses = []
     for node in ast.walk(function_node):
-        if isinstance(node, ast.Assign):
+        if isinstance(node, ast.Name):
+            if node.id in global_vars:
+                global_uses.append(node.id)
+        elif isinstance(node, ast.Assign):
             for target in node.targets:
                 if isinstance(target, ast.Name):
                     local_vars.add(target.id)
-        elif isinstance(node, ast.AnnAssign):
-            if isinstance(node.target, ast.Name):
-                local_vars.add(node.target.id)
-        elif isinstance(node, ast.AugAssign):
+        elif isinstance(node, (ast.AnnAssign, ast.AugAssign)):
             if isinstance(node.target, ast.Name):
                 local_vars.add(node.target.id)
 
-    # All global variable uses that are not local variables
-    for node in ast.walk(function_node):
-        if isinstance(node, ast.Name) and node.id in global_vars and node.id not in local_vars:
-            used_globals.append(f"{node.id} = {global_vars[node.id]}")  # Add to list with the format 'aaa = bbb'
+    for name in global_uses:
+        if name not in local_vars:
+            used_globals.append(f"{name} = {global_vars[name]}")  # Add to list with the format 'aaa = bbb'
 
     return used_globals
 
@@ -169,9 +504,11 @@ def splice_intervals(intervals):
     return spliced_intervals
 
 
-def parse_python_file(file_path, file_content=None):
+def parse_python_file(file_path, file_content=None, with_text=True):
     """Parse a Python file to extract class and function definitions with their line numbers.
     :param file_path: Path to the Python file.
+    :param with_text: Copy the lines of every class, method and function into its "text".
+        Without it symbols only carry their line range into the file contents.
     :return: Class names, function names, and file contents
     """
     if file_content is None:
@@ -189,89 +526,264 @@ def parse_python_file(file_path, file_content=None):
             print(f"Error in file {file_path}: {e}")
             return [], [], "", [], []
 
+    file_lines = file_content.splitlines()
     class_info = []
     function_names = []
     class_methods = set()
     global_vars = {}
     imports = []
     import_interval = []
-    # first get all global variables and imports, they will be used in the next steps
-    for node in ast.walk(parsed_data):
+    # first get all global variables and imports, they will be used in the next steps.
+    # module level nodes are exactly the statements in the module body
+    for node in parsed_data.body:
         # global variables (Assign nodes && at module level)
-        if isinstance(node, ast.Assign) and is_global_node(node, parsed_data):
+        if isinstance(node, ast.Assign):
             for target in node.targets:
                 if isinstance(target, ast.Name):  
                     value = ast.unparse(node.value)  
                     global_vars[target.id] = value
 
         # import statements
-        elif isinstance(node, ast.Import) and is_global_node(node, parsed_data):
+        elif isinstance(node, ast.Import):
             for alias in node.names:
                 imports.append(f"import {alias.name}")
             import_interval.append((node.lineno, node.end_lineno))
-        elif isinstance(node, ast.ImportFrom) and is_global_node(node, parsed_data):
+        elif isinstance(node, ast.ImportFrom):
             module = node.module if node.module else ""
             for alias in node.names:
                 imports.append(f"from {module} import {alias.name}")
             import_interval.append((node.lineno, node.end_lineno))
+    # one breadth-first walk over the whole tree, a function is reported as a method of the
+    # classes seen before it in this order
     for node in ast.walk(parsed_data):
         if isinstance(node, ast.ClassDef):
             methods = []
             for n in node.body:
                 if isinstance(n, ast.FunctionDef):
                     used_globals = find_global_vars_in_function(n, global_vars)
-                    methods.append(
-                        {
-                            "name": n.name,
-                            "start_line": n.lineno,
-                            "end_line": n.end_lineno,
-                            "text": file_content.splitlines()[
-                                n.lineno - 1 : n.end_lineno
-                            ],
-                            "used_globals": used_globals,
-                        }
-                    )
+                    method = {
+                        "name": n.name,
+                        "start_line": n.lineno,
+                        "end_line": n.end_lineno,
+                    }
+                    if with_text:
+                        method["text"] = file_lines[n.lineno - 1 : n.end_lineno]
+                    method["used_globals"] = used_globals
+                    methods.append(method)
                     class_methods.add(n.name)
-            class_info.append(
-                {
+            clazz = {
+                "name": node.name,
+                "start_line": node.lineno,
+                "end_line": node.end_lineno,
+            }
+            if with_text:
+                clazz["text"] = file_lines[node.lineno - 1 : node.end_lineno]
+            clazz["methods"] = methods
+            class_info.append(clazz)
+        elif isinstance(node, ast.FunctionDef):
+            if node.name not in class_methods:
+                used_globals = find_global_vars_in_function(node, global_vars)
+                function = {
                     "name": node.name,
                     "start_line": node.lineno,
                     "end_line": node.end_lineno,
-                    "text": file_content.splitlines()[
-                        node.lineno - 1 : node.end_lineno
-                    ],
-                    "methods": methods,
                 }
-            )
-        elif isinstance(node, ast.FunctionDef) and not isinstance(
-            node, ast.AsyncFunctionDef
-        ):
-            if node.name not in class_methods:
-                used_globals = find_global_vars_in_function(node, global_vars)
-                function_names.append(
-                    {
-                        "name": node.name,
-                        "start_line": node.lineno,
-                        "end_line": node.end_lineno,
-                        "text": file_content.splitlines()[
-                            node.lineno - 1 : node.end_lineno
-                        ],
-                        "used_globals": used_globals,
-                    }
-                )
+                if with_text:
+                    function["text"] = file_lines[node.lineno - 1 : node.end_lineno]
+                function["used_globals"] = used_globals
+                function_names.append(function)
     import_interval =  splice_intervals(import_interval)
 
-    return class_info, function_names, file_content.splitlines(), imports, import_interval
+    return class_info, function_names, file_lines, imports, import_interval
+
+
+# the process pool shared by all structures, started on first use with the configured number
+# of workers, see _get_parse_pool
+_parse_pool = None
+_parse_pool_size = 0
+_parse_pool_lock = threading.Lock()
+
+
+def _shutdown_parse_pool():
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(_shutdown_parse_pool)
+
+
+def _get_parse_pool(num_workers):
+    """Return the shared pool, replacing it by a larger one if it has fewer workers."""
+    global _parse_pool, _parse_pool_size
+    with _parse_pool_lock:
+        if _parse_pool is None or _parse_pool_size < num_workers:
+            if _parse_pool is not None:
+                # the maps running on it finish, its workers exit once they are done
+                _parse_pool.shutdown(wait=False)
+            # forkserver: the callers run this from thread pools, forking those is unsafe
+            _parse_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+            _parse_pool_size = num_workers
+        return _parse_pool
+
+
+def _parse_python_files(parse_function, *iterables, num_workers=None):
+    """Map parse_function over the files, in a process pool when there are enough of them.
+    Results are returned in input order."""
+    num_workers = STRUCTURE_NUM_WORKERS if num_workers is None else num_workers
+    iterables = [list(iterable) for iterable in iterables]
+    num_files = len(iterables[0])
+    num_tasks = min(num_workers, num_files // MIN_FILES_PER_WORKER)
+    if num_tasks <= 1:
+        return list(map(parse_function, *iterables))
+    if num_tasks < num_workers:
+        # a smaller repository keeps at most num_tasks workers of the pool busy
+        chunksize = -(-num_files // num_tasks)
+    else:
+        chunksize = max(1, num_files // (num_workers * 4))
+    return list(
+        _get_parse_pool(num_workers).map(parse_function, *iterables, chunksize=chunksize)
+    )
+
+
+def _make_file_entry(result):
+    class_info, function_names, file_lines, imports, import_interval = result
+    return {
+        "classes": class_info,
+        "functions": function_names,
+        "text": file_lines,
+        "imports": imports,
+        "import_interval": import_interval,
+    }
+
+
+FILE_ENTRY_KEYS = {"classes", "functions", "text", "imports", "import_interval"}
+
+
+class LazyFileEntry(dict):
+    """Entry of a Python file that is parsed the first time its contents are used.
+    The keys are there from the start, so walking a structure and telling files from
+    directories (show_project_structure, filter_none_python, ...) parses nothing.
+    Loading is done once, under a per-entry lock, by the first thread that needs it."""
+
+    __slots__ = ("_loader", "_lock")
+
+    def __init__(self, loader):
+        super().__init__(
+            dict.fromkeys(["classes", "functions", "text", "imports", "import_interval"])
+        )
+        self._loader = loader
+        self._lock = threading.Lock()
 
+    def load(self):
+        if self._loader is not None:
+            with self._lock:
+                if self._loader is not None:
+                    dict.update(self, _make_file_entry(self._loader()))
+                    self._loader = None
+        return self
 
-def create_structure(directory_path):
+    @property
+    def loaded(self):
+        return self._loader is None
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self.load(), key)
+
+    def get(self, key, default=None):
+        return dict.get(self.load(), key, default)
+
+    def __iter__(self):
+        # an overridden __iter__ also keeps dict(entry) and {**entry} from copying the placeholders
+        return dict.__iter__(self)
+
+    def items(self):
+        return dict.items(self.load())
+
+    def values(self):
+        return dict.values(self.load())
+
+    def copy(self):
+        return dict.copy(self.load())
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self.load(), key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self.load(), key)
+
+    def pop(self, *args):
+        return dict.pop(self.load(), *args)
+
+    def setdefault(self, key, default=None):
+        return dict.setdefault(self.load(), key, default)
+
+    def update(self, *args, **kwargs):
+        dict.update(self.load(), *args, **kwargs)
+
+    def __or__(self, other):
+        return dict.__or__(self.copy(), other)
+
+    def __eq__(self, other):
+        if isinstance(other, dict) and dict.keys(self) != other.keys():
+            return False  # e.g. the `== {}` checks for empty directories
+        if isinstance(other, LazyFileEntry):
+            other.load()
+        return dict.__eq__(self.load(), other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return dict.__repr__(self.load())
+
+    def __reduce_ex__(self, protocol):
+        # copies and pickles are plain dicts
+        return dict, (self.copy(),)
+
+
+def load_structure(structure):
+    """Parse every file of a lazy structure that has not been parsed yet.
+    :param structure: Structure as returned by create_structure(..., lazy=True)
+    :return: The same structure
+    """
+    for content in structure.values():
+        if isinstance(content, LazyFileEntry):
+            content.load()
+        elif isinstance(content, dict):
+            load_structure(content)
+    return structure
+
+
+def _read_file_bytes(file_path):
+    try:
+        with open(file_path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def create_structure(directory_path, num_workers=None, lazy=False):
     """Create the structure of the repository directory by parsing Python files.
+    The structure is compact: each file keeps its lines once in "text", classes, methods and
+    functions only point into them with start_line and end_line, see expand_structure.
     :param directory_path: Path to the repository directory.
+    :param num_workers: Number of processes parsing the files, defaults to STRUCTURE_NUM_WORKERS.
+    :param lazy: Only read the Python files, each one is parsed when its entry is first used
+        (see LazyFileEntry). The directory can be removed as soon as this returns.
     :return: A dictionary representing the structure.
     """
     structure = {}
+    python_files = []
 
-    for root, _, files in os.walk(directory_path):
+    for root, dirs, files in os.walk(directory_path):
+        # the git metadata is not part of the repository contents
+        dirs[:] = [d for d in dirs if d != ".git"]
         repo_name = os.path.basename(directory_path)
         relative_root = os.path.relpath(root, directory_path)
         if relative_root == ".":
@@ -282,17 +794,287 @@ def create_structure(directory_path):
                 curr_struct[part] = {}
             curr_struct = curr_struct[part]
         for file_name in files:
+            # entries are inserted in walk order now and filled in once parsed
+            curr_struct[file_name] = {}
             if file_name.endswith(".py"):
-                file_path = os.path.join(root, file_name)
-                class_info, function_names, file_lines, imports, import_interval = parse_python_file(file_path)
-                curr_struct[file_name] = {
-                    "classes": class_info,
-                    "functions": function_names,
-                    "text": file_lines,
-                    "imports": imports,
-                    "import_interval": import_interval,
-                }
+                python_files.append((curr_struct, file_name, os.path.join(root, file_name)))
+
+    if lazy:
+        for curr_struct, file_name, file_path in python_files:
+            curr_struct[file_name] = LazyFileEntry(
+                functools.partial(_parse_python_blob, file_path, _read_file_bytes(file_path))
+            )
+        return structure
+
+    results = _parse_python_files(
+        functools.partial(parse_python_file, with_text=False),
+        [file_path for _, _, file_path in python_files],
+        num_workers=num_workers,
+    )
+    for (curr_struct, file_name, _), result in zip(python_files, results):
+        curr_struct[file_name] = _make_file_entry(result)
+
+    return structure
+
+
+def _parse_python_blob(file_path, data):
+    if data is None:
+        # e.g. a dangling symbolic link, opening it fails
+        print(f"Error in file {file_path}: No such file or directory")
+        return [], [], "", [], []
+    try:
+        # decode and translate newlines exactly like open(file_path, "r") does
+        file_content = io.TextIOWrapper(io.BytesIO(data)).read()
+    except Exception as e:  # Catch all types of exceptions
+        print(f"Error in file {file_path}: {e}")
+        return [], [], "", [], []
+    return parse_python_file(file_path, file_content, with_text=False)
+
+
+def create_structure_from_git(git_dir, tree_ish, repo_name, num_workers=None, lazy=False):
+    """Create the structure of a commit straight from the object database of a repository,
+    without writing a working tree. The result is the same as checking the commit out into
+    a directory named repo_name and calling create_structure on it.
+    :param git_dir: Path to the (bare) repository, e.g. the mirror of repo_mirror.py
+    :param tree_ish: Commit or tree to build the structure of
+    :param repo_name: Name of the checkout directory, files at the root are stored under it
+    :param num_workers: Number of processes parsing the files, defaults to STRUCTURE_NUM_WORKERS.
+    :param lazy: Parse each Python file when its entry is first used, see LazyFileEntry.
+    :return: A dictionary representing the structure.
+    """
+    entries = git_objects.list_tree(git_dir, tree_ish)
+    entries_by_path = {entry.path: entry for entry in entries}
+    # os.walk is top-down: root files are stored before the files of a directory that
+    # happens to be called like the top folder, which then replace them
+    entries.sort(key=lambda entry: "/" in entry.path)
+
+    # os.walk lists the root first, create_structure stores it even if it has no files
+    structure = {repo_name: {}}
+    python_files = []
+    with git_objects.GitObjectReader(git_dir) as reader:
+        for entry in entries:
+            dir_parts = entry.path.split("/")
+            file_name = dir_parts.pop()
+            if entry.type != "blob":
+                # trees, and submodules which are checked out as empty directories
+                dir_parts.append(file_name)
+            elif not dir_parts:
+                dir_parts = [repo_name]
+            curr_struct = structure
+            for part in dir_parts:
+                if part not in curr_struct:
+                    curr_struct[part] = {}
+                curr_struct = curr_struct[part]
+            if entry.type != "blob":
+                continue
+
+            sha = entry.sha
+            if entry.mode == git_objects.SYMLINK_MODE:
+                target_path = git_objects.resolve_symlinks(
+                    entry.path, entries_by_path, reader
+                )
+                if target_path is not None and os.path.isabs(target_path):
+                    if os.path.isdir(target_path):
+                        continue
+                    curr_struct[file_name] = {}
+                    if file_name.endswith(".py"):
+                        # the checkout would read the file the link points to on this machine
+                        python_files.append(
+                            (curr_struct, file_name, entry.path, _read_file_bytes(target_path))
+                        )
+                    continue
+                target = entries_by_path.get(target_path)
+                if target_path == "" or (target is not None and target.type != "blob"):
+                    continue  # os.walk lists links to directories but never enters them
+                sha = target.sha if target is not None else None
+            curr_struct[file_name] = {}
+            if file_name.endswith(".py"):
+                python_files.append((curr_struct, file_name, entry.path, sha))
+
+        blob_shas = [sha for _, _, _, sha in python_files if isinstance(sha, str)]
+        blobs = dict(zip(blob_shas, reader.read_many(blob_shas)))
+    # the links to host files were read already
+    python_files = [
+        (curr_struct, file_name, file_path, blobs.get(sha) if isinstance(sha, str) else sha)
+        for curr_struct, file_name, file_path, sha in python_files
+    ]
+
+    if lazy:
+        for curr_struct, file_name, file_path, data in python_files:
+            curr_struct[file_name] = LazyFileEntry(
+                functools.partial(_parse_python_blob, file_path, data)
+            )
+        return structure
+
+    results = _parse_python_files(
+        _parse_python_blob,
+        [file_path for _, _, file_path, _ in python_files],
+        [data for _, _, _, data in python_files],
+        num_workers=num_workers,
+    )
+    for (curr_struct, file_name, _, _), result in zip(python_files, results):
+        curr_struct[file_name] = _make_file_entry(result)
+
+    return structure
+
+
+def update_structure_to_commit(
+    structure, repo_name, git_dir, base_commit, commit_id, num_workers=None, lazy=False
+):
+    """Derive the structure of a commit from the structure of another commit of the same
+    repository. Only the files git diff --name-status reports between the two commits are
+    re-parsed, everything else is shared with the given structure, which is left untouched.
+    The result is the same as create_structure_from_git(git_dir, commit_id, ...).
+    :param structure: Structure of base_commit
+    :param repo_name: Upstream repository name, e.g. django/django
+    :param git_dir: Path to the (bare) repository containing both commits
+    :param base_commit: Commit the structure was built at
+    :param commit_id: Commit to derive the structure of
+    :param num_workers: Number of processes parsing the files, defaults to STRUCTURE_NUM_WORKERS.
+    :param lazy: Parse each changed Python file when its entry is first used.
+    :return: The structure of commit_id, or None if it has to be built from scratch
+    """
+    try:
+        diff_output = subprocess.run(
+            [
+                "git",
+                "--git-dir",
+                git_dir,
+                "diff",
+                "--name-status",
+                "--no-renames",
+                "-z",
+                base_commit,
+                commit_id,
+            ],
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+        entries = git_objects.list_tree(git_dir, commit_id)
+    except subprocess.CalledProcessError as e:
+        print(f"An error occurred while running git command: {e}")
+        return None
+    if any(entry.mode == git_objects.SYMLINK_MODE for entry in entries):
+        return None  # a link changes whenever its target does, which the diff does not show
+    entries_by_path = {entry.path: entry for entry in entries}
+    changed_paths = [os.fsdecode(path) for path in diff_output.split(b"\0")[1::2]]
+
+    top_folder = repo_to_top_folder[repo_name]
+
+    def get_location(path):
+        parts = path.split("/")
+        # files at the repository root live under the top folder, see create_structure
+        return (top_folder, parts[0]) if len(parts) == 1 else tuple(parts)
+
+    def get_source(location):
+        """The entry of commit_id stored at a location, a file in a directory named like the
+        top folder wins over a file at the root, as in create_structure."""
+        if len(location) == 2 and location[0] == top_folder:
+            return entries_by_path.get("/".join(location)) or entries_by_path.get(location[1])
+        return entries_by_path.get("/".join(location))
+
+    # like create_structure, the top folder is there first even if the root has no files
+    structure = {top_folder: {}, **structure}
+    structure.pop(".git", None)  # structures built before .git was skipped
+    copied = set()
+    python_files = []
+    # deletions first, deepest first, so that emptied directories can be pruned on the way up
+    locations = sorted({get_location(path) for path in changed_paths}, key=len)
+    for location in reversed(locations):
+        if get_source(location) is not None:
+            continue
+        curr_struct = structure
+        for part in location[:-1]:
+            curr_struct = curr_struct.get(part)
+            if not isinstance(curr_struct, dict) or curr_struct.keys() == FILE_ENTRY_KEYS:
+                break
+        else:
+            curr_struct = _get_structure_dir(structure, list(location[:-1]), copied)
+            curr_struct.pop(location[-1], None)
+            for depth in range(len(location) - 1, 1 if location[0] == top_folder else 0, -1):
+                parent = _get_structure_dir(structure, list(location[: depth - 1]), copied)
+                if parent.get(location[depth - 1]) == {} and get_source(location[:depth]) is None:
+                    del parent[location[depth - 1]]
+                else:
+                    break
+    for location in locations:
+        source = get_source(location)
+        if source is None:
+            continue
+        curr_struct = structure
+        for part in location[:-1]:
+            curr_struct = curr_struct.get(part)
+            if curr_struct is None:
+                break
+            if not isinstance(curr_struct, dict) or curr_struct.keys() == FILE_ENTRY_KEYS:
+                return None  # a parsed file became a directory
+        curr_struct = _get_structure_dir(structure, list(location[:-1]), copied, create=True)
+        file_name = location[-1]
+        if source.type != "blob":
+            # a submodule, checked out as an empty directory
+            curr_struct.setdefault(file_name, {})
+        elif file_name.endswith(".py"):
+            python_files.append((curr_struct, file_name, source.path, source.sha))
+        else:
+            curr_struct[file_name] = {}
+
+    with git_objects.GitObjectReader(git_dir) as reader:
+        blobs = reader.read_many([sha for _, _, _, sha in python_files])
+    if lazy:
+        for (curr_struct, file_name, file_path, _), data in zip(python_files, blobs):
+            curr_struct[file_name] = LazyFileEntry(
+                functools.partial(_parse_python_blob, file_path, data)
+            )
+        return structure
+
+    results = _parse_python_files(
+        _parse_python_blob,
+        [file_path for _, _, file_path, _ in python_files],
+        blobs,
+        num_workers=num_workers,
+    )
+    for (curr_struct, file_name, _, _), result in zip(python_files, results):
+        curr_struct[file_name] = _make_file_entry(result)
+    return structure
+
+
+def _iter_file_entries(structure):
+    for content in structure.values():
+        if isinstance(content, dict):
+            if content.keys() == FILE_ENTRY_KEYS:
+                yield content
             else:
-                curr_struct[file_name] = {}
+                yield from _iter_file_entries(content)
+
+
+def _iter_symbols(file_entry):
+    for clazz in file_entry["classes"]:
+        yield clazz
+        yield from clazz.get("methods", [])
+    yield from file_entry["functions"]
+
 
+def compact_structure(structure):
+    """Drop the per-symbol "text" copies of a structure in place, e.g. one loaded from an
+    older PROJECT_FILE_LOC file. The file lines themselves are kept.
+    :param structure: Structure as returned by create_structure
+    :return: The same structure
+    """
+    for file_entry in _iter_file_entries(structure):
+        for symbol in _iter_symbols(file_entry):
+            symbol.pop("text", None)
+    return structure
+
+
+def expand_structure(structure):
+    """Add "text" to every class, method and function of a compact structure in place, for
+    consumers that need the full format of parse_python_file(..., with_text=True).
+    :param structure: Structure as returned by create_structure
+    :return: The same structure
+    """
+    for file_entry in _iter_file_entries(structure):
+        file_lines = file_entry["text"]
+        for symbol in _iter_symbols(file_entry):
+            if "text" not in symbol:
+                symbol["text"] = file_lines[symbol["start_line"] - 1 : symbol["end_line"]]
     return structure
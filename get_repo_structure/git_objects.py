@@ -0,0 +1,157 @@
+import os
+import subprocess
+import tempfile
+import threading
+from collections import namedtuple
+
+TreeEntry = namedtuple("TreeEntry", ["mode", "type", "sha", "path"])
+
+SYMLINK_MODE = "120000"
+# same limit as the kernel when following chains of symbolic links
+MAX_SYMLINK_HOPS = 40
+
+
+def list_tree(git_dir, tree_ish):
+    """List every entry of a tree recursively, including the trees themselves.
+    :param git_dir: Path to the (bare) repository
+    :param tree_ish: Commit or tree to list
+    :return: List of TreeEntry, in git's path order
+    """
+    output = subprocess.run(
+        ["git", "--git-dir", git_dir, "ls-tree", "-r", "-t", "-z", "--full-tree", tree_ish],
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    entries = []
+    for record in output.split(b"\0"):
+        if not record:
+            continue
+        info, path = record.split(b"\t", 1)
+        mode, obj_type, sha = info.decode().split(" ")
+        entries.append(TreeEntry(mode, obj_type, sha, os.fsdecode(path)))
+    return entries
+
+
+def apply_patch_to_tree(git_dir, commit_id, patch_content):
+    """Apply a patch to the tree of a commit in a throwaway index, without a working tree.
+    :param git_dir: Path to the (bare) repository
+    :param commit_id: Commit the patch applies to
+    :param patch_content: Patch content, as passed to git apply
+    :return: Hash of the patched tree, or None if the patch does not apply
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict(os.environ, GIT_INDEX_FILE=os.path.join(tmp_dir, "index"))
+        try:
+            subprocess.run(
+                ["git", "--git-dir", git_dir, "read-tree", commit_id], env=env, check=True
+            )
+            subprocess.run(
+                ["git", "--git-dir", git_dir, "apply", "--cached", "-"],
+                input=patch_content.encode("utf-8"),
+                env=env,
+                check=True,
+            )
+            return subprocess.run(
+                ["git", "--git-dir", git_dir, "write-tree"],
+                env=env,
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout.decode().strip()
+        except subprocess.CalledProcessError as e:
+            print(f"An error occurred while running git command: {e}")
+            return None
+
+
+class GitObjectReader:
+    """Reads objects from a repository through one long running `git cat-file --batch`
+    process instead of starting git for every file. Safe to share between threads."""
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self.lock = threading.Lock()
+        self.process = subprocess.Popen(
+            ["git", "--git-dir", git_dir, "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+        self.process.stdout.close()
+
+    def _read_response(self):
+        header = self.process.stdout.readline()
+        if not header or header.endswith(b" missing\n"):
+            return None
+        _, _, size = header.split()
+        data = self.process.stdout.read(int(size))
+        self.process.stdout.read(1)  # the newline after the content
+        return data
+
+    def read(self, object_name):
+        """Return the content of an object, or None if it does not exist."""
+        return self.read_many([object_name])[0]
+
+    def read_many(self, object_names):
+        """Return the contents of several objects, in order. The requests are written from a
+        second thread so that git never waits for us to read a response before the next one."""
+        object_names = list(object_names)
+        with self.lock:
+            writer = threading.Thread(
+                target=self._write_requests, args=(object_names,), daemon=True
+            )
+            writer.start()
+            contents = [self._read_response() for _ in object_names]
+            writer.join()
+        return contents
+
+    def _write_requests(self, object_names):
+        self.process.stdin.write(
+            b"".join(name.encode() + b"\n" for name in object_names)
+        )
+        self.process.stdin.flush()
+
+
+def resolve_symlinks(path, entries, reader):
+    """Resolve a path the way the file system would in a checkout of the tree.
+    :param path: Path inside the repository
+    :param entries: Map from path to TreeEntry for the whole tree
+    :param reader: GitObjectReader used to read the link targets
+    :return: Path of the entry the path ends up at, an absolute path for links to the host
+        file system, or None for dangling links and relative links leaving the repository
+    """
+    parts = []
+    pending = path.split("/")
+    hops = 0
+    while pending:
+        part = pending.pop(0)
+        if part in ("", "."):
+            continue
+        if part == "..":
+            if not parts:
+                return None
+            parts.pop()
+            continue
+        parts.append(part)
+        entry = entries.get("/".join(parts))
+        if entry is None:
+            return None
+        if entry.mode == SYMLINK_MODE:
+            hops += 1
+            target = os.fsdecode(reader.read(entry.sha))
+            if hops > MAX_SYMLINK_HOPS:
+                return None
+            if target.startswith("/"):
+                return os.path.join(target, *pending)
+            # the target is relative to the directory containing the link
+            parts.pop()
+            pending = target.split("/") + pending
+    return "/".join(parts)
@@ -0,0 +1,186 @@
+import argparse
+import os
+import subprocess
+
+from filelock import FileLock
+
+# SET THIS TO KEEP ONE PERSISTENT BARE MIRROR PER UPSTREAM REPOSITORY
+REPO_MIRROR_DIR = os.environ.get("REPO_MIRROR_DIR", None)
+
+MIRROR_REFSPECS = ["+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"]
+
+
+def get_mirror_path(repo_name, mirror_dir=None):
+    """Return the path of the bare mirror for the given upstream repository.
+    :param repo_name: Upstream repository name, e.g. django/django
+    :param mirror_dir: Directory holding the mirrors, defaults to REPO_MIRROR_DIR
+    :return: Path to the bare repository
+    """
+    mirror_dir = mirror_dir or REPO_MIRROR_DIR
+    return os.path.join(mirror_dir, repo_name.replace("/", "__") + ".git")
+
+
+def has_commit(mirror_path, commit_id):
+    """Check whether the commit is already present in the local object database."""
+    if not os.path.isdir(mirror_path):
+        return False
+    result = subprocess.run(
+        ["git", "-C", mirror_path, "cat-file", "-e", f"{commit_id}^{{commit}}"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return result.returncode == 0
+
+
+def seed_mirror(repo_name, source, mirror_dir=None):
+    """Create or update the bare mirror of a repository from a local path (or any git url).
+    Once seeded, structures for commits contained in the source can be built offline.
+    :param repo_name: Upstream repository name, e.g. django/django
+    :param source: Local repository path or url to copy the objects from
+    :param mirror_dir: Directory holding the mirrors, defaults to REPO_MIRROR_DIR
+    :return: Path to the bare repository, or None on failure
+    """
+    mirror_path = get_mirror_path(repo_name, mirror_dir)
+    os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+    try:
+        with FileLock(mirror_path + ".lock"):
+            if not os.path.isdir(mirror_path):
+                print(f"Seeding mirror {mirror_path} from {source}...")
+                subprocess.run(
+                    ["git", "clone", "--bare", "--quiet", source, mirror_path],
+                    check=True,
+                )
+                # later fetches of missing commits go to the upstream repository
+                subprocess.run(
+                    [
+                        "git",
+                        "-C",
+                        mirror_path,
+                        "remote",
+                        "set-url",
+                        "origin",
+                        f"https://github.com/{repo_name}.git",
+                    ],
+                    check=True,
+                )
+            else:
+                print(f"Updating mirror {mirror_path} from {source}...")
+                subprocess.run(
+                    ["git", "-C", mirror_path, "fetch", "--quiet", source]
+                    + MIRROR_REFSPECS,
+                    check=True,
+                )
+        print("Mirror seeded successfully.")
+        return mirror_path
+    except subprocess.CalledProcessError as e:
+        print(f"An error occurred while running git command: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+    return None
+
+
+def ensure_mirror(repo_name, commit_id, mirror_dir=None):
+    """Make sure the bare mirror exists and contains the commit, cloning or fetching only when needed.
+    :param repo_name: Upstream repository name, e.g. django/django
+    :param commit_id: Commit that has to be available locally
+    :param mirror_dir: Directory holding the mirrors, defaults to REPO_MIRROR_DIR
+    :return: Path to the bare repository, or None if the commit could not be obtained
+    """
+    mirror_path = get_mirror_path(repo_name, mirror_dir)
+    # fast path: no lock and no network if the object database already has the commit
+    if has_commit(mirror_path, commit_id):
+        return mirror_path
+
+    os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+    try:
+        with FileLock(mirror_path + ".lock"):
+            if not os.path.isdir(mirror_path):
+                print(
+                    f"Cloning bare mirror of https://github.com/{repo_name}.git to {mirror_path}..."
+                )
+                subprocess.run(
+                    [
+                        "git",
+                        "clone",
+                        "--bare",
+                        "--quiet",
+                        f"https://github.com/{repo_name}.git",
+                        mirror_path,
+                    ],
+                    check=True,
+                )
+            if not has_commit(mirror_path, commit_id):
+                print(f"Fetching {commit_id} into mirror {mirror_path}...")
+                subprocess.run(
+                    ["git", "-C", mirror_path, "fetch", "--quiet", "origin"]
+                    + MIRROR_REFSPECS,
+                    check=True,
+                )
+            if not has_commit(mirror_path, commit_id):
+                # the commit may not be reachable from any branch or tag
+                subprocess.run(
+                    ["git", "-C", mirror_path, "fetch", "--quiet", "origin", commit_id],
+                    check=True,
+                )
+    except subprocess.CalledProcessError as e:
+        print(f"An error occurred while running git command: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+
+    if has_commit(mirror_path, commit_id):
+        return mirror_path
+    return None
+
+
+def checkout_from_mirror(repo_name, commit_id, repo_path, mirror_dir=None):
+    """Check out the commit into repo_path, sharing the object database of the mirror.
+    Nothing is copied besides the working tree, so removing repo_path afterwards is cheap.
+    :param repo_name: Upstream repository name, e.g. django/django
+    :param commit_id: Commit ID to checkout
+    :param repo_path: Path of the working tree to create
+    :param mirror_dir: Directory holding the mirrors, defaults to REPO_MIRROR_DIR
+    :return: None
+    """
+    mirror_path = ensure_mirror(repo_name, commit_id, mirror_dir)
+    if mirror_path is None:
+        print(f"Commit {commit_id} is not available in the mirror of {repo_name}.")
+        return
+    try:
+        print(f"Checking out commit {commit_id} from mirror {mirror_path} to {repo_path}...")
+        subprocess.run(
+            [
+                "git",
+                "clone",
+                "--shared",
+                "--no-checkout",
+                "--quiet",
+                mirror_path,
+                repo_path,
+            ],
+            check=True,
+        )
+        subprocess.run(
+            ["git", "-C", repo_path, "checkout", "--quiet", commit_id], check=True
+        )
+        print("Commit checked out successfully.")
+    except subprocess.CalledProcessError as e:
+        print(f"An error occurred while running git command: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repo", type=str, required=True, help="e.g. django/django")
+    parser.add_argument(
+        "--source", type=str, required=True, help="local repository to seed from"
+    )
+    parser.add_argument("--mirror_dir", type=str, default=REPO_MIRROR_DIR)
+    args = parser.parse_args()
+
+    assert args.mirror_dir, "Set REPO_MIRROR_DIR or pass --mirror_dir"
+    seed_mirror(args.repo, args.source, args.mirror_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,21 @@ from collections import Counter
 import json
 import re
 from patchpilot.repair.utils import construct_topn_file_context
-from patchpilot.util.compress_file import get_skeleton
+from patchpilot.util.compress_file import (
+    COMPRESSION_LEVELS,
+    choose_compression_levels,
+    get_compressed_file,
+    get_skeleton,
+)
 from patchpilot.util.get_function_interval import get_function_interval
 from patchpilot.util.postprocess_data import extract_code_blocks, extract_locs_for_files
-from patchpilot.util.search_tool import search_string, search_class_def, search_func_def, search_string_schema, search_class_def_schema, search_func_def_schema
+from patchpilot.util.search_tool import search_batch, search_string_schema, search_class_def_schema, search_func_def_schema
 from patchpilot.util.preprocess_data import (
     correct_file_paths,
-    get_full_file_paths_and_classes_and_functions,
     get_repo_files,
     show_project_structure,
 )
+from patchpilot.util.repo_index import get_repo_index
 
 MAX_CONTEXT_LENGTH = 128000
 
@@ -450,52 +455,42 @@ Return just the locations. Do not include any comments or explanations. Do not f
         if traj:
             self.logger.info(f"Response for search:\n{str(traj)}")
             if "tool_call" in traj and traj["tool_call"]:
+                # (key of the result, kind for the log, tool name, argument) of every search
+                searches = []
                 for tool_call in traj["tool_call"]:
-                    if tool_call.function.name == "search_string":
-                        try:
-                            arguments = tool_call.function.arguments
-                            argument_dict=json.loads(arguments)
-                        except Exception as e:
-                            raise e
-                        if argument_dict and isinstance(argument_dict, dict) and "query_string" in argument_dict:
-                            query_string = argument_dict["query_string"]
-                            pattern = r"(?i)\b\w*warning\w*\b|\b\w*error\w*\b"
-                            cleaned_text = re.sub(pattern, "", query_string)
-                            cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
-                            search_results = " ".join(search_string(cleaned_text, structure=self.structure))
-                            if search_results:
-                                search_str_with_file[query_string] = search_results
-                                self.logger.info(f'search result for string {query_string}: {search_results}')
-                            else:
-                                self.logger.info(f'search result for string {query_string}: not found')
-                    elif tool_call.function.name == "search_class_def":
-                        try:
-                            arguments = tool_call.function.arguments
-                            argument_dict=json.loads(arguments)
-                        except Exception as e:
-                            raise e
-                        if argument_dict and isinstance(argument_dict, dict) and "class_name" in argument_dict:
-                            class_name = argument_dict["class_name"]
-                            search_results = " ".join(search_class_def(class_name, structure=self.structure))
-                            if search_results:
-                                search_str_with_file[class_name] = search_results
-                                self.logger.info(f'search result for class {class_name}: {search_results}')
-                            else:
-                                self.logger.info(f'search result for class {class_name}: not found')
-                    elif tool_call.function.name == "search_func_def":
-                        try:
-                            arguments = tool_call.function.arguments
-                            argument_dict=json.loads(arguments)
-                        except Exception as e:
-                            raise e
-                        if argument_dict and isinstance(argument_dict, dict) and "function_name" in argument_dict:
-                            function_name = argument_dict["function_name"]
-                            search_results = " ".join(search_func_def(function_name, structure=self.structure))
-                            if search_results:
-                                search_str_with_file[function_name] = search_results
-                                self.logger.info(f'search result for func {function_name}: {search_results}')
-                            else:
-                                self.logger.info(f'search result for func {function_name}: not found')
+                    if tool_call.function.name not in ("search_string", "search_class_def", "search_func_def"):
+                        continue
+                    try:
+                        arguments = tool_call.function.arguments
+                        argument_dict=json.loads(arguments)
+                    except Exception as e:
+                        raise e
+                    if not argument_dict or not isinstance(argument_dict, dict):
+                        continue
+                    if tool_call.function.name == "search_string" and "query_string" in argument_dict:
+                        query_string = argument_dict["query_string"]
+                        pattern = r"(?i)\b\w*warning\w*\b|\b\w*error\w*\b"
+                        cleaned_text = re.sub(pattern, "", query_string)
+                        cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
+                        searches.append((query_string, "string", "search_string", cleaned_text))
+                    elif tool_call.function.name == "search_class_def" and "class_name" in argument_dict:
+                        class_name = argument_dict["class_name"]
+                        searches.append((class_name, "class", "search_class_def", class_name))
+                    elif tool_call.function.name == "search_func_def" and "function_name" in argument_dict:
+                        function_name = argument_dict["function_name"]
+                        searches.append((function_name, "func", "search_func_def", function_name))
+                # all searches of the turn share one pass over the repository
+                batch_results = search_batch(
+                    [(tool_name, argument) for _, _, tool_name, argument in searches],
+                    structure=self.structure,
+                )
+                for (key, kind, _, _), result in zip(searches, batch_results):
+                    search_results = " ".join(result)
+                    if search_results:
+                        search_str_with_file[key] = search_results
+                        self.logger.info(f'search result for {kind} {key}: {search_results}')
+                    else:
+                        self.logger.info(f'search result for {kind} {key}: not found')
         return search_str_with_file
 
     def localize(
@@ -578,12 +573,10 @@ Return just the locations. Do not include any comments or explanations. Do not f
         element_count = Counter(model_found_files_raw)
         model_found_files = [item for item, count in element_count.most_common()]
 
-        files, classes, functions = get_full_file_paths_and_classes_and_functions(
-            self.structure
-        )
+        path_index = get_repo_index(self.structure).get_path_index()
 
         # sort based on order of appearance in model_found_files
-        found_files = correct_file_paths(model_found_files, files, match_partial_paths)
+        found_files = correct_file_paths(model_found_files, path_index, match_partial_paths)
         found_files = found_files[:top_n]
 
         self.logger.info(raw_outputs)
@@ -596,7 +589,7 @@ Return just the locations. Do not include any comments or explanations. Do not f
         )
 
     def localize_function_from_compressed_files(self, file_names, mock=False, num_samples=1, coverage_info=None, additional_info=None):
-        from patchpilot.util.api_requests import num_tokens_from_messages
+        from patchpilot.util.api_requests import num_tokens_from_messages, num_tokens_from_template
         from patchpilot.util.model import make_model        
         file_contents = get_repo_files(self.structure, file_names)
         coverage_dict = {}
@@ -627,20 +620,34 @@ Return just the locations. Do not include any comments or explanations. Do not f
             self.file_content_in_block_template.format(file_name=fn, file_content=code)
             for fn, code in compressed_file_contents.items()
         ]
-        file_contents = "".join(contents)
         template = (
             self.obtain_relevant_functions_and_vars_from_compressed_files_prompt_more
         )
         message = template.format(
-            problem_statement=self.problem_statement, file_contents=file_contents
+            problem_statement=self.problem_statement, file_contents="".join(contents)
         )
 
-        def message_too_long(message):
+        def message_too_long(contents):
+            # counted from the template, the problem statement and each file block, which
+            # are encoded once across samples and rounds
             return (
-                num_tokens_from_messages(message, self.model_name) >= MAX_CONTEXT_LENGTH
+                num_tokens_from_template(
+                    template,
+                    self.model_name,
+                    problem_statement=self.problem_statement,
+                    file_contents=contents,
+                )
+                >= MAX_CONTEXT_LENGTH
             )
 
-        while message_too_long(message) and len(contents) > 1:
+        if message_too_long(contents):
+            contents = self._fit_compressed_files(
+                file_contents, compressed_file_contents, file_to_delete_functions_start_lines, template
+            )
+            message = template.format(
+                problem_statement=self.problem_statement, file_contents="".join(contents)
+            )
+        while message_too_long(contents) and len(contents) > 1:
             self.logger.info(f"reducing to \n{len(contents)} files")
             contents = contents[:-1]
             file_contents = "".join(contents)
@@ -648,7 +655,7 @@ Return just the locations. Do not include any comments or explanations. Do not f
                 problem_statement=self.problem_statement, file_contents=file_contents
             )  # Recreate message
 
-        if message_too_long(message):
+        if message_too_long(contents):
             raise ValueError(
                 "The remaining file content is too long to fit within the context length"
             )
@@ -713,22 +720,58 @@ Return just the locations. Do not include any comments or explanations. Do not f
 
         return model_found_locs_merged_result, {"raw_output_loc": raw_outputs}, traj
     
+    def _fit_compressed_files(
+        self, file_contents, skeletons, file_to_delete_functions_start_lines, template
+    ):
+        """
+        Compress the files of a prompt that is too long further, see choose_compression_levels.
+        Each file is counted once per level, instead of the prompt once per file left out.
+
+        Returns:
+        the file blocks to put in the prompt, in the order of the files
+        """
+        from patchpilot.util.api_requests import num_tokens, num_tokens_from_template
+
+        budget = MAX_CONTEXT_LENGTH - 1 - num_tokens_from_template(
+            template, self.model_name, problem_statement=self.problem_statement, file_contents=[]
+        )
+        blocks = []
+        token_counts = []
+        for fn, skeleton in skeletons.items():
+            file_blocks = []
+            for level in COMPRESSION_LEVELS:
+                if level == "skeleton":
+                    content = skeleton
+                else:
+                    content = get_compressed_file(
+                        file_contents[fn], level, file_to_delete_functions_start_lines.get(fn, None)
+                    )
+                file_blocks.append(
+                    self.file_content_in_block_template.format(file_name=fn, file_content=content)
+                )
+            blocks.append(file_blocks)
+            token_counts.append([num_tokens(block, self.model_name) for block in file_blocks])
+
+        levels = choose_compression_levels(token_counts, budget)
+        self.logger.info(
+            "compressed the files to fit the context: "
+            + ", ".join(
+                f"{fn} ({'left out' if level is None else COMPRESSION_LEVELS[level]})"
+                for fn, level in zip(skeletons, levels)
+            )
+        )
+        return [
+            file_blocks[level] for file_blocks, level in zip(blocks, levels) if level is not None
+        ]
+
     def localize_line_from_files(
         self,
         file_names,
         num_samples: int = 1,
     ):
-        from patchpilot.util.api_requests import num_tokens_from_messages
+        from patchpilot.util.api_requests import num_tokens, num_tokens_from_template
         from patchpilot.util.model import make_model
 
-        def message_too_long(msg: str) -> bool:
-            return (
-                num_tokens_from_messages(
-                    [{"role": "user", "content": msg}], self.model_name
-                )
-                >= MAX_CONTEXT_LENGTH
-            )
-
         # read repo files
         file_contents = get_repo_files(self.structure, file_names)
 
@@ -747,23 +790,27 @@ Return just the locations. Do not include any comments or explanations. Do not f
                 for idx, line in enumerate(code.splitlines(keepends=True), start=1)
             ]
 
-            # chunk long files
+            # chunk long files, the prompt of a chunk counted as the prompt without its lines
+            # plus the tokens of each line
+            prompt_tokens = num_tokens_from_template(
+                self.obtain_relevant_code_combine_top_n_prompt,
+                self.model_name,
+                problem_statement=self.problem_statement,
+                file_contents=[],
+                last_search_results="",
+            ) + num_tokens_from_template(
+                self.file_content_in_block_template, self.model_name, file_name=fn, file_content=[]
+            )
             chunks, current = [], []
+            chunk_tokens = prompt_tokens
             for line in numbered:
+                line_tokens = num_tokens(line, self.model_name)
+                if current and chunk_tokens + line_tokens >= MAX_CONTEXT_LENGTH:
+                    chunks.append("".join(current))
+                    current = []
+                    chunk_tokens = prompt_tokens
                 current.append(line)
-                content_block = self.file_content_in_block_template.format(
-                    file_name=fn, file_content="".join(current)
-                )
-                prompt = self.obtain_relevant_code_combine_top_n_prompt.format(
-                    problem_statement=self.problem_statement,
-                    file_contents=content_block,
-                    last_search_results="",
-                )
-                if message_too_long(prompt):
-                    last = current.pop()
-                    if current:
-                        chunks.append("".join(current))
-                    current = [last]
+                chunk_tokens += line_tokens
             if current:
                 chunks.append("".join(current))
 
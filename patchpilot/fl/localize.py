@@ -4,10 +4,8 @@ import json
 import os
 import pickle
 from datasets import load_dataset
-from patchpilot.util.preprocess_data import (
-    transfer_arb_locs_to_locs,
-    get_full_file_paths_and_classes_and_functions,
-)
+from patchpilot.util.preprocess_data import transfer_arb_locs_to_locs
+from patchpilot.util.repo_index import RepoStructure, get_repo_index
 
 from patchpilot.fl.FL import LLMFL
 from patchpilot.repair.repair import poc_info_prompt
@@ -23,9 +21,7 @@ from patchpilot.util.utils import (
     setup_logger, ensure_directory_exists,
     coverage_to_dict,
 )
-from get_repo_structure.get_repo_structure import (
-    get_project_structure_from_scratch,
-)
+from patchpilot.util.structure_cache import get_project_structure_cached
 
 # SET THIS IF YOU WANT TO USE THE PREPROCESSED FILES
 PROJECT_STRUCTURE = os.environ.get("PROJECT_STRUCTURE", None)
@@ -55,7 +51,7 @@ def localize_instance(
 
     else:
         # we need to get the project structure directly
-        file_json = get_project_structure_from_scratch(
+        file_json = get_project_structure_cached(
             bug["repo"], bug["base_commit"], bug["instance_id"], "playground"
         )
     if args.repo_graph:
@@ -110,7 +106,8 @@ def localize_instance(
 
     bench_data = [x for x in swe_bench_data if x["instance_id"] == instance_id][0]
     problem_statement = bench_data["problem_statement"]
-    structure = file_json["structure"]
+    # the structure keeps its index, see get_repo_index
+    structure = RepoStructure(file_json["structure"])
 
     filter_none_python(structure)  # some basic filtering steps
 
@@ -271,7 +268,7 @@ def localize_instance(
                     if found_edit_locs[sample_index][i] and isinstance(found_edit_locs[sample_index][i], list) and found_edit_locs[sample_index][i][0] is not None:
                             found_edit_locs_merged[i] += found_edit_locs[sample_index][i][0] + "\n"
 
-        files, _, _ = get_full_file_paths_and_classes_and_functions(structure)
+        index = get_repo_index(structure)
 
         # Construct file contents
         file_contents = dict()
@@ -280,11 +277,10 @@ def localize_instance(
         for i, pred_file in enumerate(pred_files):
             content = None
 
-            for file_content in files:
-                if file_content[0] == pred_file:
-                    content = "\n".join(file_content[1])
-                    file_contents[pred_file] = content
-                    break
+            file_lines = index.get_file_lines(pred_file)
+            if file_lines is not None:
+                content = "\n".join(file_lines)
+                file_contents[pred_file] = content
 
             assert content is not None, f"{pred_file} file not found"
 
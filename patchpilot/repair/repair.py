@@ -13,7 +13,6 @@ from filelock import FileLock
 from patchpilot.repair.bfs import vote_outputs_unwrap, apply_plan_step_by_step
 from patchpilot.util.model import make_model
 from patchpilot.util.preprocess_data import (
-    get_full_file_paths_and_classes_and_functions,
     get_repo_structure,
     transfer_arb_locs_to_locs,
     find_definitions_by_name,
@@ -21,6 +20,7 @@ from patchpilot.util.preprocess_data import (
     find_modified_functions,
     extract_file_content
 )
+from patchpilot.util.repo_index import get_repo_index
 from patchpilot.fl.FL import LLMFL
 from patchpilot.util.utils import load_jsonl, setup_logger
 from patchpilot.repair.utils import post_process_raw_output, post_process_raw_output_refine, construct_topn_file_context
@@ -710,7 +710,7 @@ def process_loc(loc, args, swe_bench_data, prev_generations):
         structure = get_repo_structure(
             instance_id, bench_data["repo"], bench_data["base_commit"], "playground"
         )
-    files,  classes, functions = get_full_file_paths_and_classes_and_functions(structure)
+    index = get_repo_index(structure)
 
     poc_code_prompt = ""
     base_patch_prompt = ""
@@ -848,12 +848,10 @@ def process_loc(loc, args, swe_bench_data, prev_generations):
     # pred_files are the files that we have localized
     for i, pred_file in enumerate(pred_files):
         content = None
-        # files are all files in the repo, index 0 is the file name, index 1 is the content
-        for file_content in files:
-            if file_content[0] == pred_file:
-                content = "\n".join(file_content[1])
-                file_contents[pred_file] = content
-                break
+        file_lines = index.get_file_lines(pred_file)
+        if file_lines is not None:
+            content = "\n".join(file_lines)
+            file_contents[pred_file] = content
 
         assert content is not None, f"{pred_file} file not found"
     
@@ -890,7 +888,8 @@ def process_loc(loc, args, swe_bench_data, prev_generations):
         modified_funcs=find_modified_functions(base_patch_diff, structure)
         modified_funcs_to_callers = {}
         modified_funcs_to_same_name_funcs = {}
-        files, classes, functions = get_full_file_paths_and_classes_and_functions(structure)
+        index = get_repo_index(structure)
+        files = index.files
         if modified_funcs and len(modified_funcs) <= 3:
             for func in modified_funcs:
                 all_callers = find_callers_by_name(func, structure)
@@ -923,12 +922,10 @@ def process_loc(loc, args, swe_bench_data, prev_generations):
         for i, pred_file in enumerate(pred_files):
             content = None
 
-            # files are all files in the repo, index 0 is the file name, index 1 is the content
-            for file_content in files:
-                if file_content[0] == pred_file:
-                    content = "\n".join(file_content[1])
-                    file_contents[pred_file] = content
-                    break
+            file_lines = index.get_file_lines(pred_file)
+            if file_lines is not None:
+                content = "\n".join(file_lines)
+                file_contents[pred_file] = content
 
             assert content is not None, f"{pred_file} file not found"
         file_loc_intervals = {}
@@ -1517,16 +1514,15 @@ def break_tie(args, loc, instance_id, final_patches, min_patches):
     structure = get_repo_structure(
         instance_id, bench_data["repo"], bench_data["base_commit"], "playground"
     )
-    files, _, _ = get_full_file_paths_and_classes_and_functions(structure)
+    index = get_repo_index(structure)
     file_contents = dict()
     for i, pred_file in enumerate(pred_files):
         content = None
 
-        for file_content in files:
-            if file_content[0] == pred_file:
-                content = "\n".join(file_content[1])
-                file_contents[pred_file] = content
-                break
+        file_lines = index.get_file_lines(pred_file)
+        if file_lines is not None:
+            content = "\n".join(file_lines)
+            file_contents[pred_file] = content
 
         assert content is not None, f"{pred_file} file not found"
 
@@ -1,24 +1,79 @@
+import hashlib
+import string
+import threading
 import time
 import json
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Dict, Union
 
 import anthropic
 import openai
 import tiktoken
 
+# token counts kept for the texts counted most recently, a count takes about 200 bytes
+MAX_CACHED_TOKEN_COUNTS = 65536
 
-def num_tokens_from_messages(message, model="gpt-3.5-turbo-0301"):
-    """Returns the number of tokens used by a list of messages."""
+_token_counts = OrderedDict()
+_token_counts_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """Returns the tiktoken encoding of a model, loaded once per model."""
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def num_tokens(text, model="gpt-3.5-turbo-0301"):
+    """Returns the number of tokens of a text, encoding each text once per encoding."""
+    encoding = get_encoding(model)
+    key = (encoding.name, hashlib.sha1(text.encode("utf-8", "surrogatepass")).digest())
+    with _token_counts_lock:
+        count = _token_counts.get(key)
+        if count is not None:
+            _token_counts.move_to_end(key)
+            return count
+    count = len(encoding.encode(text))
+    with _token_counts_lock:
+        _token_counts[key] = count
+        while len(_token_counts) > MAX_CACHED_TOKEN_COUNTS:
+            _token_counts.popitem(last=False)
+    return count
+
+
+def num_tokens_from_fragments(fragments, model="gpt-3.5-turbo-0301"):
+    """
+    Returns the number of tokens of the concatenation of fragments, as the sum of their
+    counts. Tokens merging across the joins can make it a few tokens more than encoding the
+    concatenation, but each fragment is only encoded the first time it is seen.
+    """
+    return sum(num_tokens(fragment, model) for fragment in fragments)
+
+
+def num_tokens_from_template(template, model="gpt-3.5-turbo-0301", **fields):
+    """
+    Returns the number of tokens of template.format(**fields), counting the text of the
+    template and each field as separate fragments, see num_tokens_from_fragments. A field
+    may also be a list of fragments, standing for their concatenation.
+    """
+    fragments = []
+    for literal_text, field_name, _, _ in string.Formatter().parse(template):
+        fragments.append(literal_text)
+        if field_name is not None:
+            value = fields[field_name]
+            fragments.extend([value] if isinstance(value, str) else value)
+    return num_tokens_from_fragments(fragments, model)
+
+
+def num_tokens_from_messages(message, model="gpt-3.5-turbo-0301"):
+    """Returns the number of tokens used by a list of messages."""
     if isinstance(message, list):
         # use last message.
-        num_tokens = len(encoding.encode(message[0]["content"]))
-    else:
-        num_tokens = len(encoding.encode(message))
-    return num_tokens
+        return num_tokens(message[0]["content"], model)
+    return num_tokens(message, model)
 
 
 def create_chatgpt_config(
@@ -1,9 +1,98 @@
+import ast
+import io
+import re
+import tokenize
+
 import libcst as cst
 import libcst.matchers as m
 from typing import Union, List
 from libcst.metadata import PositionProvider, MetadataWrapper
 
 
+class StringCollector(cst.CSTVisitor):
+    """Collect all string literals in a function body into strings."""
+
+    def __init__(self, strings):
+        super().__init__()
+        self.strings = strings
+
+    def visit_SimpleString(self, node: cst.SimpleString):
+        if isinstance(node.evaluated_value, str):
+            if "div>" not in node.evaluated_value and "<div" not in node.evaluated_value and "</div" not in node.evaluated_value:
+                self.strings.append(node.evaluated_value)
+        else:
+            self.strings.append(node.evaluated_value)
+
+    def visit_ConcatenatedString(self, node: cst.ConcatenatedString):
+        # Recursively collect strings
+        node.left.visit(self)
+        node.right.visit(self)
+
+
+class CodeRemover(cst.CSTTransformer):
+    """Remove code logic from a function body, keep only comments and docstrings."""
+
+    def leave_SimpleStatementLine(self, original_node, updated_node):
+        # Keep comments and docstrings
+        has_comment = any(line.comment for line in original_node.leading_lines) or \
+                      original_node.trailing_whitespace.comment
+        is_docstring = (
+                len(original_node.body) == 1 and isinstance(original_node.body[0], cst.Expr) and
+                isinstance(original_node.body[0].value, cst.SimpleString)
+        )
+        if has_comment or is_docstring:
+            return original_node
+        else:
+            # Remove other statements
+            return cst.RemoveFromParent()
+
+    def leave_Assign(self, original_node, updated_node):
+        # Remove assignment statements
+        return cst.RemoveFromParent()
+
+    def leave_AugAssign(self, original_node, updated_node):
+        # Remove augmented assignment statements (e.g., +=)
+        return cst.RemoveFromParent()
+
+    def leave_AnnAssign(self, original_node, updated_node):
+        # Remove annotated assignments
+        return cst.RemoveFromParent()
+
+    def leave_For(self, original_node, updated_node):
+        return cst.RemoveFromParent()
+
+    def leave_While(self, original_node, updated_node):
+        return cst.RemoveFromParent()
+
+    def leave_If(self, original_node, updated_node):
+        return cst.RemoveFromParent()
+
+    def leave_With(self, original_node, updated_node):
+        return cst.RemoveFromParent()
+
+    def leave_Try(self, original_node, updated_node):
+        return cst.RemoveFromParent()
+
+    def leave_FunctionDef(self, original_node, updated_node):
+        # Do not traverse nested functions
+        return original_node
+
+    def leave_ClassDef(self, original_node, updated_node):
+        # Do not traverse nested classes
+        return original_node
+
+    def leave_Return(self, original_node, updated_node):
+        return cst.RemoveFromParent()
+
+    def leave_Expr(self, original_node, updated_node):
+        # Remove expressions unless they are docstrings
+        if isinstance(original_node.value, cst.SimpleString):
+            # Keep docstrings
+            return original_node
+        else:
+            return cst.RemoveFromParent()
+
+
 class CompressTransformer(cst.CSTTransformer):
     DESCRIPTION = str = "Replaces function body with ..."
     replacement_string = '"$$FUNC_BODY_REPLACEMENT_STRING$$"'
@@ -57,83 +146,7 @@ class CompressTransformer(cst.CSTTransformer):
         # Initialize list to collect strings
         strings = []
 
-        # Collect all string literals in the function body
-        class StringCollector(cst.CSTVisitor):
-            def visit_SimpleString(self, node: cst.SimpleString):
-                if isinstance(node.evaluated_value, str):
-                    if "div>" not in node.evaluated_value and "<div" not in node.evaluated_value and "</div" not in node.evaluated_value:
-                        strings.append(node.evaluated_value)
-                else:
-                    strings.append(node.evaluated_value)
-
-            def visit_ConcatenatedString(self, node: cst.ConcatenatedString):
-                # Recursively collect strings
-                node.left.visit(self)
-                node.right.visit(self)
-
-        updated_node.body.visit(StringCollector())
-
-        # Remove code logic, keep only comments and docstrings
-        class CodeRemover(cst.CSTTransformer):
-            def leave_SimpleStatementLine(self, original_node, updated_node):
-                # Keep comments and docstrings
-                has_comment = any(line.comment for line in original_node.leading_lines) or \
-                              original_node.trailing_whitespace.comment
-                is_docstring = (
-                        len(original_node.body) == 1 and isinstance(original_node.body[0], cst.Expr) and
-                        isinstance(original_node.body[0].value, cst.SimpleString)
-                )
-                if has_comment or is_docstring:
-                    return original_node
-                else:
-                    # Remove other statements
-                    return cst.RemoveFromParent()
-
-            def leave_Assign(self, original_node, updated_node):
-                # Remove assignment statements
-                return cst.RemoveFromParent()
-
-            def leave_AugAssign(self, original_node, updated_node):
-                # Remove augmented assignment statements (e.g., +=)
-                return cst.RemoveFromParent()
-
-            def leave_AnnAssign(self, original_node, updated_node):
-                # Remove annotated assignments
-                return cst.RemoveFromParent()
-
-            def leave_For(self, original_node, updated_node):
-                return cst.RemoveFromParent()
-
-            def leave_While(self, original_node, updated_node):
-                return cst.RemoveFromParent()
-
-            def leave_If(self, original_node, updated_node):
-                return cst.RemoveFromParent()
-
-            def leave_With(self, original_node, updated_node):
-                return cst.RemoveFromParent()
-
-            def leave_Try(self, original_node, updated_node):
-                return cst.RemoveFromParent()
-
-            def leave_FunctionDef(self, original_node, updated_node):
-                # Do not traverse nested functions
-                return original_node
-
-            def leave_ClassDef(self, original_node, updated_node):
-                # Do not traverse nested classes
-                return original_node
-
-            def leave_Return(self, original_node, updated_node):
-                return cst.RemoveFromParent()
-
-            def leave_Expr(self, original_node, updated_node):
-                # Remove expressions unless they are docstrings
-                if isinstance(original_node.value, cst.SimpleString):
-                    # Keep docstrings
-                    return original_node
-                else:
-                    return cst.RemoveFromParent()
+        updated_node.body.visit(StringCollector(strings))
 
         # Apply CodeRemover to the function body
         new_body = updated_node.body.visit(CodeRemover())
@@ -213,6 +226,579 @@ class CommentAndStringCollector(cst.CSTVisitor):
         node.right.visit(self)
 
 
+_FUNCTION_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef)
+_DEFINITION_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+_COMPOUND_TYPES = _DEFINITION_TYPES + (
+    ast.If, ast.For, ast.AsyncFor, ast.While, ast.With, ast.AsyncWith, ast.Try, ast.Match,
+) + ((ast.TryStar,) if hasattr(ast, "TryStar") else ())
+# the statements CodeRemover drops from function bodies together with everything inside
+_CONTROL_FLOW_TYPES = (ast.If, ast.For, ast.AsyncFor, ast.While, ast.With, ast.AsyncWith, ast.Try)
+# the small statements CodeRemover drops from one-line function bodies, besides expressions
+_REMOVED_SMALL_TYPES = (ast.Assign, ast.AugAssign, ast.AnnAssign, ast.Return)
+# one string literal token without the f prefix, what libcst parses into a SimpleString
+_SIMPLE_STRING_RE = re.compile(
+    r"""(?is)[rbu]{0,2}(?:'''(?:[^'\\]|\\.|'(?!''))*'''|\"\"\"(?:[^"\\]|\\.|"(?!""))*\"\"\""""
+    r"""|'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*")"""
+)
+_LINE_RE = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+$")
+_NEWLINE_RE = re.compile(r"\r\n?|\n")
+_TRAILING_NEWLINE_RE = re.compile(r"(?:\r\n|\r|\n)\Z")
+
+_DROP, _KEEP, _REBUILD, _RECURSE = range(4)
+
+
+def _keeps_string(value):
+    # StringCollector leaves out HTML fragments
+    if isinstance(value, str):
+        return "div>" not in value and "<div" not in value and "</div" not in value
+    return True
+
+
+def _position(node):
+    return node.lineno, node.col_offset
+
+
+class AstCompressor:
+    """
+    Produces the skeleton of CompressTransformer from an ast parse and the source lines.
+
+    The statements kept are copied line by line from the source, the function and class
+    headers up to their colon, and only the lines libcst generates itself (the strings
+    assignment and the pass of emptied bodies) are rendered here. Blank and comment lines
+    between statements go with the statement or block libcst attaches them to: the lines
+    after a block that are indented at least as deep as it are its footer, the others lead
+    the next statement.
+
+    Statement lines of a rebuilt body are not re-indented as libcst would do when the file
+    mixes indentation widths, the default indentation being used for the generated lines only.
+    """
+
+    def __init__(self, code, keep_constant=True, delete_func_start_lines=None):
+        self.code = code
+        self.keep_constant = keep_constant
+        self.delete_lines = set(delete_func_start_lines or ())
+        self.tree = ast.parse(code)
+        self.lines = _LINE_RE.findall(code)
+        newline = _NEWLINE_RE.search(code)
+        self.newline = newline.group(0) if newline else "\n"
+        self.default_indent = self._detect_indent()
+        # line number of the first line from each line on that is not blank or a comment
+        self.next_code_line = [len(self.lines) + 1] * (len(self.lines) + 2)
+        for lineno in range(len(self.lines), 0, -1):
+            self.next_code_line[lineno] = (
+                self.next_code_line[lineno + 1] if self._is_empty(lineno) else lineno
+            )
+        self._owned_ends = {}
+        self._compressed = {}
+
+    # -- lines and positions --
+
+    def _is_empty(self, lineno):
+        stripped = self.lines[lineno - 1].strip()
+        return not stripped or stripped.startswith("#")
+
+    def _is_comment(self, lineno):
+        return self.lines[lineno - 1].lstrip().startswith("#")
+
+    def _text(self, first, last):
+        return "".join(self.lines[first - 1 : last])
+
+    def _col(self, lineno, byte_col):
+        """Character column of an ast column offset, which counts utf-8 bytes."""
+        line = self.lines[lineno - 1]
+        if line.isascii():
+            return byte_col
+        return len(line.encode("utf-8")[:byte_col].decode("utf-8", "replace"))
+
+    def _slice(self, first_lineno, first_col, last_lineno, last_col):
+        """Source text between two character positions."""
+        if first_lineno == last_lineno:
+            return self.lines[first_lineno - 1][first_col:last_col]
+        return (
+            self.lines[first_lineno - 1][first_col:]
+            + self._text(first_lineno + 1, last_lineno - 1)
+            + self.lines[last_lineno - 1][:last_col]
+        )
+
+    def _segment(self, node):
+        return self._slice(
+            node.lineno,
+            self._col(node.lineno, node.col_offset),
+            node.end_lineno,
+            self._col(node.end_lineno, node.end_col_offset),
+        )
+
+    def _indent_of(self, lineno):
+        line = self.lines[lineno - 1]
+        return line[: len(line) - len(line.lstrip())]
+
+    def _detect_indent(self):
+        # libcst takes the first INDENT token, which opens the first indented block at module level
+        for node in self.tree.body:
+            if isinstance(node, _COMPOUND_TYPES):
+                for block in self._blocks(node):
+                    if not self._is_suite(block):
+                        return self._indent_of(self._start(block[0]))
+        return "    "
+
+    # -- statements and blocks --
+
+    def _start(self, item):
+        node = item[0] if isinstance(item, list) else item
+        if isinstance(node, _DEFINITION_TYPES) and node.decorator_list:
+            return node.decorator_list[0].lineno
+        return node.lineno
+
+    def _blocks(self, node):
+        """The statement lists of a compound statement in source order, elif bodies included."""
+        if isinstance(node, ast.If):
+            orelse = node.orelse
+            if (
+                len(orelse) == 1
+                and isinstance(orelse[0], ast.If)
+                and self.lines[orelse[0].lineno - 1].lstrip().startswith("elif")
+            ):
+                return [node.body] + self._blocks(orelse[0])
+            blocks = [node.body, orelse]
+        elif isinstance(node, (ast.For, ast.AsyncFor, ast.While)):
+            blocks = [node.body, node.orelse]
+        elif isinstance(node, ast.Match):
+            blocks = [case.body for case in node.cases]
+        elif isinstance(node, _COMPOUND_TYPES) and hasattr(node, "handlers"):
+            blocks = [node.body] + [handler.body for handler in node.handlers]
+            blocks += [node.orelse, node.finalbody]
+        else:
+            blocks = [node.body]
+        return [block for block in blocks if block]
+
+    def _is_suite(self, block):
+        """Whether a block is on the line of its header, like the body of `def f(): pass`."""
+        first = block[0]
+        line = self.lines[first.lineno - 1]
+        return bool(line[: self._col(first.lineno, first.col_offset)].strip())
+
+    @staticmethod
+    def _items(block):
+        """Group the simple statements of a block sharing a line, like SimpleStatementLine."""
+        items = []
+        for node in block:
+            if (
+                not isinstance(node, _COMPOUND_TYPES)
+                and items
+                and isinstance(items[-1], list)
+                and items[-1][-1].end_lineno == node.lineno
+            ):
+                items[-1].append(node)
+            elif isinstance(node, _COMPOUND_TYPES):
+                items.append(node)
+            else:
+                items.append([node])
+        return items
+
+    def _owned_end(self, item):
+        """The last line of a statement together with the footers of its blocks."""
+        if isinstance(item, list):
+            return item[-1].end_lineno
+        key = id(item)
+        if key not in self._owned_ends:
+            end = item.end_lineno
+            blocks = self._blocks(item) if isinstance(item, _COMPOUND_TYPES) else []
+            if blocks and not self._is_suite(blocks[-1]):
+                # the footer ends at the last line, before the next code, indented like the block
+                indent = self._indent_of(self._start(blocks[-1][0]))
+                position = self._owned_end(self._items(blocks[-1])[-1]) + 1
+                end = position - 1
+                for lineno in range(position, self.next_code_line[position]):
+                    if self.lines[lineno - 1].startswith(indent):
+                        end = lineno
+            self._owned_ends[key] = end
+        return self._owned_ends[key]
+
+    def _leading_start(self, item):
+        """First leading line of the first statement of a block."""
+        lineno = self._start(item) - 1
+        while lineno >= 1 and self._is_empty(lineno):
+            lineno -= 1
+        return lineno + 1
+
+    def _is_simple_string(self, node):
+        return (
+            isinstance(node, ast.Constant)
+            and isinstance(node.value, (str, bytes))
+            and _SIMPLE_STRING_RE.fullmatch(self._segment(node)) is not None
+        )
+
+    def _is_deleted(self, node):
+        return isinstance(node, _FUNCTION_TYPES) and node.lineno in self.delete_lines
+
+    def _has_trailing_comment(self, node):
+        line = self.lines[node.end_lineno - 1]
+        rest = line[self._col(node.end_lineno, node.end_col_offset) :].lstrip(" \t\x0c")
+        if rest.startswith(";"):
+            rest = rest[1:].lstrip(" \t\x0c")
+        return rest.startswith("#")
+
+    # -- what happens to each statement --
+
+    def _module_fate(self, item, lead):
+        if isinstance(item, list):
+            return _KEEP if self.keep_constant and isinstance(item[0], ast.Assign) else _DROP
+        if isinstance(item, _DEFINITION_TYPES):
+            return _DROP if self._is_deleted(item) else _REBUILD
+        return _DROP
+
+    def _class_fate(self, item, lead):
+        if isinstance(item, list):
+            first = item[0]
+            if isinstance(first, ast.Expr) and self._is_simple_string(first.value):
+                return _DROP
+            return _KEEP
+        return self._verbatim_fate(item, lead)
+
+    def _verbatim_fate(self, item, lead):
+        if isinstance(item, list):
+            return _KEEP
+        if isinstance(item, _DEFINITION_TYPES):
+            return _DROP if self._is_deleted(item) else _REBUILD
+        return _RECURSE
+
+    def _function_fate(self, item, lead):
+        if isinstance(item, list):
+            if any(self._is_comment(lineno) for lineno in range(lead, self._start(item))):
+                return _KEEP
+            if self._has_trailing_comment(item[-1]):
+                return _KEEP
+            if (
+                len(item) == 1
+                and isinstance(item[0], ast.Expr)
+                and self._is_simple_string(item[0].value)
+            ):
+                return _KEEP
+            return _DROP
+        if isinstance(item, _CONTROL_FLOW_TYPES):
+            return _DROP
+        return self._verbatim_fate(item, lead)
+
+    # -- rendering --
+
+    def _render_items(self, items, fate, out, dropped, first_lead=None):
+        """
+        Render the statements of a block, each with its leading lines, into out.
+
+        Arguments:
+        items -- the statements, as from _items
+        fate -- decides, from a statement and its first leading line, what becomes of it
+        out -- list of the text pieces rendered
+        dropped -- receives the ids of the statements left out
+        first_lead -- first leading line of the first statement, by default the line after
+            the last code line before it
+
+        Returns:
+        whether any statement is left
+        """
+        kept = False
+        previous = None
+        for item in items:
+            if previous is not None:
+                lead = self._owned_end(previous) + 1
+            elif first_lead is not None:
+                lead = first_lead
+            else:
+                lead = self._leading_start(item)
+            previous = item
+            item_fate = fate(item, lead)
+            if item_fate == _DROP:
+                dropped.update(map(id, item) if isinstance(item, list) else (id(item),))
+                continue
+            kept = True
+            start = self._start(item)
+            out.append(self._text(lead, start - 1))
+            if item_fate == _KEEP:
+                out.append(self._text(start, self._owned_end(item)))
+            elif item_fate == _REBUILD:
+                out.append(self._compress(item)[0])
+            else:
+                child_fate = self._verbatim_fate if fate == self._class_fate else fate
+                out.append(self._render_kept(item, child_fate, dropped))
+        return kept
+
+    def _render_kept(self, node, fate, dropped):
+        """Render a compound statement as in the source, but with its blocks' statements
+        passed through fate."""
+        out = []
+        cursor = self._start(node)
+        for block in self._blocks(node):
+            if self._is_suite(block):
+                continue
+            items = self._items(block)
+            lead = self._leading_start(items[0])
+            out.append(self._text(cursor, lead - 1))
+            if not self._render_items(items, fate, out, dropped):
+                out.append(self._indent_of(self._start(items[0])) + "pass" + self.newline)
+            cursor = self._owned_end(items[-1]) + 1
+        out.append(self._text(cursor, self._owned_end(node)))
+        return "".join(out)
+
+    def _header(self, node):
+        """The header of a function or class up to its colon, with the newline of the block."""
+        first = node.body[0]
+        colon = None
+        if self._is_suite(node.body):
+            lineno = first.lineno
+            prefix = self.lines[lineno - 1][: self._col(lineno, first.col_offset)].rstrip()
+            if prefix.endswith(":"):
+                colon = lineno, len(prefix) - 1
+        else:
+            lineno = self._start(first) - 1
+            while self._is_empty(lineno):
+                lineno -= 1
+            line = self.lines[lineno - 1]
+            stripped = line.rstrip()
+            if "#" not in line and stripped.endswith(":"):
+                colon = lineno, len(stripped) - 1
+        if colon is None:
+            colon = self._find_colon(node)
+        lineno, col = colon
+        header = self._text(self._start(node), lineno - 1) + self.lines[lineno - 1][: col + 1]
+        return header + self.newline, colon
+
+    def _find_colon(self, node):
+        depth = 0
+        readline = iter(self.lines[node.lineno - 1 :]).__next__
+        for token in tokenize.generate_tokens(readline):
+            if token.type == tokenize.OP:
+                if token.string in "([{":
+                    depth += 1
+                elif token.string in ")]}":
+                    depth -= 1
+                elif token.string == ":" and depth == 0:
+                    return node.lineno + token.start[0] - 1, token.start[1]
+        raise ValueError(f"no colon after the header on line {node.lineno}")
+
+    def _body_line(self, node, text):
+        """A line libcst generates in the body of a rebuilt function or class."""
+        return self._indent_of(node.lineno) + self.default_indent + text + self.newline
+
+    def _small_statements(self, body, colon):
+        """Split a one-line body into its leading whitespace, the text of each small statement
+        with its semicolon, and the whitespace, comment and newline after them."""
+        texts = []
+        for node, following in zip(body, body[1:]):
+            texts.append(
+                self._slice(
+                    node.lineno,
+                    self._col(node.lineno, node.col_offset),
+                    following.lineno,
+                    self._col(following.lineno, following.col_offset),
+                )
+            )
+        last = body[-1]
+        end_col = self._col(last.end_lineno, last.end_col_offset)
+        rest = self.lines[last.end_lineno - 1][end_col:]
+        semicolon = re.match(r"[ \t\x0c]*;", rest)
+        if semicolon:
+            end_col += semicolon.end()
+            rest = rest[semicolon.end() :]
+        texts.append(
+            self._slice(
+                last.lineno, self._col(last.lineno, last.col_offset), last.end_lineno, end_col
+            )
+        )
+        first = body[0]
+        leading = self._slice(
+            colon[0], colon[1] + 1, first.lineno, self._col(first.lineno, first.col_offset)
+        )
+        return leading, texts, rest
+
+    def _compress(self, node):
+        """Return the compressed text of a function or class and the strings StringCollector
+        finds in it."""
+        key = id(node)
+        if key not in self._compressed:
+            if isinstance(node, ast.ClassDef):
+                self._compressed[key] = self._compress_class(node)
+            else:
+                self._compressed[key] = self._compress_function(node)
+        return self._compressed[key]
+
+    def _compress_class(self, node):
+        header, colon = self._header(node)
+        header_strings = self._strings_of(node.decorator_list + node.bases + node.keywords)
+        if self._is_suite(node.body):
+            _, texts, _ = self._small_statements(node.body, colon)
+            return header + "".join(texts), header_strings + self._strings_of(node.body)
+        out = [header]
+        dropped = set()
+        if not self._render_items(self._items(node.body), self._class_fate, out, dropped):
+            out.append(self._body_line(node, "pass"))
+        kept_strings = self._strings_of([child for child in node.body if id(child) not in dropped])
+        return "".join(out), header_strings + kept_strings
+
+    def _compress_function(self, node):
+        header, colon = self._header(node)
+        header_strings = self._strings_of(
+            node.decorator_list + list(ast.iter_child_nodes(node.args)) + [node.returns]
+        )
+        # StringCollector runs on the body after its nested functions and classes are compressed
+        strings = self._strings_of(node.body)
+        out = [header]
+        if strings:
+            assignment = "strings = [" + ", ".join(repr(string) for string in strings) + "]"
+            out.append(self._body_line(node, assignment))
+        if self._is_suite(node.body):
+            leading, texts, trailing = self._small_statements(node.body, colon)
+            kept = [
+                child
+                for child in node.body
+                if not isinstance(child, _REMOVED_SMALL_TYPES)
+                and not (isinstance(child, ast.Expr) and not self._is_simple_string(child.value))
+            ]
+            body = "".join(text for child, text in zip(node.body, texts) if child in kept)
+            out.append(leading + (body or "pass") + trailing)
+        else:
+            dropped = set()
+            if not self._render_items(self._items(node.body), self._function_fate, out, dropped):
+                if not strings:
+                    out.append(self._body_line(node, "pass"))
+            kept = [child for child in node.body if id(child) not in dropped]
+        return "".join(out), header_strings + strings + self._strings_of(kept)
+
+    # -- strings --
+
+    def _strings_of(self, nodes):
+        strings = []
+        for node in nodes:
+            if node is not None:
+                strings.extend(self._node_strings(node))
+        return strings
+
+    def _node_strings(self, node):
+        """The strings StringCollector finds in a node, functions and classes in it compressed."""
+        if isinstance(node, _DEFINITION_TYPES):
+            return [] if self._is_deleted(node) else self._compress(node)[1]
+        if isinstance(node, (ast.Constant, ast.JoinedStr)):
+            if isinstance(node, ast.Constant) and not isinstance(node.value, (str, bytes)):
+                return []
+            return self._literal_strings(node)
+        children = list(ast.iter_child_nodes(node))
+        if all(hasattr(child, "lineno") for child in children):
+            # some fields are not in source order, the defaults of arguments for one
+            children.sort(key=_position)
+        strings = []
+        for child in children:
+            strings.extend(self._node_strings(child))
+        return strings
+
+    def _literal_strings(self, node):
+        segment = self._segment(node)
+        if isinstance(node, ast.Constant) and _SIMPLE_STRING_RE.fullmatch(segment):
+            return [node.value] if _keeps_string(node.value) else []
+        readline = io.StringIO("(" + segment + ")").readline
+        tokens = [
+            token.string
+            for token in tokenize.generate_tokens(readline)
+            if token.type == tokenize.STRING
+        ]
+        return self._concatenation_strings(tokens)
+
+    def _concatenation_strings(self, tokens):
+        # libcst nests implicit concatenations to the right, and StringCollector visits both
+        # sides of each one twice
+        strings = self._token_strings(tokens[0])
+        if len(tokens) > 1:
+            strings = (strings + self._concatenation_strings(tokens[1:])) * 2
+        return strings
+
+    def _token_strings(self, token):
+        prefix = token[: len(token) - len(token.lstrip("rRbBuUfF"))]
+        if "f" not in prefix.lower():
+            value = ast.literal_eval(token)
+            return [value] if _keeps_string(value) else []
+        return _formatted_strings(ast.parse(token, mode="eval").body)
+
+    # -- outlines --
+
+    def outline(self, signatures=True):
+        """
+        The functions and classes of the module, the definitions in classes indented under
+        them. With signatures each is its header up to the colon, else its kind and name.
+        """
+        out = []
+        self._outline(self.tree.body, signatures, out)
+        return "".join(out)
+
+    def _outline(self, body, signatures, out):
+        for node in body:
+            if not isinstance(node, _DEFINITION_TYPES) or self._is_deleted(node):
+                continue
+            if signatures:
+                out.append(self._header(node)[0])
+            else:
+                if isinstance(node, ast.ClassDef):
+                    kind = "class"
+                elif isinstance(node, ast.AsyncFunctionDef):
+                    kind = "async def"
+                else:
+                    kind = "def"
+                out.append(f"{self._indent_of(node.lineno)}{kind} {node.name}{self.newline}")
+            if isinstance(node, ast.ClassDef):
+                self._outline(node.body, signatures, out)
+
+    # -- the skeleton --
+
+    def compress(self):
+        items = self._items(self.tree.body)
+        if not items:
+            return self.code
+        first_start = self._start(items[0])
+        out = [self._text(1, first_start - 1)]
+        self._render_items(items, self._module_fate, out, set(), first_lead=first_start)
+        out.append(self._text(self._owned_end(items[-1]) + 1, len(self.lines)))
+        code = "".join(out)
+        if self._has_trailing_newline():
+            return code or self.newline
+        # libcst leaves out the newline of the last line when the file has none
+        return _TRAILING_NEWLINE_RE.sub("", code)
+
+    def _has_trailing_newline(self):
+        if not self.code.endswith(("\n", "\r")):
+            return False
+        # a backslash continues the last line instead
+        return not self.code.endswith(("\\\n", "\\\r", "\\\r\n"))
+
+
+def _formatted_strings(node):
+    """The strings in the replacement fields of an f-string."""
+    strings = []
+    for value in node.values:
+        if isinstance(value, ast.FormattedValue):
+            found = []
+            stack = [value.value]
+            while stack:
+                child = stack.pop()
+                if isinstance(child, ast.Constant):
+                    if isinstance(child.value, (str, bytes)) and _keeps_string(child.value):
+                        found.append((_position(child), [child.value]))
+                elif isinstance(child, ast.JoinedStr):
+                    found.append((_position(child), _formatted_strings(child)))
+                else:
+                    stack.extend(ast.iter_child_nodes(child))
+            for _, child_strings in sorted(found, key=lambda entry: entry[0]):
+                strings.extend(child_strings)
+            if value.format_spec is not None:
+                strings.extend(_formatted_strings(value.format_spec))
+    return strings
+
+
+def compress_source(
+    raw_code, keep_constant: bool = True, delete_func_start_lines: List[int] = None
+):
+    """The skeleton of compress_module, computed with ast instead of libcst. Raises SyntaxError
+    if the code does not parse."""
+    code = AstCompressor(raw_code, keep_constant, delete_func_start_lines).compress()
+    return _replace_body_placeholder(code)
+
+
 code = """
 \"\"\"
 this is a module
@@ -237,16 +823,75 @@ def test():
 
 """
 
-def get_skeleton(raw_code, keep_constant: bool = True, delete_func_start_lines: List[int] = None):
-    try:
-        tree = cst.parse_module(raw_code)
-    except:
-        return raw_code
+def get_skeleton(
+    raw_code, keep_constant: bool = True, delete_func_start_lines: List[int] = None, backend: str = None
+):
+    # source_model imports this module
+    from patchpilot.util.source_model import get_source_model
+
+    return get_source_model(raw_code).get_skeleton(keep_constant, delete_func_start_lines, backend)
+
 
-    wrapper = MetadataWrapper(tree)
-    
+# the ways a file can be shown, from the most to the least content, see get_compressed_file
+COMPRESSION_LEVELS = ("skeleton", "signatures", "names")
+
+
+def get_compressed_file(
+    raw_code, level: str = "skeleton", delete_func_start_lines: List[int] = None
+):
+    """
+    Return a file compressed to one of COMPRESSION_LEVELS: its skeleton, only the headers of
+    its functions and classes, or only their names. The functions starting on
+    delete_func_start_lines are left out at every level. A file that does not parse keeps its
+    content as skeleton and has no signatures or names.
+    """
+    if level == "skeleton":
+        return get_skeleton(raw_code, True, delete_func_start_lines)
+    if level not in COMPRESSION_LEVELS:
+        raise ValueError(f"Unknown compression level {level}, expected one of {COMPRESSION_LEVELS}")
+    try:
+        compressor = AstCompressor(raw_code, delete_func_start_lines=delete_func_start_lines)
+        return compressor.outline(signatures=level == "signatures")
+    except (SyntaxError, ValueError, RecursionError, tokenize.TokenError):
+        return ""
+
+
+def choose_compression_levels(token_counts: List[List[int]], budget: int):
+    """
+    Pick a compression level for each file so that together they fit in a token budget. As
+    many files as fit are taken at their smallest level, in order, then the files are
+    raised, in order, each to the largest level the budget still allows. The earlier files
+    are the more relevant: they are compressed the least and the last left out.
+
+    Arguments:
+    token_counts -- for each file, its token counts at each level, the largest level first
+    budget -- the tokens all files may take
+
+    Returns:
+    for each file, the index of its level, or None if it is left out. The first file is
+    always kept, even if it does not fit
+    """
+    levels = []
+    used = 0
+    for counts in token_counts:
+        if levels and used + counts[-1] > budget:
+            break
+        levels.append(len(counts) - 1)
+        used += counts[-1]
+    for i, level in enumerate(levels):
+        counts = token_counts[i]
+        for larger in range(level):
+            if used - counts[level] + counts[larger] <= budget:
+                used += counts[larger] - counts[level]
+                levels[i] = larger
+                break
+    return levels + [None] * (len(token_counts) - len(levels))
+
+
+def compress_module(wrapper: MetadataWrapper, keep_constant: bool = True, delete_func_start_lines: List[int] = None):
+    """Return the skeleton of a parsed module, see get_skeleton."""
     # Step 1: Collect functions to delete
-    collector = FunctionCollector(delete_func_start_lines)
+    collector = FunctionCollector(delete_func_start_lines or [])
     wrapper.visit(collector)
     functions_to_delete_nodes = collector.functions_to_delete
 
@@ -256,7 +901,10 @@ def get_skeleton(raw_code, keep_constant: bool = True, delete_func_start_lines:
         functions_to_delete=functions_to_delete_nodes
     )
     modified_tree = wrapper.visit(transformer)
-    code = modified_tree.code
+    return _replace_body_placeholder(modified_tree.code)
+
+
+def _replace_body_placeholder(code):
     code = code.replace(CompressTransformer.replacement_string + "\n", "...\n")
     code = code.replace(CompressTransformer.replacement_string, "...\n")
     return code
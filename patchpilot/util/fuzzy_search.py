@@ -0,0 +1,162 @@
+import multiprocessing
+import os
+import time
+from collections import Counter
+
+from fuzzysearch import find_near_matches
+
+# number of processes aligning a fuzzy query against the files, 1 aligns in the calling thread.
+# The searches already run from the threads of the localization loops, so it is off by default
+FUZZY_SEARCH_WORKERS = int(os.environ.get("FUZZY_SEARCH_WORKERS", 1))
+# seconds the worker processes may spend on one fuzzy query, the files they have not aligned
+# by then are aligned in the calling thread
+FUZZY_SEARCH_TIMEOUT = float(os.environ.get("FUZZY_SEARCH_TIMEOUT", 120))
+# below this many characters to align, starting the worker processes costs more than it saves
+MIN_PARALLEL_CHARS = 256 * 1024
+
+
+def choose_qgram_filters(query, max_l_dist):
+    """
+    Every edit destroys at most q of the q-grams of the query, so a substring within
+    max_l_dist edits of it still shares len(query) - q + 1 - max_l_dist * q of them.
+
+    Returns:
+    list of (q, threshold) for the q-gram lengths giving a positive threshold, longest first
+    """
+    filters = []
+    for q in (3, 2, 1):
+        threshold = len(query) - q + 1 - max_l_dist * q
+        if threshold >= 1:
+            filters.append((q, threshold))
+    return filters
+
+
+def _query_qgrams(query, q):
+    return Counter(query[j : j + q] for j in range(len(query) - q + 1))
+
+
+def filter_by_qgram_presence(content_index, query, qgram_filters):
+    """Return the indices of the files holding at least threshold of the q-grams of query,
+    counted as often as query has them, for every (q, threshold) whose q-grams are already
+    indexed, in file order. The other filters are left to has_qgram_window."""
+    candidates = range(len(content_index.paths))
+    for q, threshold in qgram_filters:
+        if q == 1 or not content_index.has_qgram_files(q):
+            # every file has most characters, checking the windows is cheaper than an index,
+            # and one query does not pay for building one
+            continue
+        counts = [0] * len(content_index.paths)
+        qgram_files = content_index.get_qgram_files(q)
+        for qgram, multiplicity in _query_qgrams(query, q).items():
+            for i in qgram_files.get(qgram, ()):
+                counts[i] += multiplicity
+        candidates = [i for i in candidates if counts[i] >= threshold]
+    return candidates
+
+
+def has_qgram_window(content, query_qgrams, span, threshold):
+    """
+    Whether some q-grams of content, starting at most span characters apart, share threshold
+    q-grams with the query. Each q-gram counts at most as often as it is in the query.
+
+    Arguments:
+    content -- text to check
+    query_qgrams -- Counter of the q-grams of the query
+    span -- largest distance between the starts of two q-grams of one match
+    threshold -- shared q-grams needed
+    """
+    occurrences = []
+    for qgram_id, qgram in enumerate(query_qgrams):
+        position = content.find(qgram)
+        while position != -1:
+            occurrences.append((position, qgram_id))
+            position = content.find(qgram, position + 1)
+    if len(occurrences) < threshold:
+        return False
+    occurrences.sort()
+
+    limits = list(query_qgrams.values())
+    in_window = [0] * len(limits)
+    shared = 0
+    left = 0
+    for position, qgram_id in occurrences:
+        while occurrences[left][0] < position - span:
+            left_id = occurrences[left][1]
+            in_window[left_id] -= 1
+            if in_window[left_id] < limits[left_id]:
+                shared -= 1
+            left += 1
+        if in_window[qgram_id] < limits[qgram_id]:
+            shared += 1
+        in_window[qgram_id] += 1
+        if shared >= threshold:
+            return True
+    return False
+
+
+def _count_near_matches(task):
+    i, content, query, max_l_dist, qgram_filters = task
+    for q, threshold in qgram_filters:
+        # a match is at most len(query) + max_l_dist long
+        span = len(query) + max_l_dist - q
+        if not has_qgram_window(content, _query_qgrams(query, q), span, threshold):
+            return i, 0
+    return i, len(find_near_matches(query, content, max_l_dist=max_l_dist))
+
+
+def fuzzy_search(content_index, query, max_l_dist, num_workers=None, timeout=None):
+    """
+    Count the matches of find_near_matches(query, content, max_l_dist) in every file of a
+    ContentIndex. Files that cannot contain a match by q-gram counting are skipped, first
+    with the index if it is built, then by sliding a window over the q-grams of each file, and
+    the alignment of the rest is spread over a process pool.
+
+    Arguments:
+    content_index -- ContentIndex of the files to search
+    query -- the string to search for
+    max_l_dist -- the largest Levenshtein distance of a match
+    num_workers -- number of processes aligning, defaults to FUZZY_SEARCH_WORKERS
+    timeout -- seconds the workers may spend aligning, defaults to FUZZY_SEARCH_TIMEOUT. The
+        files they have not aligned by then are aligned in the calling thread, every file is
+        always searched
+
+    Returns:
+    list of (file path, number of matches) of the files with matches, the most matches first
+    and in file order on ties
+    """
+    num_workers = FUZZY_SEARCH_WORKERS if num_workers is None else num_workers
+    timeout = FUZZY_SEARCH_TIMEOUT if timeout is None else timeout
+    qgram_filters = choose_qgram_filters(query, max_l_dist)
+    candidates = filter_by_qgram_presence(content_index, query, qgram_filters)
+    tasks = [
+        (i, content_index.contents[i], query, max_l_dist, qgram_filters) for i in candidates
+    ]
+
+    counts = {}
+    deadline = time.monotonic() + timeout
+    num_workers = min(num_workers, len(tasks))
+    if num_workers > 1 and sum(len(task[1]) for task in tasks) >= MIN_PARALLEL_CHARS:
+        # the largest files first, so that no worker is left aligning one at the end
+        tasks.sort(key=lambda task: len(task[1]), reverse=True)
+        # forkserver: search_string is called from thread pools, forking those is unsafe
+        with multiprocessing.get_context("forkserver").Pool(num_workers) as pool:
+            results = pool.imap_unordered(_count_near_matches, tasks)
+            try:
+                for _ in tasks:
+                    i, count = results.next(timeout=max(deadline - time.monotonic(), 0))
+                    counts[i] = count
+            except multiprocessing.TimeoutError:
+                pass
+        # leaving the pool terminates the workers still aligning
+        if len(counts) < len(tasks):
+            print(
+                f"Fuzzy search for '{query}' ran out of its {timeout}s budget in the workers, "
+                f"aligning the {len(tasks) - len(counts)} remaining files here"
+            )
+    for task in tasks:
+        if task[0] not in counts:
+            i, count = _count_near_matches(task)
+            counts[i] = count
+
+    matches = sorted((i for i, count in counts.items() if count), key=lambda i: (-counts[i], i))
+    return [(content_index.paths[i], counts[i]) for i in matches]
@@ -3,8 +3,14 @@ from libcst.metadata import PositionProvider
 from libcst.metadata import MetadataWrapper
 
 def get_function_interval(file_content):
-    module = cst.parse_module(file_content)
-    wrapper = MetadataWrapper(module)
+    # source_model imports this module
+    from patchpilot.util.source_model import get_source_model
+
+    return dict(get_source_model(file_content).get_function_intervals())
+
+
+def collect_function_intervals(wrapper: MetadataWrapper):
+    """Return {function name: (start line, end line)} of a parsed module, see get_function_interval."""
 
     class FunctionCollector(cst.CSTVisitor):
         METADATA_DEPENDENCIES = (PositionProvider,)
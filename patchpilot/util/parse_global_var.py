@@ -22,13 +22,16 @@ class GlobalVariableVisitor(cst.CSTVisitor):
 
 
 def parse_global_var_from_code(file_content: str) -> dict[str, dict]:
-    """Parse global variables."""
-    try:
-        tree = cst.parse_module(file_content)
-    except:
-        return file_content
+    """Parse global variables. Results are shared by every caller passing the same content,
+    they must not be modified."""
+    # source_model imports this module
+    from patchpilot.util.source_model import get_source_model
 
-    wrapper = cst.metadata.MetadataWrapper(tree)
+    return get_source_model(file_content).get_global_vars()
+
+
+def collect_global_vars(wrapper: cst.metadata.MetadataWrapper) -> dict[str, dict]:
+    """Return the line range of every global variable of a parsed module."""
     visitor = GlobalVariableVisitor()
     wrapper.visit(visitor)
 
@@ -1,13 +1,22 @@
 import json
 import os
 import re
-from collections import defaultdict
+from bisect import bisect_right
+from collections import defaultdict, namedtuple
+from functools import lru_cache
 
 from patchpilot.util.parse_global_var import parse_global_var_from_code
-from get_repo_structure.get_repo_structure import (
-    get_project_structure_from_scratch,
-    parse_python_file,
+from patchpilot.util.structure_cache import get_project_structure_cached
+from patchpilot.util.source_model import get_source_model
+from patchpilot.util.repo_index import (
+    IDENTIFIER_PATTERN,
+    PathIndex,
+    RepoIndex,
+    RepoStructure,
+    get_repo_index,
+    invalidate_repo_index,
 )
+from get_repo_structure.get_repo_structure import compact_structure
 
 
 def is_scope(line):
@@ -23,32 +32,71 @@ def get_func_name(line):
 def get_indent_level(line):
     return len(line) - len(line.lstrip())
 
-def get_extended_context_intervals(context_intervals, content):
+# lines, function spans and sticky scroll scopes of a file content, see get_content_layout
+ContentLayout = namedtuple(
+    "ContentLayout", ["lines", "function_starts", "function_ends", "scope_stacks"]
+)
+
+
+@lru_cache(maxsize=128)
+def get_content_layout(content):
+    """
+    Analyze a file content in one pass and cache the result, the same files are rendered
+    again and again while building prompts.
+
+    Returns a ContentLayout with:
+    - lines: content.split("\n")
+    - function_starts, function_ends: line indices of the functions found by the "def" heuristic
+      of get_extended_context_intervals. A function ends where the next one starts, so the spans
+      are sorted and disjoint.
+    - scope_stacks: for every line, the (line index, indent level) of the class and function
+      lines shown as sticky scroll headers once that line is reached
+    """
     lines = content.split("\n")
-    functions = []
-    current_func = None
+    function_starts = []
+    function_ends = []
     current_indent_level = None
+    scope_stacks = []
+    scopes = ()
 
-    # Identify all functions in the content
     for i, line in enumerate(lines):
+        # Identify all functions in the content
         if is_func_def(line):
-            if current_func:
+            if current_indent_level is not None:
                 # If a new function starts, the previous one ends
-                current_func['end_line'] = i - 1
-                functions.append(current_func)
+                function_ends.append(i - 1)
             # Start a new function
             current_indent_level = get_indent_level(line)
-            current_func = {'name': get_func_name(line), 'start_line': i, 'end_line': None}
-        elif current_func and line.strip() and get_indent_level(line) <= current_indent_level: 
+            function_starts.append(i)
+        elif current_indent_level is not None and line.strip() and get_indent_level(line) <= current_indent_level:
             # If there is a smaller indent, the function ends
-            current_func['end_line'] = i - 1
-            functions.append(current_func)
-            current_func = None
-
-    if current_func:
+            function_ends.append(i - 1)
+            current_indent_level = None
+
+        if is_scope(line):
+            indent_level = len(line) - len(line.lstrip())
+            while scopes and scopes[-1][1] >= indent_level:
+                scopes = scopes[:-1]
+            scopes = scopes + ((i, indent_level),)
+        # lines without a scope share the tuple of the line before
+        scope_stacks.append(scopes)
+
+    if current_indent_level is not None:
         # If there's a function still open at the end, close it
-        current_func['end_line'] = len(lines) - 1
-        functions.append(current_func)
+        function_ends.append(len(lines) - 1)
+    return ContentLayout(lines, function_starts, function_ends, scope_stacks)
+
+
+def get_extended_context_intervals(context_intervals, content):
+    layout = get_content_layout(content)
+
+    def find_function(line):
+        # the spans are disjoint, only the last one starting before the line can contain it
+        i = bisect_right(layout.function_starts, line) - 1
+        if i >= 0 and line <= layout.function_ends[i]:
+            return i
+        return None
+
     extended_context_intervals = []
 
     for interval in context_intervals:
@@ -57,16 +105,14 @@ def get_extended_context_intervals(context_intervals, content):
         extended_max_line = max_line
 
         # Find the function that wraps the interval's min_line
-        for func in functions:
-            if func['start_line'] <= min_line <= func['end_line']:
-                extended_min_line = func['start_line']
-                break
+        func = find_function(min_line)
+        if func is not None:
+            extended_min_line = layout.function_starts[func]
 
         # Find the function that wraps the interval's max_line
-        for func in functions:
-            if func['start_line'] <= max_line <= func['end_line']:
-                extended_max_line = func['end_line']
-                break
+        func = find_function(max_line)
+        if func is not None:
+            extended_max_line = layout.function_ends[func]
 
         extended_context_intervals.append((extended_min_line, extended_max_line))
     return extended_context_intervals
@@ -81,7 +127,8 @@ def line_wrap_content(
 ):
     """add n| to each line, where n increases"""
 
-    lines = content.split("\n")
+    layout = get_content_layout(content)
+    lines = layout.lines
     if context_intervals is None or context_intervals == []:
         context_intervals = [(0, len(lines))]
     
@@ -93,59 +140,54 @@ def line_wrap_content(
             context_intervals[i] = extended_context_intervals[i]
 
     new_lines = []
-    prev_scopes = []
+    prev_scopes = ()
     line_format = "{line}"
     if not no_line_number:
         line_format = (
             "{line_number}|{line}" if not add_space else "{line_number}| {line} "
         )
+    # only the lines of each interval are visited, the scopes around them come from the layout
     for interval in context_intervals:
         min_line, max_line = interval
 
         if min_line != 0:
             new_lines.append("...")
 
-        scopes = []
-        for i, line in enumerate(lines):
-            if sticky_scroll:
-                # add current line to scope if necessary
-                if is_scope(line): # get the definition line of class or function, append this line at the start of the retrieved code 
-                    indent_level = len(line) - len(line.lstrip())
-                    while scopes and scopes[-1]["indent_level"] >= indent_level:
-                        scopes.pop()
-                    scopes.append(
-                        {"line": line, "line_number": i, "indent_level": indent_level}
-                    )
-
-            if min_line != -1 and i < min_line - 1:
-                continue
-            if sticky_scroll and i == min_line - 1:
-                # add scope lines
-                last_scope_line = None
-                for j, scope_line in enumerate(scopes):
-                    # don't repeat previous scopes
-                    if (
-                        len(prev_scopes) > j
-                        and prev_scopes[j]["line_number"] == scope_line["line_number"]
-                    ):
-                        continue
-                    # don't repeat current line
-                    if i == scope_line["line_number"]:
-                        continue
-                    new_lines.append(
-                        line_format.format(
-                            line_number=scope_line["line_number"] + 1,
-                            line=scope_line["line"],
-                        )
+        # lines min_line to max_line (1-based), at least one line unless the interval starts
+        # after the end of the file
+        first = max(min_line - 1, 0)
+        last = len(lines) - 1
+        if max_line != -1:
+            last = min(max(first, max_line - 1), last)
+
+        if sticky_scroll and 0 <= min_line - 1 < len(lines):
+            # add scope lines
+            i = min_line - 1
+            last_scope_line = None
+            for j, (scope_line_number, _) in enumerate(layout.scope_stacks[i]):
+                # don't repeat previous scopes
+                if (
+                    len(prev_scopes) > j
+                    and prev_scopes[j][0] == scope_line_number
+                ):
+                    continue
+                # don't repeat current line
+                if i == scope_line_number:
+                    continue
+                new_lines.append(
+                    line_format.format(
+                        line_number=scope_line_number + 1,
+                        line=lines[scope_line_number],
                     )
-                    last_scope_line = scope_line["line_number"]
-                if last_scope_line is not None and last_scope_line < i - 1:
-                    new_lines.append("...")
+                )
+                last_scope_line = scope_line_number
+            if last_scope_line is not None and last_scope_line < i - 1:
+                new_lines.append("...")
 
-            new_lines.append(line_format.format(line_number=i + 1, line=line))
-            if max_line != -1 and i >= max_line - 1:
-                break
-        prev_scopes = scopes
+        for i in range(first, last + 1):
+            new_lines.append(line_format.format(line_number=i + 1, line=lines[i]))
+        if sticky_scroll:
+            prev_scopes = layout.scope_stacks[last]
 
     if max_line != len(lines):
         new_lines.append("...")
@@ -188,7 +230,9 @@ def transfer_arb_locs_to_locs(
     file_content="",
 ) -> tuple[list, list]:
     if structure is None:
-        class_info, function_names, file_lines, imports, import_interval = parse_python_file("", file_content)
+        class_info, function_names, file_lines, imports, import_interval = (
+            get_source_model(file_content).get_definitions()
+        )
         structure = {}
         structure[pred_file] = {
             "classes": class_info,
@@ -197,15 +241,12 @@ def transfer_arb_locs_to_locs(
             "imports": imports,
             "import_interval": import_interval,
         }
+        # a one file structure, not worth keeping around
+        index = RepoIndex(structure)
+    else:
+        index = get_repo_index(structure)
 
-    files, classes, functions = get_full_file_paths_and_classes_and_functions(structure)
-    imports = []
-    import_interval = []
-    for file in files:
-        if file[0] == pred_file:
-            imports = file[2]
-            import_interval = file[3]
-            break
+    imports, import_interval = index.get_file_imports(pred_file)
 
     used_globals = []
 
@@ -223,17 +264,13 @@ def transfer_arb_locs_to_locs(
             # handle cases like "class: MyClass.my_method"
             if loc.startswith("class: ") and "." not in loc:
                 loc = loc[len("class: ") :].strip()
-                relevant_class = [
-                    clazz
-                    for clazz in classes
-                    if clazz["file"] == pred_file and clazz["name"] == loc
-                ]
+                relevant_class = index.get_class(pred_file, loc)
 
-                if len(relevant_class) == 0:
+                if relevant_class is None:
                     print(f"{loc} class could not be found")
                 else:
                     line_loc.append(
-                        (relevant_class[0]["start_line"], relevant_class[0]["end_line"])
+                        (relevant_class["start_line"], relevant_class["end_line"])
                     )
                     current_class_name = loc
 
@@ -246,52 +283,31 @@ def transfer_arb_locs_to_locs(
                     method_name = loc.split(".")[1]
                     class_name = loc.split(".")[0]
 
-                    relevant_class = [
-                        clazz
-                        for clazz in classes
-                        if clazz["file"] == pred_file and clazz["name"] == class_name
-                    ]
-                    if len(relevant_class) == 0:
+                    if index.get_class(pred_file, class_name) is None:
                         print(f"{class_name} class could not be found")
                     else:
-                        relevant_method = [
-                            method
-                            for method in relevant_class[0]["methods"]
-                            if method["name"] == method_name
-                        ]
-                        if len(relevant_method) == 0:
+                        relevant_method = index.get_method(pred_file, class_name, method_name)
+                        if relevant_method is None:
                             print(f"{full_loc} method could not be found")
                         else:
                             line_loc.append(
                                 (
-                                    relevant_method[0]["start_line"],
-                                    relevant_method[0]["end_line"],
+                                    relevant_method["start_line"],
+                                    relevant_method["end_line"],
                                 )
                             )
-                            used_globals.extend(relevant_method[0]["used_globals"])
+                            used_globals.extend(relevant_method["used_globals"])
 
                 else:
-                    relevant_function = [
-                        function
-                        for function in functions
-                        if function["file"] == pred_file and function["name"] == loc
-                    ]
-                    if len(relevant_function) == 0:
+                    relevant_function = index.get_function(pred_file, loc)
+                    if relevant_function is None:
                         print(f"{loc} function could not be found")
                         if current_class_name != "":
                             # check if its a method
-                            relevant_class = [
-                                clazz
-                                for clazz in classes
-                                if clazz["file"] == pred_file
-                                and clazz["name"] == current_class_name
-                            ]
-                            relevant_method = [
-                                method
-                                for method in relevant_class[0]["methods"]
-                                if method["name"] == loc
-                            ]
-                            if len(relevant_method) == 0:
+                            relevant_method = index.get_method(
+                                pred_file, current_class_name, loc
+                            )
+                            if relevant_method is None:
                                 print(f"{loc} method could not be found")
                                 # print([method for method in relevant_class[0]['methods']])
                                 #
@@ -302,23 +318,14 @@ def transfer_arb_locs_to_locs(
                             else:
                                 line_loc.append(
                                     (
-                                        relevant_method[0]["start_line"],
-                                        relevant_method[0]["end_line"],
+                                        relevant_method["start_line"],
+                                        relevant_method["end_line"],
                                     )
                                 )
-                                used_globals.extend(relevant_method[0]["used_globals"])
+                                used_globals.extend(relevant_method["used_globals"])
                         else:
                             # look for it in any class
-                            relevant_method = []
-                            for clazz in classes:
-                                if clazz["file"] == pred_file:
-                                    relevant_method.extend(
-                                        [
-                                            method
-                                            for method in clazz["methods"]
-                                            if method["name"] == loc
-                                        ]
-                                    )
+                            relevant_method = index.get_methods_in_file(pred_file, loc)
 
                             if len(relevant_method) == 1:
                                 line_loc.append(
@@ -331,11 +338,11 @@ def transfer_arb_locs_to_locs(
                     else:
                         line_loc.append(
                             (
-                                relevant_function[0]["start_line"],
-                                relevant_function[0]["end_line"],
+                                relevant_function["start_line"],
+                                relevant_function["end_line"],
                             )
                         )
-                        used_globals.extend(relevant_function[0]["used_globals"])
+                        used_globals.extend(relevant_function["used_globals"])
             elif loc.startswith("line: "):
                 if remove_line:
                     # TODO: can recover the corresponding function instead of throwing it away
@@ -374,10 +381,7 @@ def transfer_arb_locs_to_locs(
     # TODO: think of strategies to do bunched up lines
     # TODO: e.g., we can have multiple code segments (right now, its just one)
 
-    for file_content in files:
-        if file_content[0] == pred_file:
-            content = file_content[1]
-            break
+    content = index.get_file_lines(pred_file)
 
     if len(line_loc) == 0:
         return [], [], [], []
@@ -471,14 +475,17 @@ def show_project_structure(structure, spacing=0) -> str:
 
 def filter_out_test_files(structure):
     """filter out test files from the project structure"""
+    invalidate_repo_index(structure)
     for key, value in list(structure.items()):
         if key.startswith("test"):
             del structure[key]
-        elif isinstance(value, dict):
+        elif isinstance(value, dict) and not "classes" in value:
+            # file entries hold no directories, looking into them would parse lazy ones
             filter_out_test_files(value)
 
 
 def filter_none_python(structure):
+    invalidate_repo_index(structure)
     for key, value in list(structure.items()):
         try:
             if (
@@ -523,15 +530,11 @@ def filter_proposed_files(proposed_files, repo_structure):
     filtered_files = []
     for instance_id, files in instance_to_files.items():
         if instance_id in instance_to_structure:
-            repo_files, _, _ = get_full_file_paths_and_classes_and_functions(
-                instance_to_structure[instance_id]
-            )
-            repo_files_set = set(repo_files)
+            path_index = get_repo_index(instance_to_structure[instance_id]).get_path_index()
             valid_files = []
-            for repo_file in repo_files_set:
-                for proposed_file in files:
-                    if proposed_file == repo_file.split("/")[-1]:
-                        valid_files.append(repo_file)
+            for proposed_file in files:
+                # every repository file with the proposed file name
+                valid_files.extend(path_index.find_by_basename(proposed_file))
             if valid_files:
                 filtered_files.append(
                     {"instance_id": instance_id, "files": valid_files}
@@ -559,9 +562,7 @@ def filter_proposed_classes(proposed_classes, repo_structure):
     filtered_classes = []
     for instance_id, classes in instance_to_classes.items():
         if instance_id in instance_to_structure:
-            _, repo_classes, _ = get_full_file_paths_and_classes_and_functions(
-                instance_to_structure[instance_id]
-            )
+            repo_classes = get_repo_index(instance_to_structure[instance_id]).classes
             repo_classes_set = {clazz["name"]: clazz["file"] for clazz in repo_classes}
             valid_classes = []
             for proposed_class in classes:
@@ -599,9 +600,7 @@ def filter_proposed_methods(proposed_methods, repo_structure):
     filtered_methods = []
     for instance_id, methods in instance_to_methods.items():
         if instance_id in instance_to_structure:
-            _, repo_classes, _ = get_full_file_paths_and_classes_and_functions(
-                instance_to_structure[instance_id]
-            )
+            repo_classes = get_repo_index(instance_to_structure[instance_id]).classes
             valid_methods = []
             for repo_class in repo_classes:
                 for method in methods:
@@ -640,9 +639,7 @@ def filter_proposed_functions(proposed_functions, repo_structure):
     filtered_functions = []
     for instance_id, functions in instance_to_functions.items():
         if instance_id in instance_to_structure:
-            _, _, repo_functions = get_full_file_paths_and_classes_and_functions(
-                instance_to_structure[instance_id]
-            )
+            repo_functions = get_repo_index(instance_to_structure[instance_id]).functions
             valid_functions = []
             for repo_function in repo_functions:
                 for function in functions:
@@ -660,6 +657,32 @@ def filter_proposed_functions(proposed_functions, repo_structure):
     return filtered_functions
 
 
+class LazySymbol(dict):
+    """A function of a compact structure (see create_structure). Its "text" is not stored,
+    it is sliced from the lines of its file when first accessed."""
+
+    __slots__ = ("_file_lines",)
+
+    def __init__(self, symbol, file_lines):
+        super().__init__(symbol)
+        self._file_lines = file_lines
+
+    def __missing__(self, key):
+        if key != "text":
+            raise KeyError(key)
+        text = self._file_lines[self["start_line"] - 1 : self["end_line"]]
+        self["text"] = text
+        return text
+
+    def __contains__(self, key):
+        return key == "text" or super().__contains__(key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+
 def get_full_file_paths_and_classes_and_functions(structure, current_path=""):
     """
     Recursively retrieve all file paths, classes, and functions within a directory structure.
@@ -720,6 +743,8 @@ def get_full_file_paths_and_classes_and_functions(structure, current_path=""):
                         )
                 if "functions" in content:
                     for function in content["functions"]:
+                        if "text" not in function:
+                            function = LazySymbol(function, content["text"])
                         function["file"] = next_path
                         functions.append(function)
         else:
@@ -729,6 +754,32 @@ def get_full_file_paths_and_classes_and_functions(structure, current_path=""):
     return files, classes, functions
 
 
+def is_file_entry(content):
+    """Same test as get_full_file_paths_and_classes_and_functions for telling a parsed file from a directory."""
+    return (
+        "functions" in content
+        or "classes" in content
+        or "text" in content
+        or "imports" in content
+        or "import_interval" in content
+    ) and len(content) == 5
+
+
+def iter_python_files(structure, current_path=""):
+    """
+    Yield (file path, file entry) for every parsed file, in the order of
+    get_full_file_paths_and_classes_and_functions, without flattening classes and functions.
+    Entries of lazy structures are only parsed once the caller uses them.
+    """
+    for name, content in structure.items():
+        if isinstance(content, dict):
+            next_path = f"{current_path}/{name}" if current_path else name
+            if is_file_entry(content):
+                yield next_path, content
+            else:
+                yield from iter_python_files(content, next_path)
+
+
 def find_definitions_by_name(target_name, structure):
     """
     Given a target function or method name, return all definitions (file, start_line, end_line).
@@ -741,127 +792,120 @@ def find_definitions_by_name(target_name, structure):
     - List of dicts with keys: 'name', 'file', 'start_line', 'end_line', 'type' ('function' or 'method')
     """
     results = []
-    _, classes, functions = get_full_file_paths_and_classes_and_functions(structure)
+    index = get_repo_index(structure)
 
     # Search free functions
-    for fn in functions:
-        if fn.get("name") == target_name:
-            results.append({
-                "type": "function",
-                "name": target_name,
-                "file": fn.get("file"),
-                "start_line": fn.get("start_line"),
-                "end_line": fn.get("end_line"),
-            })
+    for fn in index.find_functions(target_name):
+        results.append({
+            "type": "function",
+            "name": target_name,
+            "file": fn.get("file"),
+            "start_line": fn.get("start_line"),
+            "end_line": fn.get("end_line"),
+        })
 
     # Search methods inside classes
-    for cls in classes:
-        for method in cls.get("methods", []):
-            if method.get("name") == target_name:
-                results.append({
-                    "type": "method",
-                    "class": cls.get("name"),
-                    "name": target_name,
-                    "file": cls.get("file"),
-                    "start_line": method.get("start_line"),
-                    "end_line": method.get("end_line"),
-                })
+    for cls, method in index.find_methods(target_name):
+        results.append({
+            "type": "method",
+            "class": cls.get("name"),
+            "name": target_name,
+            "file": cls.get("file"),
+            "start_line": method.get("start_line"),
+            "end_line": method.get("end_line"),
+        })
 
     return results
 
 
 def find_callers_by_name(target_name, structure):
-    files, classes, functions = get_full_file_paths_and_classes_and_functions(structure)
+    index = get_repo_index(structure)
     callers = []
     seen = set()
-    # Iterate through files with content
-    for entry in files:
-        if isinstance(entry, tuple) and len(entry) >= 2:
-            file_path, text_lines, *_ = entry
-            for idx, line in enumerate(text_lines):
-                # Skip the definition line of the target function/method
-                if re.search(rf"\bdef\s+{re.escape(target_name)}\s*\(", line):
-                    continue
-                # Match calls like target_name(
-                if re.search(rf"\b{re.escape(target_name)}\s*\(", line):
-                    call_line = idx + 1
-                    found = False
-                    # Check within free functions
-                    for fn in functions:
-                        if fn.get("file") == file_path and fn.get("start_line") <= call_line <= fn.get("end_line"):
-                            key = ("function", fn["name"], file_path, fn.get("start_line"), fn.get("end_line"))
-                            if key not in seen:
-                                seen.add(key)
-                                callers.append({
-                                    "type": "function",
-                                    "caller_name": fn.get("name", ""),
-                                    "file": file_path,
-                                    "start_line": fn.get("start_line", 0),
-                                    "end_line": fn.get("end_line", 0),
-                                })
-                            found = True
-                            break
-                    if found:
-                        continue
-                    # Check within class methods
-                    for cls in classes:
-                        if cls.get("file") == file_path:
-                            for method in cls.get("methods", []):
-                                if method.get("start_line") <= call_line <= method.get("end_line"):
-                                    key = ("method", cls.get("name"), method.get("name"), file_path, method.get("start_line"), method.get("end_line"))
-                                    if key not in seen:
-                                        seen.add(key)
-                                        callers.append({
-                                            "type": "method",
-                                            "class": cls.get("name"),
-                                            "caller_name": method.get("name"),
-                                            "file": file_path,
-                                            "start_line": method.get("start_line"),
-                                            "end_line": method.get("end_line"),
-                                        })
-                                    found = True
-                                    break
-                            if found:
-                                break
-                    if found:
-                        continue
-                    # Global scope call
-                    key = ("global", file_path, call_line, call_line)
-                    if key not in seen:
-                        seen.add(key)
-                        callers.append({
-                            "type": "global",
-                            "file": file_path,
-                            "start_line": call_line,
-                            "end_line": call_line,
-                        })
+    definition_pattern = re.compile(rf"\bdef\s+{re.escape(target_name)}\s*\(")
+    call_pattern = re.compile(rf"\b{re.escape(target_name)}\s*\(")
+    if IDENTIFIER_PATTERN.fullmatch(target_name):
+        # a call matching call_pattern holds the name as a whole word, only lines with that word can match
+        candidate_lines = index.find_identifier_lines(target_name)
+    else:
+        # Iterate through files with content
+        candidate_lines = [
+            (entry[0], idx)
+            for entry in index.files
+            if isinstance(entry, tuple) and len(entry) >= 2
+            for idx in range(len(entry[1]))
+        ]
+    for file_path, idx in candidate_lines:
+        line = index.get_file_lines(file_path)[idx]
+        # Skip the definition line of the target function/method
+        if definition_pattern.search(line):
+            continue
+        # Match calls like target_name(
+        if call_pattern.search(line):
+            call_line = idx + 1
+            # every function or method around the line, innermost first
+            scopes = index.get_scope_table(file_path).enclosing(call_line)
+            # the outermost free function is the caller, otherwise the outermost method
+            caller = next(
+                (scope for scope in reversed(scopes) if scope.kind == "function"), None
+            ) or next(
+                (scope for scope in reversed(scopes) if scope.kind == "method"), None
+            )
+            if caller is not None and caller.kind == "function":
+                fn = caller.symbol
+                key = ("function", fn["name"], file_path, fn.get("start_line"), fn.get("end_line"))
+                if key not in seen:
+                    seen.add(key)
+                    callers.append({
+                        "type": "function",
+                        "caller_name": fn.get("name", ""),
+                        "file": file_path,
+                        "start_line": fn.get("start_line", 0),
+                        "end_line": fn.get("end_line", 0),
+                    })
+                continue
+            if caller is not None:
+                cls, method = caller.clazz, caller.symbol
+                key = ("method", cls.get("name"), method.get("name"), file_path, method.get("start_line"), method.get("end_line"))
+                if key not in seen:
+                    seen.add(key)
+                    callers.append({
+                        "type": "method",
+                        "class": cls.get("name"),
+                        "caller_name": method.get("name"),
+                        "file": file_path,
+                        "start_line": method.get("start_line"),
+                        "end_line": method.get("end_line"),
+                    })
+                continue
+            # Global scope call
+            key = ("global", file_path, call_line, call_line)
+            if key not in seen:
+                seen.add(key)
+                callers.append({
+                    "type": "global",
+                    "file": file_path,
+                    "start_line": call_line,
+                    "end_line": call_line,
+                })
     return callers
 
 
 def find_modified_functions(diff, structure):
-    _, classes, functions = get_full_file_paths_and_classes_and_functions(structure)
+    index = get_repo_index(structure)
 
     file_to_modified_lines = parse_diff_to_modified_lines(diff)
 
-    file_to_classes = defaultdict(list)
-    for cls in classes:
-        file_to_classes[cls['file']].append(cls)
-
-    file_to_functions = defaultdict(list)
-    for func in functions:
-        file_to_functions[func['file']].append(func)
-
     modified_functions = set()
 
     for file_name, modified_lines in file_to_modified_lines.items():
-        for func in file_to_functions.get(file_name, []):
-            if any(func['start_line'] <= line <= func['end_line'] for line in modified_lines):
-                modified_functions.add(func['name'])
-
-        for cls in file_to_classes.get(file_name, []):
-            for method in cls.get('methods', []):
-                if any(method['start_line'] <= line <= method['end_line'] for line in modified_lines):
-                    modified_functions.add(f"{cls['name']}.{method['name']}")
+        scope_table = index.get_scope_table(file_name)
+        for line in modified_lines:
+            for scope in scope_table.enclosing(line):
+                if scope.kind == "function":
+                    modified_functions.add(scope.symbol['name'])
+                elif scope.kind == "method":
+                    modified_functions.add(f"{scope.clazz['name']}.{scope.symbol['name']}")
 
     return sorted(modified_functions)
 
@@ -902,56 +946,51 @@ PROJECT_FILE_LOC = os.environ.get("PROJECT_FILE_LOC", None)
 
 
 def get_repo_structure(instance_id: str, repo_name, base_commit, playground, **kwargs):
-
-
-    # if PROJECT_FILE_LOC is not None:
-    #     with open(PROJECT_FILE_LOC + "/" + instance_id + ".json") as f:
-    #         d = json.load(f)
-    #     repo_structure = d["structure"]
-    # else:
-    d = get_project_structure_from_scratch(
-        repo_name, base_commit, instance_id, playground, **kwargs
-    )
-    repo_structure = d["structure"]
+    # preprocessed files only describe the base commit, a patched structure has to be built
+    if (
+        PROJECT_FILE_LOC is not None
+        and not kwargs.get("model_patch", "")
+        and os.path.exists(os.path.join(PROJECT_FILE_LOC, instance_id + ".json"))
+    ):
+        with open(os.path.join(PROJECT_FILE_LOC, instance_id + ".json")) as f:
+            d = json.load(f)
+        # older files repeat the lines of every symbol, they are sliced lazily instead
+        compact_structure(d["structure"])
+    else:
+        d = get_project_structure_cached(
+            repo_name, base_commit, instance_id, playground, **kwargs
+        )
+    # the structure keeps its index, see get_repo_index
+    repo_structure = RepoStructure(d["structure"])
 
     return repo_structure
 
 
 def get_repo_files(structure, filepaths: list[str]):
-    files, classes, functions = get_full_file_paths_and_classes_and_functions(structure)
     file_contents = dict()
+    index = get_repo_index(structure)
     for filepath in filepaths:
-        content = None
-
-        for file_content in files:
-            if file_content[0] == filepath:
-                content = "\n".join(file_content[1])
-                file_contents[filepath] = content
-                break
-
-        assert content is not None, "file not found"
+        # a lazy structure only parses the files asked for
+        file_entry = index.get_file_entry(filepath)
+        assert file_entry is not None, "file not found"
+        file_contents[filepath] = "\n".join(file_entry["text"])
     return file_contents
 
 
 def correct_file_paths(model_found_files, files, include_partial_paths=True):
+    """
+    Map the files proposed by the model to repository files. Exact matches win, otherwise the
+    first file that ends with the proposed path or that the proposed path ends with is used.
+    files is a list as returned by get_full_file_paths_and_classes_and_functions, or the
+    PathIndex of one (see RepoIndex.get_path_index), which saves building it again.
+    """
     found_files = []
     if model_found_files:
+        path_index = files if isinstance(files, PathIndex) else PathIndex(files)
         for model_file in model_found_files:
             if not model_file:
                 continue
-            found_match = False
-            # Check if any model found file is a subset of the current file path
-            for file_content in files:
-                file = file_content[0]
-                if model_file == file:
-                    found_files.append(file)
-                    found_match = True
-            if include_partial_paths and not found_match:
-                for file_content in files:
-                    file = file_content[0]
-                    if file.endswith(model_file) or model_file.endswith(file):
-                        found_files.append(file)
-                        break  # No need to check further, we found a match
+            found_files.extend(path_index.find(model_file, include_partial_paths))
         return found_files
     else:
         return []
@@ -0,0 +1,572 @@
+import ast
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict, namedtuple
+from functools import partial
+
+# plain dict structures whose index is kept, the index holds on to its structure so that ids
+# stay unique. A RepoStructure keeps its own index instead, for as long as it lives
+MAX_INDEXED_STRUCTURES = 8
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+# string queries a batch needs before the contents are indexed by trigram, the index takes
+# about as long to build as this many scans of every file
+MIN_INDEXED_QUERIES = 256
+
+# the words of a line, as delimited by \b in regular expressions
+IDENTIFIER_PATTERN = re.compile(r"\w+")
+
+# kind is "class", "method" or "function", clazz is the class of a method
+Scope = namedtuple("Scope", ["kind", "start_line", "end_line", "symbol", "clazz"])
+
+
+class ScopeTable:
+    """
+    The class, method and function ranges of one file, sorted by start line, each with the
+    index of the scope around it. Definitions parsed from one file nest properly, so the
+    innermost scope around a line is the last scope starting at or before it, or the first
+    of that scope's parents that has not ended yet.
+    """
+
+    def __init__(self, classes, functions):
+        scopes = []
+        for clazz in classes:
+            scopes.append(Scope("class", clazz["start_line"], clazz["end_line"], clazz, None))
+            for method in clazz["methods"]:
+                scopes.append(
+                    Scope("method", method["start_line"], method["end_line"], method, clazz)
+                )
+        for function in functions:
+            scopes.append(
+                Scope("function", function["start_line"], function["end_line"], function, None)
+            )
+        scopes.sort(key=lambda scope: (scope.start_line, -scope.end_line))
+
+        self.scopes = scopes
+        self.start_lines = [scope.start_line for scope in scopes]
+        self.parents = []
+        open_scopes = []
+        for i, scope in enumerate(scopes):
+            while open_scopes and scopes[open_scopes[-1]].end_line < scope.start_line:
+                open_scopes.pop()
+            self.parents.append(open_scopes[-1] if open_scopes else -1)
+            open_scopes.append(i)
+
+    def _innermost_index(self, line):
+        i = bisect_right(self.start_lines, line) - 1
+        while i >= 0 and self.scopes[i].end_line < line:
+            i = self.parents[i]
+        return i
+
+    def innermost(self, line):
+        """Return the innermost Scope containing the line, or None at module level."""
+        i = self._innermost_index(line)
+        return self.scopes[i] if i >= 0 else None
+
+    def enclosing(self, line):
+        """Return every Scope containing the line, innermost first."""
+        result = []
+        i = self._innermost_index(line)
+        while i >= 0:
+            result.append(self.scopes[i])
+            i = self.parents[i]
+        return result
+
+
+class DefinitionTable:
+    """
+    The function definitions of one file with their source spans, from a single parse of the
+    file contents. methods maps (class name, function name) to the first function of that name
+    in the body of the first class of that name, functions maps a function name to its first
+    definition anywhere in the file and the class it is a method of, in ast.walk order.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.methods = {}
+        self.functions = {}
+        tree = ast.parse("\n".join(lines))
+        parent_classes = {}
+        seen_classes = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ClassDef):
+                first_of_name = node.name not in seen_classes
+                seen_classes.add(node.name)
+                for item in node.body:
+                    if not isinstance(item, ast.FunctionDef):
+                        continue
+                    parent_classes[item] = node.name
+                    if first_of_name:
+                        self.methods.setdefault((node.name, item.name), self._span(item))
+            elif isinstance(node, ast.FunctionDef) and node.name not in self.functions:
+                # a class is walked before the functions of its body
+                self.functions[node.name] = (parent_classes.get(node, ""), self._span(node))
+
+    @staticmethod
+    def _span(node):
+        return node.lineno - 1, node.col_offset, node.end_lineno - 1, node.end_col_offset
+
+    def get_source(self, span):
+        """Return the source of a span, as ast.get_source_segment does."""
+        start, col_offset, end, end_col_offset = span
+        if start == end:
+            return self.lines[start].encode()[col_offset:end_col_offset].decode()
+        first = self.lines[start].encode()[col_offset:].decode()
+        last = self.lines[end].encode()[:end_col_offset].decode()
+        return "\n".join([first] + self.lines[start + 1 : end] + [last])
+
+
+class PathIndex:
+    """
+    Resolves file paths proposed by the model against the files of a repository, with the
+    matching rules of correct_file_paths, without comparing the path to every file:
+    - paths map to their positions in the file list for exact matches
+    - the reversed paths are sorted, the files ending with a path are then a range of them, and
+      a sparse table answers which of those comes first in the file list
+    - files a path ends with are among its suffixes, which are looked up directly
+    - base names map to their paths
+    """
+
+    def __init__(self, files):
+        # correct_file_paths compares the first item of each entry
+        self.paths = [file[0] for file in files]
+        self.positions = defaultdict(list)
+        self.paths_by_basename = defaultdict(list)
+        for i, path in enumerate(self.paths):
+            self.positions[path].append(i)
+            self.paths_by_basename[path.split("/")[-1]].append(path)
+
+        order = sorted(range(len(self.paths)), key=lambda i: self.paths[i][::-1])
+        self.reversed_paths = [self.paths[i][::-1] for i in order]
+        # first_position[k][j] is the smallest position among order[j : j + 2 ** k]
+        self.first_position = [order]
+        k = 1
+        while 1 << k <= len(order):
+            previous = self.first_position[-1]
+            half = 1 << (k - 1)
+            self.first_position.append(
+                [
+                    min(previous[j], previous[j + half])
+                    for j in range(len(order) - (1 << k) + 1)
+                ]
+            )
+            k += 1
+
+    def _first_ending_with(self, path):
+        """Position of the first file ending with path, or None."""
+        reversed_path = path[::-1]
+        lo = bisect_left(self.reversed_paths, reversed_path)
+        hi = bisect_left(self.reversed_paths, reversed_path + "\U0010ffff", lo)
+        if lo == hi:
+            return None
+        k = (hi - lo).bit_length() - 1
+        return min(self.first_position[k][lo], self.first_position[k][hi - (1 << k)])
+
+    def _first_ended_by(self, path):
+        """Position of the first file that path ends with, or None."""
+        first = None
+        for start in range(len(path) + 1):
+            positions = self.positions.get(path[start:])
+            if positions and (first is None or positions[0] < first):
+                first = positions[0]
+        return first
+
+    def find(self, path, include_partial_paths=True):
+        """
+        Return every file equal to path. Without one, return the first file that ends with
+        path or that path ends with, if include_partial_paths.
+        """
+        positions = self.positions.get(path)
+        if positions:
+            return [self.paths[i] for i in positions]
+        if not include_partial_paths:
+            return []
+        candidates = [
+            i
+            for i in (self._first_ending_with(path), self._first_ended_by(path))
+            if i is not None
+        ]
+        return [self.paths[min(candidates)]] if candidates else []
+
+    def find_by_basename(self, basename):
+        return self.paths_by_basename.get(basename, [])
+
+
+class ContentIndex:
+    """
+    The contents of the files of a structure, with a trigram index for substring search. A
+    file can only contain a string if it contains every trigram of it, so indexed queries
+    check the files holding all of the query's trigrams instead of every file. Building the
+    index takes a few hundred plain scans, so it is only built for batches of at least
+    MIN_INDEXED_QUERIES queries and reused once built. Checking a candidate is a plain
+    substring test on the joined contents.
+    """
+
+    def __init__(self, entries_by_path):
+        self.paths = list(entries_by_path)
+        self.contents = ["\n".join(entry["text"]) for entry in entries_by_path.values()]
+        # see get_qgram_files
+        self._qgram_files = {}
+        self._qgram_lock = threading.Lock()
+
+    def _index_qgrams(self, q):
+        qgram_files = defaultdict(partial(array, "I"))
+        for i, content in enumerate(self.contents):
+            for qgram in {content[j : j + q] for j in range(len(content) - q + 1)}:
+                qgram_files[qgram].append(i)
+        return dict(qgram_files)
+
+    def has_qgram_files(self, q):
+        """Whether the q-gram index is built, the searches only use it then."""
+        return q in self._qgram_files
+
+    def get_qgram_files(self, q):
+        """Return the map from each q-gram to the indices of the files containing it, q is 2
+        or 3, building it on first use."""
+        if q not in (2, 3):
+            raise ValueError(f"no index of {q}-grams")
+        if q not in self._qgram_files:
+            with self._qgram_lock:
+                if q not in self._qgram_files:
+                    self._qgram_files[q] = self._index_qgrams(q)
+        return self._qgram_files[q]
+
+    def candidates(self, query):
+        """Return the indices of the files that may contain query, in file order."""
+        if len(query) < 3 or not self.has_qgram_files(3):
+            return range(len(self.paths))
+        trigram_files = self.get_qgram_files(3)
+        postings = []
+        for trigram in {query[j : j + 3] for j in range(len(query) - 2)}:
+            files = trigram_files.get(trigram)
+            if files is None:
+                return []
+            postings.append(files)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for files in postings[1:]:
+            if len(candidates) * 10 <= len(files):
+                # a few substring tests are cheaper than going through a long list
+                break
+            candidates.intersection_update(files)
+        return sorted(candidates)
+
+    def count_occurrences(self, queries):
+        """
+        Count the occurrences of several strings in one pass over the files that may contain
+        any of them, each file being checked for the queries it may contain.
+
+        Returns:
+        dict from each query to {file path: number of occurrences} of the files containing it,
+        in file order
+        """
+        queries = list(queries)
+        if len(dict.fromkeys(queries)) >= MIN_INDEXED_QUERIES:
+            self.get_qgram_files(3)
+        queries_by_file = defaultdict(list)
+        for query in dict.fromkeys(queries):
+            for i in self.candidates(query):
+                queries_by_file[i].append(query)
+        occurrences = {query: {} for query in queries}
+        for i in sorted(queries_by_file):
+            content = self.contents[i]
+            for query in queries_by_file[i]:
+                count = content.count(query)
+                if count:
+                    occurrences[query][self.paths[i]] = count
+        return occurrences
+
+
+class RepoIndex:
+    """
+    Lookup tables over one structure, so that helpers look files, classes and functions up by
+    name instead of flattening the whole structure and scanning it on every call.
+
+    The paths are read when the index is created, without parsing the entries of lazy
+    structures. Classes and functions are flattened once, the first time a symbol is looked up.
+    Lists keep the order of get_full_file_paths_and_classes_and_functions, so the first match
+    of a lookup is the one the linear scans used to find.
+    """
+
+    def __init__(self, structure):
+        # preprocess_data imports this module
+        from patchpilot.util.preprocess_data import iter_python_files
+
+        self.structure = structure
+        self.entries_by_path = dict(iter_python_files(structure))
+        self.file_positions = {path: i for i, path in enumerate(self.entries_by_path)}
+        self._lock = threading.Lock()
+        self._flattened = None
+        self.scope_tables = {}
+        self.definition_tables = {}
+        self._text_index_lock = threading.Lock()
+        self._identifier_lines = None
+        self._path_index = None
+        self._content_index = None
+
+    def _flatten(self):
+        from patchpilot.util.preprocess_data import (
+            get_full_file_paths_and_classes_and_functions,
+        )
+
+        files, classes, functions = get_full_file_paths_and_classes_and_functions(
+            self.structure
+        )
+        self.classes_by_file = defaultdict(list)
+        self.classes_by_name = defaultdict(list)
+        self.class_by_file_and_name = {}
+        self.method_by_qualified_name = {}
+        self.methods_by_file_and_name = defaultdict(list)
+        self.methods_by_name = defaultdict(list)
+        for clazz in classes:
+            file = clazz["file"]
+            self.classes_by_file[file].append(clazz)
+            self.classes_by_name[clazz["name"]].append(clazz)
+            first_of_name = (file, clazz["name"]) not in self.class_by_file_and_name
+            self.class_by_file_and_name.setdefault((file, clazz["name"]), clazz)
+            for method in clazz["methods"]:
+                if first_of_name:
+                    # file, class name and method name, as in "function: MyClass.my_method"
+                    self.method_by_qualified_name.setdefault(
+                        (file, clazz["name"], method["name"]), method
+                    )
+                self.methods_by_file_and_name[(file, method["name"])].append(method)
+                self.methods_by_name[method["name"]].append((clazz, method))
+
+        self.functions_by_file = defaultdict(list)
+        self.functions_by_name = defaultdict(list)
+        self.function_by_file_and_name = {}
+        for function in functions:
+            self.functions_by_file[function["file"]].append(function)
+            self.functions_by_name[function["name"]].append(function)
+            self.function_by_file_and_name.setdefault(
+                (function["file"], function["name"]), function
+            )
+        self._flattened = (files, classes, functions)
+
+    def flattened(self):
+        """Return (files, classes, functions) as get_full_file_paths_and_classes_and_functions
+        does, computed once. The lists are shared, callers must not modify them."""
+        if self._flattened is None:
+            with self._lock:
+                if self._flattened is None:
+                    self._flatten()
+        return self._flattened
+
+    @property
+    def files(self):
+        return self.flattened()[0]
+
+    @property
+    def classes(self):
+        return self.flattened()[1]
+
+    @property
+    def functions(self):
+        return self.flattened()[2]
+
+    def get_path_index(self):
+        """Return the PathIndex of the files, built on first use. It only needs the paths, so
+        the files of a lazy structure are not parsed."""
+        if self._path_index is None:
+            path_index = PathIndex([(path,) for path in self.entries_by_path])
+            with self._lock:
+                if self._path_index is None:
+                    self._path_index = path_index
+        return self._path_index
+
+    def get_content_index(self):
+        """Return the ContentIndex of the files, built on first use."""
+        if self._content_index is None:
+            with self._text_index_lock:
+                if self._content_index is None:
+                    self._content_index = ContentIndex(self.entries_by_path)
+        return self._content_index
+
+    def get_file_entry(self, file_path):
+        return self.entries_by_path.get(file_path)
+
+    def get_file_lines(self, file_path):
+        entry = self.entries_by_path.get(file_path)
+        return entry["text"] if entry is not None else None
+
+    def get_file_imports(self, file_path):
+        """Return (imports, import_interval) of a file, both empty if it is not in the structure."""
+        entry = self.entries_by_path.get(file_path)
+        if entry is None:
+            return [], []
+        return entry.get("imports", []), entry.get("import_interval", [])
+
+    def get_classes_in_file(self, file_path):
+        self.flattened()
+        return self.classes_by_file.get(file_path, [])
+
+    def get_functions_in_file(self, file_path):
+        self.flattened()
+        return self.functions_by_file.get(file_path, [])
+
+    def get_scope_table(self, file_path):
+        """Return the ScopeTable of a file, built on first use. Empty for unknown files."""
+        table = self.scope_tables.get(file_path)
+        if table is None:
+            table = ScopeTable(
+                self.get_classes_in_file(file_path),
+                self.get_functions_in_file(file_path),
+            )
+            self.scope_tables[file_path] = table
+        return table
+
+    def get_definition_table(self, file_path):
+        """Return the DefinitionTable of a file, parsed on first use."""
+        table = self.definition_tables.get(file_path)
+        if table is None:
+            table = DefinitionTable(self.get_file_lines(file_path))
+            self.definition_tables[file_path] = table
+        return table
+
+    def find_function_definition(self, function_name, class_name=""):
+        """
+        Return (file path, class name, source) of the first definition of a function in the
+        order of the files, or None. With a class name only the methods of the first class of
+        that name in each file count, without one the function may be defined anywhere and
+        the class is "" unless it is a method. Only the files where the structure has a
+        class, method or function of that name are parsed.
+        """
+        if class_name:
+            files = [clazz["file"] for clazz in self.find_classes(class_name)]
+        else:
+            files = [function["file"] for function in self.find_functions(function_name)]
+            files += [clazz["file"] for clazz, _ in self.find_methods(function_name)]
+        positions = self.file_positions
+        for file_path in sorted(set(files) & positions.keys(), key=positions.get):
+            table = self.get_definition_table(file_path)
+            if class_name:
+                span = table.methods.get((class_name, function_name))
+                if span is not None:
+                    return file_path, class_name, table.get_source(span)
+            elif function_name in table.functions:
+                parent_class, span = table.functions[function_name]
+                return file_path, parent_class, table.get_source(span)
+        return None
+
+    def get_class(self, file_path, class_name):
+        self.flattened()
+        return self.class_by_file_and_name.get((file_path, class_name))
+
+    def get_function(self, file_path, function_name):
+        self.flattened()
+        return self.function_by_file_and_name.get((file_path, function_name))
+
+    def get_method(self, file_path, class_name, method_name):
+        """Return the method of the first class of that name in the file, or None."""
+        self.flattened()
+        return self.method_by_qualified_name.get((file_path, class_name, method_name))
+
+    def get_methods_in_file(self, file_path, method_name):
+        """Return the methods of that name of all classes in the file."""
+        self.flattened()
+        return self.methods_by_file_and_name.get((file_path, method_name), [])
+
+    def find_classes(self, class_name):
+        self.flattened()
+        return self.classes_by_name.get(class_name, [])
+
+    def find_functions(self, function_name):
+        self.flattened()
+        return self.functions_by_name.get(function_name, [])
+
+    def find_methods(self, method_name):
+        """Return (class, method) for every method of that name in the repository."""
+        self.flattened()
+        return self.methods_by_name.get(method_name, [])
+
+    def _build_identifier_lines(self):
+        # lines are numbered across all files, file_starts holds the number of each file's first line
+        file_paths = []
+        file_starts = []
+        identifier_lines = defaultdict(partial(array, "I"))
+        line_number = 0
+        for entry in self.files:
+            if not isinstance(entry, tuple):
+                continue
+            file_paths.append(entry[0])
+            file_starts.append(line_number)
+            for line in entry[1]:
+                for identifier in set(IDENTIFIER_PATTERN.findall(line)):
+                    identifier_lines[identifier].append(line_number)
+                line_number += 1
+        self._identifier_lines = (file_paths, file_starts, dict(identifier_lines))
+
+    def find_identifier_lines(self, identifier):
+        """
+        Return (file path, line index) of every line where identifier appears as a whole word,
+        in the order of the files and their lines. The inverted index is built over all files
+        on the first query.
+        """
+        if self._identifier_lines is None:
+            with self._text_index_lock:
+                if self._identifier_lines is None:
+                    self._build_identifier_lines()
+        file_paths, file_starts, identifier_lines = self._identifier_lines
+        result = []
+        for line_number in identifier_lines.get(identifier, ()):
+            file_index = bisect_right(file_starts, line_number) - 1
+            result.append((file_paths[file_index], line_number - file_starts[file_index]))
+        return result
+
+
+class RepoStructure(dict):
+    """
+    A structure that stores its RepoIndex on itself, so that the index is freed with the
+    structure instead of being held by the module. The index is not pickled.
+    """
+
+    __slots__ = ("repo_index",)
+
+    def __reduce_ex__(self, protocol):
+        return RepoStructure, (dict(self),)
+
+
+def get_repo_index(structure):
+    """
+    Return the RepoIndex of a structure, building it on first use. Structures are not
+    expected to change once indexed, code that modifies one calls invalidate_repo_index.
+    """
+    if isinstance(structure, RepoStructure):
+        index = getattr(structure, "repo_index", None)
+        if index is None or index.structure is not structure:
+            # concurrent builds are rare and build the same index, the last one is kept
+            index = RepoIndex(structure)
+            structure.repo_index = index
+        return index
+
+    key = id(structure)
+    with _indexes_lock:
+        entry = _indexes.get(key)
+        if entry is not None and entry.structure is structure:
+            _indexes.move_to_end(key)
+            return entry
+    index = RepoIndex(structure)
+    with _indexes_lock:
+        entry = _indexes.get(key)
+        if entry is not None and entry.structure is structure:
+            # built concurrently by another thread
+            return entry
+        _indexes[key] = index
+        while len(_indexes) > MAX_INDEXED_STRUCTURES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def invalidate_repo_index(structure):
+    if isinstance(structure, RepoStructure):
+        structure.repo_index = None
+        return
+    with _indexes_lock:
+        entry = _indexes.get(id(structure))
+        if entry is not None and entry.structure is structure:
+            del _indexes[id(structure)]
@@ -1,8 +1,5 @@
-from fuzzysearch import find_near_matches
-from patchpilot.util.preprocess_data import (
-    get_full_file_paths_and_classes_and_functions,
-)
-import ast
+from patchpilot.util.fuzzy_search import fuzzy_search
+from patchpilot.util.repo_index import get_repo_index
 
 
 search_string_schema = {
@@ -91,46 +88,12 @@ def search_func_def_with_class_and_file(structure, function_name: str, class_nam
     found_class_name = class_name
     found_function_code = ""
     found_file_name = ""
-    
-    # Get the list of files, classes, and functions from the provided structure
-    files, classes, functions = get_full_file_paths_and_classes_and_functions(structure)
 
-    
-    for file in files:        
-        file_path, file_contents = file[0], "\n".join(file[1])
-        
-        # Parse file contents to check for class and function definitions
-        tree = ast.parse(file_contents)
-        
-        # If a specific class name is provided, search within the class
-        if class_name:
-            found_class = False
-            for node in ast.walk(tree):
-                if isinstance(node, ast.ClassDef) and node.name == class_name:
-                    found_class = True
-                    for item in node.body:
-                        if isinstance(item, ast.FunctionDef) and item.name == function_name:
-                            found_function_code = ast.get_source_segment(file_contents, item)
-                            found_file_name = file_path
-                            found_class_name = class_name
-                            break
-                    break
-            if not found_class:
-                continue  # Class not found in this file, skip to next file
-        else:
-            # If no specific class name, search for the function definition directly
-            for node in ast.walk(tree):
-                if isinstance(node, ast.FunctionDef) and node.name == function_name:
-                    found_function_code = ast.get_source_segment(file_contents, node)
-                    found_file_name = file_path
-                    # Check if function is within a class
-                    parent_class = next((cls.name for cls in ast.walk(tree) if isinstance(cls, ast.ClassDef) and node in cls.body), None)
-                    found_class_name = parent_class if parent_class else ""
-                    break
-
-        if found_function_code:
-          print(f"Found function {function_name} in class {found_class_name} in file {found_file_name}")
-          break  # Stop search once function definition is found
+    # the first definition in the order of the files, parsing only the files that define the name
+    definition = get_repo_index(structure).find_function_definition(function_name, class_name)
+    if definition is not None:
+        found_file_name, found_class_name, found_function_code = definition
+        print(f"Found function {function_name} in class {found_class_name} in file {found_file_name}")
 
     # Return the result as a list with file name, class name, and function code
     return [found_file_name, found_class_name, found_function_code]
@@ -144,10 +107,8 @@ def search_func_def(function_name: str, structure) -> list[str]:
     """
     search_res=[]
     print(f"searching for function {function_name}")
-    files, classes, functions = get_full_file_paths_and_classes_and_functions(structure)
-    for function_struct in functions:
-        if function_struct["name"] == function_name:
-            search_res.append(function_struct["file"])
+    for function_struct in get_repo_index(structure).find_functions(function_name):
+        search_res.append(function_struct["file"])
     return [] if not search_res else search_res
 
 
@@ -158,10 +119,8 @@ def search_class_def(class_name: str, structure) -> list[str]:
     # Implementation code
     search_res=[]
     print(f"searching for class {class_name}")
-    files, classes, functions = get_full_file_paths_and_classes_and_functions(structure)
-    for class_struct in classes:
-        if class_struct["name"] == class_name:
-            search_res.append(class_struct["file"])
+    for class_struct in get_repo_index(structure).find_classes(class_name):
+        search_res.append(class_struct["file"])
     return [] if not search_res else search_res
 
 
@@ -170,29 +129,67 @@ def search_string(query_string: str, structure) -> list[str]:
     Accepts a string to search for and returns the file paths where the string is found. We only return the files that contain the specific string the most number of times. 
     Note: The string should be specific enough (e.g., an error message) to ensure accurate search results.
     """
-    file_to_num_occurrences = {}
     print(f"searching for string '{query_string}'")
-    files, classes, functions = get_full_file_paths_and_classes_and_functions(structure)
-    for file in files:
-        if query_string in "\n".join(file[1]):
-            file_to_num_occurrences[file[0]] = "\n".join(file[1]).count(query_string)
+    content_index = get_repo_index(structure).get_content_index()
+    # only the files holding every trigram of the query can contain it
+    file_to_num_occurrences = content_index.count_occurrences([query_string])[query_string]
+    return _rank_string_matches(query_string, file_to_num_occurrences, content_index)
+
+
+def _rank_string_matches(query_string, file_to_num_occurrences, content_index):
+    """The files of search_string from the exact occurrences of the query, in file order,
+    falling back to a fuzzy search when there are none."""
     file_to_num_occurrences = dict(sorted(file_to_num_occurrences.items(), key=lambda item: item[1], reverse=True))
     if file_to_num_occurrences:
         return [file for file in file_to_num_occurrences.keys()][:20]
     #fuzzy search
      # Fuzzy search if no exact matches found
     print(f"Performing Fuzzy search for string '{query_string}'")
-    fuzzy_matches = {}
-    for file in files:
-        file_path, file_contents = file[0], "\n".join(file[1])
-        matches = find_near_matches(query_string, file_contents, max_l_dist=min(len(query_string) // 3, 9))
-        if matches:
-            fuzzy_matches[file_path] = len(matches)
-
+    # files sorted by number of fuzzy matches in descending order
+    fuzzy_matches = fuzzy_search(content_index, query_string, max_l_dist=min(len(query_string) // 3, 9))
     if fuzzy_matches:
-        # Sort files by number of fuzzy matches in descending order
-        sorted_fuzzy_files = sorted(fuzzy_matches.items(), key=lambda item: item[1], reverse=True)
-        return [file for file, _ in sorted_fuzzy_files][:20]
+        return [file for file, _ in fuzzy_matches][:20]
 
     # If no matches found
-    return []
\ No newline at end of file
+    return []
+
+
+SEARCH_TOOLS = {
+    "search_string": search_string,
+    "search_class_def": search_class_def,
+    "search_func_def": search_func_def,
+}
+
+
+def search_batch(queries, structure) -> list[list[str]]:
+    """
+    Answers several search_string, search_class_def and search_func_def calls at once, with
+    the results the calls would return one after another. The exact matches of all string
+    queries are counted in a single pass over the files, and repeated queries are run once.
+
+    Arguments:
+    queries -- list of (tool name, argument), e.g. ("search_class_def", "MyClass")
+    structure -- the repository structure
+
+    Returns:
+    The result of each query, in order
+    """
+    for tool_name, _ in queries:
+        if tool_name not in SEARCH_TOOLS:
+            raise ValueError(f"Search tool {tool_name} is not supported")
+    query_strings = [argument for tool_name, argument in queries if tool_name == "search_string"]
+    if query_strings:
+        content_index = get_repo_index(structure).get_content_index()
+        occurrences = content_index.count_occurrences(query_strings)
+
+    results = {}
+    for query in queries:
+        if query in results:
+            continue
+        tool_name, argument = query
+        if tool_name == "search_string":
+            print(f"searching for string '{argument}'")
+            results[query] = _rank_string_matches(argument, occurrences[argument], content_index)
+        else:
+            results[query] = SEARCH_TOOLS[tool_name](argument, structure=structure)
+    return [list(results[query]) for query in queries]
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import threading
+import tokenize
+from collections import OrderedDict
+
+import libcst as cst
+from libcst.metadata import MetadataWrapper
+
+from get_repo_structure.get_repo_structure import parse_python_file
+from patchpilot.util.compress_file import compress_module, compress_source
+from patchpilot.util.get_function_interval import collect_function_intervals
+from patchpilot.util.parse_global_var import collect_global_vars
+from patchpilot.util.utils import atomic_write
+
+# models kept for the contents seen most recently, the results alone are small
+MAX_SOURCE_MODELS = 128
+# a libcst tree with its positions takes about 85 times the size of the source, so the models
+# keep their trees only for the most recently parsed contents, up to this many source bytes in
+# total. A model whose tree was released parses its content again if it needs it
+MAX_PARSED_SOURCE_BYTES = 2 * 1024 * 1024
+
+_source_models = OrderedDict()
+_source_models_lock = threading.Lock()
+# models holding a MetadataWrapper -> size of their content, oldest first
+_parsed_models = OrderedDict()
+_parsed_source_bytes = 0
+_parsed_models_lock = threading.Lock()
+
+# SET THIS TO KEEP SKELETONS ACROSS SAMPLES, ROUNDS AND PROCESS RESTARTS, see get_skeleton
+SKELETON_CACHE_DIR = os.environ.get("SKELETON_CACHE_DIR", None)
+# part of every cached skeleton's key, bump it when compress_module produces different output
+SKELETON_CACHE_VERSION = 1
+# "libcst" compresses with CompressTransformer, "ast" with AstCompressor, which gives the same
+# skeletons several times faster and falls back to libcst on the files ast cannot parse
+SKELETON_BACKEND = os.environ.get("SKELETON_BACKEND", "libcst")
+SKELETON_BACKENDS = ("libcst", "ast")
+
+
+def get_content_hash(content):
+    return hashlib.sha1(content.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def get_skeleton_cache_path(
+    content_hash, keep_constant, delete_func_start_lines, cache_dir=None, backend="libcst"
+):
+    """
+    Return the cache file of the skeleton of a content compressed with the given options.
+
+    Arguments:
+    content_hash -- get_content_hash of the file content
+    keep_constant -- whether module level assignments are kept
+    delete_func_start_lines -- start lines of the functions left out, in any order
+    cache_dir -- the cache root, defaults to SKELETON_CACHE_DIR
+    backend -- the skeleton backend, the backends are kept apart in case their outputs differ
+    """
+    cache_dir = cache_dir or SKELETON_CACHE_DIR
+    options = json.dumps(
+        [
+            SKELETON_CACHE_VERSION,
+            keep_constant,
+            sorted(set(delete_func_start_lines or ()), key=str),
+            backend,
+        ],
+        default=str,
+    )
+    options_hash = hashlib.sha1(options.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, content_hash[:2], f"{content_hash}_{options_hash}.py")
+
+
+def load_cached_skeleton(cache_path):
+    """Load a cached skeleton, returning None if it is missing or unreadable."""
+    try:
+        with open(cache_path, "rb") as f:
+            return f.read().decode("utf-8", "surrogatepass")
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def save_cached_skeleton(cache_path, skeleton):
+    # concurrent writers of a key write the same skeleton, the last replace wins
+    atomic_write(cache_path, skeleton.encode("utf-8", "surrogatepass"), mode="wb")
+
+
+class SourceModel:
+    """
+    Everything the analyzers compute about one file content: skeletons, function intervals,
+    global variable ranges and the class and function tables of parse_python_file. The libcst
+    analyses share a single parse and position resolution, done on first use and released when
+other contents have been parsed since, see MAX_PARSED_SOURCE_BYTES. Each result is
+    computed once, under the model's lock, and shared by every caller, so it must not be
+    modified.
+    """
+
+    def __init__(self, content, content_hash=None):
+        self.content = content
+        self.content_hash = content_hash or get_content_hash(content)
+        self._lock = threading.Lock()
+        self._wrapper = None
+        self._parse_error = None
+        self._skeletons = {}
+        self._function_intervals = None
+        self._global_vars = None
+        self._definitions = None
+
+    def _get_wrapper(self):
+        """Return the MetadataWrapper of the content, or None if it does not parse."""
+        if self._wrapper is None and self._parse_error is None:
+            try:
+                tree = cst.parse_module(self.content)
+            except Exception as e:
+                self._parse_error = e
+            else:
+                # the tree is not shared, copying it would only cost time
+                self._wrapper = MetadataWrapper(tree, unsafe_skip_copy=True)
+                _track_parsed_model(self)
+        return self._wrapper
+
+    def get_skeleton(self, keep_constant=True, delete_func_start_lines=None, backend=None):
+        """Return the compressed file, or the content itself if it does not parse. With
+        SKELETON_CACHE_DIR set, skeletons are read from and written to the cache there, so
+        a file is compressed once per content and options across processes. The backend
+        defaults to SKELETON_BACKEND."""
+        backend = backend or SKELETON_BACKEND
+        if backend not in SKELETON_BACKENDS:
+            raise ValueError(
+                f"Unknown skeleton backend {backend}, expected one of {SKELETON_BACKENDS}"
+            )
+        key = (keep_constant, frozenset(delete_func_start_lines or ()), backend)
+        with self._lock:
+            if key in self._skeletons:
+                return self._skeletons[key]
+            skeleton = cache_path = None
+            if SKELETON_CACHE_DIR is not None:
+                cache_path = get_skeleton_cache_path(
+                    self.content_hash, keep_constant, delete_func_start_lines, backend=backend
+                )
+                skeleton = load_cached_skeleton(cache_path)
+            if skeleton is None:
+                skeleton = self._compress(keep_constant, delete_func_start_lines, backend)
+                if cache_path is not None:
+                    save_cached_skeleton(cache_path, skeleton)
+            self._skeletons[key] = skeleton
+            return skeleton
+
+    def _compress(self, keep_constant, delete_func_start_lines, backend):
+        if backend == "ast":
+            try:
+                return compress_source(self.content, keep_constant, delete_func_start_lines)
+            except (SyntaxError, ValueError, RecursionError, tokenize.TokenError):
+                # libcst decides what parses, as it did before the ast backend
+                pass
+        wrapper = self._get_wrapper()
+        if wrapper is None:
+            return self.content
+        return compress_module(wrapper, keep_constant, delete_func_start_lines)
+
+    def get_function_intervals(self):
+        """Return {function name: (start line, end line)}, raising the parse error if the
+        content does not parse."""
+        with self._lock:
+            if self._function_intervals is None:
+                wrapper = self._get_wrapper()
+                if wrapper is None:
+                    raise self._parse_error
+                self._function_intervals = collect_function_intervals(wrapper)
+            return self._function_intervals
+
+    def get_global_vars(self):
+        """Return {variable name: {"start_line", "end_line"}}, or the content itself if it does
+        not parse."""
+        with self._lock:
+            if self._global_vars is None:
+                wrapper = self._get_wrapper()
+                if wrapper is None:
+                    return self.content
+                self._global_vars = collect_global_vars(wrapper)
+            return self._global_vars
+
+    def get_definitions(self):
+        """Return parse_python_file(..., with_text=False) of the content. It parses with ast,
+        whose walk order the structures are built on."""
+        with self._lock:
+            if self._definitions is None:
+                self._definitions = parse_python_file("", self.content, with_text=False)
+            return self._definitions
+
+
+def _track_parsed_model(model):
+    """Account for the tree of a model, releasing the trees of the models parsed least recently
+    once they hold more than MAX_PARSED_SOURCE_BYTES of source."""
+    global _parsed_source_bytes
+    with _parsed_models_lock:
+        size = len(model.content)
+        _parsed_models[model] = size
+        _parsed_source_bytes += size
+        while _parsed_source_bytes > MAX_PARSED_SOURCE_BYTES and len(_parsed_models) > 1:
+            released, released_size = _parsed_models.popitem(last=False)
+            _parsed_source_bytes -= released_size
+            # callers holding the wrapper keep it alive until they are done
+            released._wrapper = None
+
+
+def get_source_model(content):
+    """Return the SourceModel of a file content, shared by all callers passing the same content."""
+    key = get_content_hash(content)
+    with _source_models_lock:
+        model = _source_models.get(key)
+        if model is None:
+            model = SourceModel(content, key)
+            _source_models[key] = model
+            while len(_source_models) > MAX_SOURCE_MODELS:
+                _source_models.popitem(last=False)
+        else:
+            _source_models.move_to_end(key)
+    return model
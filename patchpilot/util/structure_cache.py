@@ -0,0 +1,325 @@
+import hashlib
+import json
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+
+from filelock import FileLock
+
+from get_repo_structure.get_repo_structure import (
+    FILE_ENTRY_KEYS,
+    STRUCTURE_LAZY,
+    get_project_structure_from_scratch,
+    update_structure_to_commit,
+    update_structure_with_patch,
+)
+from get_repo_structure.repo_mirror import REPO_MIRROR_DIR, ensure_mirror, has_commit
+from patchpilot.util.structure_store import load_structure_store, write_structure_store
+from patchpilot.util.utils import atomic_write
+
+# SET THIS TO SHARE BUILT STRUCTURES ACROSS STAGES, ROUNDS AND PROCESSES
+STRUCTURE_CACHE_DIR = os.environ.get("STRUCTURE_CACHE_DIR", None)
+# the least recently used entries are evicted once the cache grows beyond this size
+STRUCTURE_CACHE_MAX_BYTES = int(
+    os.environ.get("STRUCTURE_CACHE_MAX_BYTES", 20 * 1024 * 1024 * 1024)
+)
+# "json", or "mmap" for read-only binary stores that all workers map instead of each
+# holding its own copy, see structure_store.py
+STRUCTURE_CACHE_FORMAT = os.environ.get("STRUCTURE_CACHE_FORMAT", "json")
+CACHE_FILE_EXTENSIONS = {"json": ".json", "mmap": ".bin"}
+# how many of the most recently used structures of a repository to consider when deriving
+# the structure of a new commit from an already built one
+MAX_REUSE_CANDIDATES = 16
+# base structures kept in the process when there is no STRUCTURE_CACHE_DIR, so that the
+# patched structures of the refine rounds are still derived instead of built from scratch
+MAX_IN_PROCESS_BASES = 2
+
+_base_structures = OrderedDict()
+_base_structures_lock = threading.Lock()
+_base_build_locks = {}
+
+# cache dir -> [estimated size in bytes, bytes this process wrote since it last measured it]
+_cache_sizes = {}
+_cache_sizes_lock = threading.Lock()
+
+
+def get_patch_hash(model_patch: str) -> str:
+    if not model_patch:
+        return "base"
+    return hashlib.sha1(model_patch.encode("utf-8")).hexdigest()[:16]
+
+
+def get_structure_cache_path(repo_name, commit_id, model_patch="", cache_dir=None):
+    """
+    Return the cache file of a (repo, commit, applied patch) structure.
+
+    Arguments:
+    repo_name -- upstream repository name, e.g. django/django
+    commit_id -- the commit SHA the structure was built at
+    model_patch -- the patch applied on top of the commit, if any
+    cache_dir -- the cache root, defaults to STRUCTURE_CACHE_DIR
+    """
+    cache_dir = cache_dir or STRUCTURE_CACHE_DIR
+    return os.path.join(
+        cache_dir,
+        repo_name.replace("/", "__"),
+        f"{commit_id}_{get_patch_hash(model_patch)}{CACHE_FILE_EXTENSIONS[STRUCTURE_CACHE_FORMAT]}",
+    )
+
+
+def load_cached_structure(cache_path):
+    """Load a cached structure, returning None if it is missing or unreadable."""
+    try:
+        if cache_path.endswith(".bin"):
+            d = load_structure_store(cache_path)
+        else:
+            with open(cache_path, "r") as f:
+                d = json.load(f)
+    except (OSError, ValueError):
+        return None
+    try:
+        # mark the entry as recently used for eviction
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return d
+
+
+def save_cached_structure(cache_path, d):
+    if cache_path.endswith(".bin"):
+        write_structure_store(cache_path, d)
+    else:
+        atomic_write(cache_path, json.dumps(d))
+
+
+def evict_structure_cache(cache_dir=None, max_bytes=None):
+    """Delete the least recently used cache entries until the cache fits into max_bytes.
+    Returns the size of the cache afterwards."""
+    cache_dir = cache_dir or STRUCTURE_CACHE_DIR
+    max_bytes = STRUCTURE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    total_bytes = 0
+    for root, _, files in os.walk(cache_dir):
+        for file_name in files:
+            if not file_name.endswith(tuple(CACHE_FILE_EXTENSIONS.values())):
+                continue
+            file_path = os.path.join(root, file_name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_path))
+            total_bytes += stat.st_size
+
+    entries.sort()
+    for _, size, file_path in entries:
+        if total_bytes <= max_bytes:
+            break
+        try:
+            # open readers keep their file handle, later readers simply rebuild
+            os.remove(file_path)
+        except OSError:
+            continue
+        total_bytes -= size
+    return total_bytes
+
+
+def track_structure_cache_write(written_bytes, cache_dir=None, max_bytes=None):
+    """
+    Account for an entry written to the cache and evict once the cache may have outgrown
+    max_bytes, instead of measuring the whole cache after every write. The estimate is the
+    size measured last plus what this process wrote since, other processes also write, so the
+    cache is measured again after this process wrote a sixteenth of max_bytes.
+    """
+    cache_dir = cache_dir or STRUCTURE_CACHE_DIR
+    max_bytes = STRUCTURE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    with _cache_sizes_lock:
+        size = _cache_sizes.get(cache_dir)
+        if size is not None:
+            size[0] += written_bytes
+            size[1] += written_bytes
+            if size[0] <= max_bytes and size[1] <= max_bytes // 16:
+                return
+    # concurrent writers may both measure, each removes what is left over
+    total_bytes = evict_structure_cache(cache_dir, max_bytes)
+    with _cache_sizes_lock:
+        _cache_sizes[cache_dir] = [total_bytes, 0]
+
+
+def find_closest_cached_commit(repo_name, commit_id, mirror_path, cache_dir=None):
+    """
+    Find the commit closest to commit_id, in number of commits, whose base structure is cached.
+
+    Arguments:
+    repo_name -- upstream repository name, e.g. django/django
+    commit_id -- the commit a structure is needed for
+    mirror_path -- bare repository containing the commits
+    cache_dir -- the cache root, defaults to STRUCTURE_CACHE_DIR
+
+    Returns:
+    (commit, cache path) of the closest cached structure, or None
+    """
+    repo_cache_dir = os.path.dirname(
+        get_structure_cache_path(repo_name, commit_id, cache_dir=cache_dir)
+    )
+    suffix = "_base" + CACHE_FILE_EXTENSIONS[STRUCTURE_CACHE_FORMAT]
+    candidates = []
+    try:
+        for file_name in os.listdir(repo_cache_dir):
+            if file_name.endswith(suffix) and not file_name.startswith(commit_id):
+                file_path = os.path.join(repo_cache_dir, file_name)
+                candidates.append((os.path.getmtime(file_path), file_name[: -len(suffix)], file_path))
+    except OSError:
+        return None
+
+    closest = None
+    for _, candidate_commit, file_path in sorted(candidates, reverse=True)[:MAX_REUSE_CANDIDATES]:
+        if not has_commit(mirror_path, candidate_commit):
+            continue
+        result = subprocess.run(
+            ["git", "-C", mirror_path, "rev-list", "--count", f"{candidate_commit}...{commit_id}"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        if result.returncode != 0:
+            continue
+        distance = int(result.stdout)
+        if closest is None or distance < closest[0]:
+            closest = (distance, candidate_commit, file_path)
+    return closest[1:] if closest is not None else None
+
+
+def derive_from_cached_commit(repo_name, commit_id):
+    """Build the structure of a commit from the closest cached commit of the same repository,
+    re-parsing only the files that differ. Returns None if there is nothing to start from."""
+    mirror_path = ensure_mirror(repo_name, commit_id)
+    if mirror_path is None:
+        return None
+    closest = find_closest_cached_commit(repo_name, commit_id, mirror_path)
+    if closest is None:
+        return None
+    base_commit, cache_path = closest
+    base_d = load_cached_structure(cache_path)
+    if base_d is None:
+        return None
+    print(f"Deriving the structure of {commit_id} from {base_commit}...")
+    return update_structure_to_commit(
+        base_d["structure"],
+        repo_name,
+        mirror_path,
+        base_commit,
+        commit_id,
+        lazy=STRUCTURE_LAZY,
+    )
+
+
+def build_project_structure(repo_name, commit_id, instance_id, repo_playground, **kwargs):
+    """Build the structure of a commit without a patch, from the closest cached commit if
+    there is one."""
+    if REPO_MIRROR_DIR is not None and STRUCTURE_CACHE_DIR is not None:
+        structure = derive_from_cached_commit(repo_name, commit_id)
+        if structure is not None:
+            return {
+                "repo": repo_name,
+                "base_commit": commit_id,
+                "structure": structure,
+                "instance_id": instance_id,
+            }
+    return get_project_structure_from_scratch(
+        repo_name, commit_id, instance_id, repo_playground, **kwargs
+    )
+
+
+def copy_structure_dirs(structure):
+    """Copy the directories of a structure, sharing the file entries, so that the copy can be
+    filtered in place (filter_none_python, ...) without changing the original."""
+    copied = {}
+    for name, content in structure.items():
+        if isinstance(content, dict) and content.keys() != FILE_ENTRY_KEYS:
+            copied[name] = copy_structure_dirs(content)
+        else:
+            copied[name] = content
+    return copied
+
+
+def get_base_structure_in_process(repo_name, commit_id, instance_id, repo_playground, **kwargs):
+    """The base structure of a commit, built once per process and kept for the
+    MAX_IN_PROCESS_BASES most recent commits. Every caller gets its own directories."""
+    key = (repo_name, commit_id)
+    with _base_structures_lock:
+        build_lock = _base_build_locks.setdefault(key, threading.Lock())
+    # only one thread builds a given base, the others wait for it
+    with build_lock:
+        with _base_structures_lock:
+            d = _base_structures.get(key)
+            if d is not None:
+                _base_structures.move_to_end(key)
+        if d is None:
+            d = build_project_structure(
+                repo_name, commit_id, instance_id, repo_playground, **kwargs
+            )
+            with _base_structures_lock:
+                _base_structures[key] = d
+                while len(_base_structures) > MAX_IN_PROCESS_BASES:
+                    evicted, _ = _base_structures.popitem(last=False)
+                    _base_build_locks.pop(evicted, None)
+    d = dict(d, structure=copy_structure_dirs(d["structure"]))
+    d["instance_id"] = instance_id
+    return d
+
+
+def get_project_structure_cached(
+    repo_name, commit_id, instance_id, repo_playground, **kwargs
+):
+    """
+    Same as get_project_structure_from_scratch, but the structure of each (repo, commit) is
+    built once and then served from STRUCTURE_CACHE_DIR, or from the process without it.
+    A patched structure re-parses only the patched files on top of the base structure and
+    is not cached: each refine round has its own patch.
+    """
+    base_kwargs = {key: value for key, value in kwargs.items() if key != "model_patch"}
+    model_patch = kwargs.get("model_patch", "")
+    if model_patch:
+        base_d = get_project_structure_cached(
+            repo_name, commit_id, instance_id, repo_playground, **base_kwargs
+        )
+        structure = update_structure_with_patch(base_d["structure"], repo_name, model_patch)
+        if structure is not None:
+            return {
+                "repo": repo_name,
+                "base_commit": commit_id,
+                "structure": structure,
+                "instance_id": instance_id,
+            }
+        return get_project_structure_from_scratch(
+            repo_name, commit_id, instance_id, repo_playground, **kwargs
+        )
+
+    if STRUCTURE_CACHE_DIR is None:
+        return get_base_structure_in_process(
+            repo_name, commit_id, instance_id, repo_playground, **base_kwargs
+        )
+
+    cache_path = get_structure_cache_path(repo_name, commit_id)
+    d = load_cached_structure(cache_path)
+    if d is None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # only one thread or process builds a given structure, the others wait and read it
+        with FileLock(cache_path + ".lock"):
+            d = load_cached_structure(cache_path)
+            if d is None:
+                d = build_project_structure(
+                    repo_name, commit_id, instance_id, repo_playground, **base_kwargs
+                )
+                save_cached_structure(cache_path, d)
+                try:
+                    written_bytes = os.path.getsize(cache_path)
+                except OSError:
+                    written_bytes = 0
+                track_structure_cache_write(written_bytes)
+
+    # the entry may have been built for another instance of the same repository and commit
+    d["instance_id"] = instance_id
+    return d
@@ -0,0 +1,183 @@
+import json
+import mmap
+import os
+import struct
+import threading
+
+from get_repo_structure.get_repo_structure import FILE_ENTRY_KEYS, LazyFileEntry
+from patchpilot.util.utils import atomic_write
+
+# Read-only binary structure files, see write_structure_store for the layout.
+STORE_MAGIC = b"PPSTRUCT"
+STORE_VERSION = 1
+# version, header length
+PREFIX_FORMAT = struct.Struct("<IQ")
+# meta offset, meta length, text offset, text length, number of lines (-1: text is "")
+FILE_RECORD_FORMAT = struct.Struct("<QQQQq")
+# keep this many files mapped for new loads, older maps live as long as their entries
+MAX_OPEN_STORES = 64
+
+_open_stores = {}
+_open_stores_lock = threading.Lock()
+
+
+def _collect_files(structure, files):
+    """Replace every parsed file by its index in files, keeping the directory layout."""
+    skeleton = {}
+    for name, content in structure.items():
+        if isinstance(content, dict) and content.keys() == FILE_ENTRY_KEYS:
+            skeleton[name] = len(files)
+            files.append(content)
+        elif isinstance(content, dict):
+            skeleton[name] = _collect_files(content, files)
+        else:
+            skeleton[name] = content
+    return skeleton
+
+
+def write_structure_store(store_path, d):
+    """
+    Write a structure to a memory-mappable file. Layout:
+    magic | version, header length | header JSON | file table | heap
+    The header holds the fields of d besides the structure, the number of files and the
+    directory layout, where every parsed file is replaced by its row in the file table.
+    Each row points to the JSON of the file's classes, functions and imports and to its
+    lines joined by newlines, both in the heap.
+
+    Arguments:
+    store_path -- file to write, replaced atomically
+    d -- dict with the structure under "structure", as returned by get_project_structure_from_scratch
+    """
+    files = []
+    header = {key: value for key, value in d.items() if key != "structure"}
+    header["structure"] = _collect_files(d["structure"], files)
+    header["num_files"] = len(files)
+    header_bytes = json.dumps(header).encode("utf-8")
+
+    heap_offset = (
+        len(STORE_MAGIC)
+        + PREFIX_FORMAT.size
+        + len(header_bytes)
+        + FILE_RECORD_FORMAT.size * len(files)
+    )
+    table = []
+    heap = []
+    for content in files:
+        meta = json.dumps(
+            {
+                "classes": content["classes"],
+                "functions": content["functions"],
+                "imports": content["imports"],
+                "import_interval": content["import_interval"],
+            }
+        ).encode("utf-8")
+        text = content["text"]
+        if isinstance(text, list):
+            # str.splitlines() lines never contain a newline
+            text_bytes = "\n".join(text).encode("utf-8", "surrogatepass")
+            num_lines = len(text)
+        else:
+            text_bytes = b""
+            num_lines = -1
+        table.append(
+            FILE_RECORD_FORMAT.pack(
+                heap_offset,
+                len(meta),
+                heap_offset + len(meta),
+                len(text_bytes),
+                num_lines,
+            )
+        )
+        heap.append(meta)
+        heap.append(text_bytes)
+        heap_offset += len(meta) + len(text_bytes)
+
+    atomic_write(
+        store_path,
+        b"".join(
+            [
+                STORE_MAGIC,
+                PREFIX_FORMAT.pack(STORE_VERSION, len(header_bytes)),
+                header_bytes,
+            ]
+            + table
+            + heap
+        ),
+        mode="wb",
+    )
+
+
+def _map_store(store_path):
+    """Map the store read-only, sharing one map per file within the process."""
+    stat = os.stat(store_path)
+    # not the mtime, which the cache touches on every load. Stores are replaced atomically,
+    # so a new store is a new inode, and a mapped inode cannot be reused while it is mapped
+    key = (store_path, stat.st_ino, stat.st_size)
+    with _open_stores_lock:
+        mm = _open_stores.get(key)
+        if mm is None:
+            with open(store_path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(_open_stores) >= MAX_OPEN_STORES:
+                # not closed, lazy entries of loaded structures may still read from it
+                _open_stores.pop(next(iter(_open_stores)))
+            _open_stores[key] = mm
+    return mm
+
+
+def _read_file(mm, record_offset):
+    meta_offset, meta_length, text_offset, text_length, num_lines = (
+        FILE_RECORD_FORMAT.unpack_from(mm, record_offset)
+    )
+    meta = json.loads(mm[meta_offset : meta_offset + meta_length])
+    if num_lines < 0:
+        text = ""
+    elif num_lines == 0:
+        text = []
+    else:
+        text = (
+            mm[text_offset : text_offset + text_length]
+            .decode("utf-8", "surrogatepass")
+            .split("\n")
+        )
+    return meta["classes"], meta["functions"], text, meta["imports"], meta["import_interval"]
+
+
+def _build_structure(skeleton, mm, table_offset):
+    structure = {}
+    for name, content in skeleton.items():
+        if isinstance(content, int):
+            record_offset = table_offset + content * FILE_RECORD_FORMAT.size
+            structure[name] = LazyFileEntry(lambda r=record_offset: _read_file(mm, r))
+        elif isinstance(content, dict):
+            structure[name] = _build_structure(content, mm, table_offset)
+        else:
+            structure[name] = content
+    return structure
+
+
+def load_structure_store(store_path):
+    """
+    Load a structure written by write_structure_store. Only the directory layout is read,
+    files are decoded from the shared memory map when first used (see LazyFileEntry), so the
+    pages are shared by all threads and processes reading the same store.
+
+    Arguments:
+    store_path -- file written by write_structure_store
+
+    Returns:
+    The dict that was written, with a fresh structure of lazy file entries
+    """
+    mm = _map_store(store_path)
+    if mm[: len(STORE_MAGIC)] != STORE_MAGIC:
+        raise ValueError(f"{store_path} is not a structure store")
+    version, header_length = PREFIX_FORMAT.unpack_from(mm, len(STORE_MAGIC))
+    if version != STORE_VERSION:
+        raise ValueError(f"{store_path} has unsupported version {version}")
+    header_offset = len(STORE_MAGIC) + PREFIX_FORMAT.size
+    d = json.loads(mm[header_offset : header_offset + header_length])
+    d["structure"] = _build_structure(
+        d["structure"], mm, header_offset + header_length
+    )
+    del d["num_files"]
+    return d
@@ -6,6 +6,7 @@ import contextlib
 import subprocess
 import glob
 import re
+import tempfile
 from collections import defaultdict
 from os.path import dirname as pdirname
 from os.path import join as pjoin
@@ -53,6 +54,27 @@ def load_json(filepath):
     return json.load(open(filepath, "r"))
 
 
+def atomic_write(filepath, data, mode="w"):
+    """
+    Write data to filepath atomically: readers see either the old or the new file, never a partial one.
+
+    Arguments:
+    filepath -- the path of the file to write
+    data -- the str (or bytes with mode="wb") to write
+    """
+    dir_path = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(dir_path, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def combine_by_instance_id(data):
     """
     Combine data entries by their instance ID.
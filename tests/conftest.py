@@ -0,0 +1,46 @@
+import subprocess
+
+import pytest
+
+
+class GitRepo:
+    """A throwaway git repository whose commits are made from {path: content} snapshots."""
+
+    def __init__(self, path):
+        self.path = path
+        self.git("init", "-q")
+
+    def git(self, *args, input=None):
+        return subprocess.run(
+            [
+                "git",
+                "-c", "user.name=test",
+                "-c", "user.email=test@example.com",
+                "-c", "commit.gpgsign=false",
+                *args,
+            ],
+            cwd=self.path,
+            input=input,
+            stdout=subprocess.PIPE,
+            check=True,
+            text=True,
+        ).stdout
+
+    def commit(self, files):
+        """Make the working tree contain exactly files and commit it, returning the sha."""
+        self.git("rm", "-rq", "--ignore-unmatch", ".")
+        for path, content in files.items():
+            file_path = self.path / path
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            file_path.write_text(content)
+        self.git("add", "-A")
+        self.git("commit", "-q", "--allow-empty", "-m", "snapshot")
+        return self.git("rev-parse", "HEAD").strip()
+
+
+@pytest.fixture
+def git_repo(tmp_path):
+    # the checkout is named like the top folder of a known repository, see repo_to_top_folder
+    path = tmp_path / "django"
+    path.mkdir()
+    return GitRepo(path)
@@ -0,0 +1,73 @@
+import os
+import random
+import sysconfig
+
+import libcst as cst
+import pytest
+from libcst.metadata import MetadataWrapper
+
+from patchpilot.util.compress_file import (
+    choose_compression_levels,
+    compress_module,
+    compress_source,
+)
+from patchpilot.util.get_function_interval import collect_function_intervals
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STDLIB_DIR = sysconfig.get_paths()["stdlib"]
+# standard library modules with decorators, nested classes, docstrings, f-strings and
+# implicit string concatenation, besides the sources of this repository
+STDLIB_MODULES = [
+    "enum.py",
+    "functools.py",
+    "json/decoder.py",
+    "string.py",
+    "textwrap.py",
+]
+# functions left out per file, as FL leaves out the functions it has already shown
+NUM_DELETED = 3
+
+
+def get_corpus():
+    paths = []
+    for package in ("patchpilot", "get_repo_structure", "useful_scripts", "tests"):
+        for root, _, files in os.walk(os.path.join(REPO_DIR, package)):
+            paths.extend(
+                os.path.relpath(os.path.join(root, name), REPO_DIR)
+                for name in files
+                if name.endswith(".py")
+            )
+    paths.extend(
+        os.path.join(STDLIB_DIR, module)
+        for module in STDLIB_MODULES
+        if os.path.exists(os.path.join(STDLIB_DIR, module))
+    )
+    return sorted(paths)
+
+
+@pytest.mark.parametrize("path", get_corpus())
+def test_skeleton_backends_match(path):
+    with open(os.path.join(REPO_DIR, path)) as f:
+        content = f.read()
+    wrapper = MetadataWrapper(cst.parse_module(content))
+    start_lines = [interval[0] for interval in collect_function_intervals(wrapper).values()]
+    deleted = random.Random(os.path.basename(path)).sample(
+        start_lines, min(NUM_DELETED, len(start_lines))
+    )
+    # the options FL uses: all constants kept, then the functions already shown left out
+    for keep_constant, delete_func_start_lines in ((True, []), (False, deleted)):
+        assert compress_source(
+            content, keep_constant, delete_func_start_lines
+        ) == compress_module(wrapper, keep_constant, delete_func_start_lines)
+
+
+def test_choose_compression_levels():
+    # all at their largest level when they fit
+    assert choose_compression_levels([[10, 5, 1], [10, 5, 1]], 20) == [0, 0]
+    # the earlier files keep more
+    assert choose_compression_levels([[10, 5, 1], [10, 5, 1]], 15) == [0, 1]
+    assert choose_compression_levels([[10, 5, 1], [10, 5, 1]], 11) == [0, 2]
+    assert choose_compression_levels([[10, 5, 1], [10, 5, 1], [10, 5, 1]], 9) == [1, 2, 2]
+    # files are left out from the end once even their names do not fit
+    assert choose_compression_levels([[10, 5, 1], [10, 5, 1], [10, 5, 1]], 2) == [2, 2, None]
+    assert choose_compression_levels([[10, 5, 3]], 1) == [2]
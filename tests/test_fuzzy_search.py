@@ -0,0 +1,20 @@
+import pytest
+
+from patchpilot.util import fuzzy_search as fuzzy_search_module
+from patchpilot.util.fuzzy_search import fuzzy_search
+from patchpilot.util.repo_index import ContentIndex
+
+CONTENTS = {
+    f"pkg/mod{i}.py": [f"def f{i}(value):", "    raise ValueError('bad value')"] * (i % 3)
+    for i in range(12)
+}
+
+
+@pytest.mark.parametrize("timeout", [0, 60])
+def test_fuzzy_search_in_workers_searches_every_file(monkeypatch, timeout):
+    content_index = ContentIndex({path: {"text": lines} for path, lines in CONTENTS.items()})
+    expected = fuzzy_search(content_index, "bad valeu", 3, num_workers=1)
+    assert expected
+    monkeypatch.setattr(fuzzy_search_module, "MIN_PARALLEL_CHARS", 0)
+    # the files the workers have not aligned when the budget runs out are aligned serially
+    assert fuzzy_search(content_index, "bad valeu", 3, num_workers=2, timeout=timeout) == expected
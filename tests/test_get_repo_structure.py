@@ -0,0 +1,67 @@
+import pytest
+
+from get_repo_structure.get_repo_structure import (
+    create_structure,
+    create_structure_from_git,
+    update_structure_to_commit,
+)
+
+REPO_NAME = "django/django"
+TOP_FOLDER = "django"
+
+SNAPSHOTS = {
+    "root files": {
+        "setup.py": "import os\n",
+        "README.rst": "docs\n",
+        "pkg/__init__.py": "",
+        "pkg/mod.py": "class A:\n    def f(self):\n        return 1\n\n\ndef g():\n    pass\n",
+    },
+    "empty root": {
+        "pkg/__init__.py": "",
+        "pkg/sub/mod.py": "def f():\n    pass\n",
+    },
+    "directory named like the top folder": {
+        "setup.py": "x = 1\n",
+        "django/__init__.py": "VERSION = 1\n",
+        "django/setup.py": "y = 2\n",
+    },
+}
+
+
+@pytest.mark.parametrize("files", SNAPSHOTS.values(), ids=SNAPSHOTS.keys())
+def test_structure_from_git_matches_checkout(git_repo, files):
+    commit = git_repo.commit(files)
+    expected = create_structure(str(git_repo.path), num_workers=1)
+    structure = create_structure_from_git(
+        str(git_repo.path / ".git"), commit, TOP_FOLDER, num_workers=1
+    )
+    assert structure == expected
+    assert list(structure) == list(expected)
+
+
+@pytest.mark.parametrize("base", SNAPSHOTS, ids=SNAPSHOTS.keys())
+@pytest.mark.parametrize("target", SNAPSHOTS, ids=SNAPSHOTS.keys())
+def test_structure_to_commit_matches_checkout(git_repo, base, target):
+    base_commit = git_repo.commit(SNAPSHOTS[base])
+    base_structure = create_structure(str(git_repo.path), num_workers=1)
+    target_commit = git_repo.commit(SNAPSHOTS[target])
+    expected = create_structure(str(git_repo.path), num_workers=1)
+    structure = update_structure_to_commit(
+        base_structure, REPO_NAME, str(git_repo.path / ".git"), base_commit, target_commit,
+        num_workers=1,
+    )
+    assert structure == expected
+    assert list(structure) == list(expected)
+
+
+def test_structure_to_commit_adds_missing_top_folder(git_repo):
+    # structures built by older versions of create_structure_from_git had no empty top folder
+    base_commit = git_repo.commit(SNAPSHOTS["empty root"])
+    base_structure = create_structure(str(git_repo.path), num_workers=1)
+    del base_structure[TOP_FOLDER]
+    target_commit = git_repo.commit({**SNAPSHOTS["empty root"], "pkg/new.py": "z = 3\n"})
+    structure = update_structure_to_commit(
+        base_structure, REPO_NAME, str(git_repo.path / ".git"), base_commit, target_commit,
+        num_workers=1,
+    )
+    assert structure == create_structure(str(git_repo.path), num_workers=1)
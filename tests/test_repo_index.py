@@ -0,0 +1,175 @@
+import random
+
+import pytest
+
+from fuzzysearch import find_near_matches
+
+from patchpilot.util.fuzzy_search import fuzzy_search
+from get_repo_structure.get_repo_structure import create_structure
+from patchpilot.util import repo_index
+from patchpilot.util.preprocess_data import correct_file_paths, iter_python_files
+from patchpilot.util.repo_index import ContentIndex, PathIndex, RepoIndex
+
+
+def linear_correct_file_paths(model_found_files, files, include_partial_paths=True):
+    """correct_file_paths as it was before PathIndex, comparing each path to every file."""
+    found_files = []
+    for model_file in model_found_files:
+        if not model_file:
+            continue
+        found_match = False
+        for file_content in files:
+            file = file_content[0]
+            if model_file == file:
+                found_files.append(file)
+                found_match = True
+        if include_partial_paths and not found_match:
+            for file_content in files:
+                file = file_content[0]
+                if file.endswith(model_file) or model_file.endswith(file):
+                    found_files.append(file)
+                    break
+    return found_files
+
+
+def indexed_correct_file_paths(model_found_files, files, include_partial_paths=True):
+    path_index = PathIndex(files)
+    found_files = []
+    for model_file in model_found_files:
+        if model_file:
+            found_files.extend(path_index.find(model_file, include_partial_paths))
+    return found_files
+
+
+FILES = [
+    ("django/db/models/query.py",),
+    ("django/db/models/sql/query.py",),
+    ("tests/queries/test_query.py",),
+    ("django/contrib/admin/utils.py",),
+    ("django/utils/__init__.py",),
+    ("django/db/utils.py",),
+    ("django/db/models/query.py",),
+    ("setup.py",),
+]
+
+PROPOSED = {
+    "exact": ["django/db/utils.py"],
+    "exact duplicated": ["django/db/models/query.py"],
+    "suffix": ["models/sql/query.py", "sql/query.py"],
+    "ambiguous basename": ["query.py", "utils.py"],
+    "ambiguous partial basename": ["ry.py", "ls.py"],
+    "proposed path ends with a file": ["repo/django/db/utils.py", "x/setup.py"],
+    "missing": ["django/db/missing.py", "missing"],
+    "empty": ["", "setup.py"],
+}
+
+
+@pytest.mark.parametrize("include_partial_paths", [True, False])
+@pytest.mark.parametrize("proposed", PROPOSED.values(), ids=PROPOSED.keys())
+def test_path_index_matches_linear_search(proposed, include_partial_paths):
+    assert indexed_correct_file_paths(
+        proposed, FILES, include_partial_paths
+    ) == linear_correct_file_paths(proposed, FILES, include_partial_paths)
+
+
+def test_path_index_cases():
+    path_index = PathIndex(FILES)
+    assert path_index.find("sql/query.py") == ["django/db/models/sql/query.py"]
+    # the first file in order wins among files sharing a base name
+    assert path_index.find("query.py") == ["django/db/models/query.py"]
+    assert path_index.find("django/db/models/query.py") == ["django/db/models/query.py"] * 2
+    assert path_index.find("django/db/missing.py") == []
+    assert path_index.find("query.py", include_partial_paths=False) == []
+    assert path_index.find_by_basename("utils.py") == [
+        "django/contrib/admin/utils.py",
+        "django/db/utils.py",
+    ]
+    assert path_index.find_by_basename("missing.py") == []
+
+
+def test_path_index_of_lazy_structure_parses_nothing(tmp_path):
+    for path in ("pkg/a.py", "pkg/sub/b.py", "c.py"):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("def f():\n    pass\n")
+    structure = create_structure(str(tmp_path), num_workers=1, lazy=True)
+    path_index = RepoIndex(structure).get_path_index()
+    assert correct_file_paths(["sub/b.py", "c.py"], path_index) == [
+        "pkg/sub/b.py",
+        f"{tmp_path.name}/c.py",
+    ]
+    assert not any(entry.loaded for _, entry in iter_python_files(structure))
+
+
+def test_path_index_matches_linear_search_on_random_files():
+    rng = random.Random(0)
+    parts = ["a", "b", "ab", "ba", "utils", "x.py", "b.py", "ab.py"]
+    for _ in range(200):
+        files = [
+            ("/".join(rng.choice(parts) for _ in range(rng.randint(1, 4))),)
+            for _ in range(rng.randint(0, 12))
+        ]
+        proposed = [
+            "/".join(rng.choice(parts) for _ in range(rng.randint(1, 3)))[rng.randint(0, 2):]
+            for _ in range(6)
+        ]
+        assert indexed_correct_file_paths(proposed, files) == linear_correct_file_paths(
+            proposed, files
+        )
+
+
+CONTENTS = {
+    "pkg/a.py": ["def parse(value):", "    raise ValueError('bad value')", ""],
+    "pkg/b.py": ["x = 'bad value' + 'bad value'", "y = 'bda value'"],
+    "pkg/c.py": [],
+    "pkg/d.py": ["ab", "abab", "aab"],
+    "pkg/e.py": ["raise ValueError(f'bad {value}')"],
+}
+QUERIES = ["bad value", "ValueError(", "ab", "a", "not there", "\nab", "'bad", "bad value"]
+
+
+def linear_count_occurrences(queries):
+    """The occurrences search_string counted before the contents were indexed."""
+    occurrences = {query: {} for query in queries}
+    for query in queries:
+        for path, lines in CONTENTS.items():
+            content = "\n".join(lines)
+            if query in content:
+                occurrences[query][path] = content.count(query)
+    return occurrences
+
+
+def get_content_index(indexed):
+    content_index = ContentIndex({path: {"text": lines} for path, lines in CONTENTS.items()})
+    if indexed:
+        content_index.get_qgram_files(2)
+        content_index.get_qgram_files(3)
+    return content_index
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_content_index_matches_linear_scan(indexed):
+    content_index = get_content_index(indexed)
+    assert content_index.count_occurrences(QUERIES) == linear_count_occurrences(QUERIES)
+    assert content_index.has_qgram_files(3) == indexed
+
+
+def test_content_index_built_for_large_batches(monkeypatch):
+    content_index = get_content_index(indexed=False)
+    content_index.count_occurrences(QUERIES[:2])
+    assert not content_index.has_qgram_files(3)
+    monkeypatch.setattr(repo_index, "MIN_INDEXED_QUERIES", 3)
+    assert content_index.count_occurrences(QUERIES) == linear_count_occurrences(QUERIES)
+    assert content_index.has_qgram_files(3)
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+@pytest.mark.parametrize("query", ["bad valeu", "VelueError", "parse(valu)", "zzzzzz"])
+def test_fuzzy_search_matches_linear_scan(indexed, query):
+    max_l_dist = min(len(query) // 3, 9)
+    counts = {}
+    for path, lines in CONTENTS.items():
+        count = len(find_near_matches(query, "\n".join(lines), max_l_dist=max_l_dist))
+        if count:
+            counts[path] = count
+    expected = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    assert fuzzy_search(get_content_index(indexed), query, max_l_dist, num_workers=1) == expected
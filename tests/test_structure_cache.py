@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+
+import pytest
+
+from patchpilot.util import structure_cache
+from patchpilot.util.structure_cache import (
+    get_project_structure_cached,
+    get_structure_cache_path,
+    track_structure_cache_write,
+)
+
+REPO_NAME = "django/django"
+
+
+@pytest.fixture
+def builds(tmp_path, monkeypatch):
+    """Serve structures from a fresh cache in tmp_path, recording every structure built."""
+    built = []
+
+    def build(repo_name, commit_id, instance_id, repo_playground, **kwargs):
+        built.append(commit_id)
+        time.sleep(0.05)  # long enough for concurrent callers to wait for the lock
+        return {
+            "repo": repo_name,
+            "base_commit": commit_id,
+            # grows with the commit, so that entries have different sizes
+            "structure": {"django": {"setup.py": {}, commit_id: {}}},
+            "instance_id": instance_id,
+        }
+
+    monkeypatch.setattr(structure_cache, "STRUCTURE_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(structure_cache, "REPO_MIRROR_DIR", None)
+    monkeypatch.setattr(structure_cache, "get_project_structure_from_scratch", build)
+    monkeypatch.setattr(structure_cache, "_cache_sizes", {})
+    return built
+
+
+def get(commit_id, instance_id="django__django-1"):
+    return get_project_structure_cached(REPO_NAME, commit_id, instance_id, "playground")
+
+
+def test_miss_builds_and_hit_loads(builds):
+    d = get("c1")
+    assert builds == ["c1"]
+    cache_path = get_structure_cache_path(REPO_NAME, "c1")
+    assert os.path.exists(cache_path)
+    # the write is atomic, no temporary file is left next to the entry
+    assert sorted(os.listdir(os.path.dirname(cache_path))) == ["c1_base.json", "c1_base.json.lock"]
+
+    hit = get("c1", instance_id="django__django-2")
+    assert builds == ["c1"]
+    assert hit["structure"] == d["structure"]
+    assert hit["instance_id"] == "django__django-2"
+
+
+def test_concurrent_misses_build_once(builds):
+    results = [None] * 4
+
+    def worker(i):
+        results[i] = get("c1")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert builds == ["c1"]
+    assert all(result["structure"] == results[0]["structure"] for result in results)
+
+
+def test_least_recently_used_entries_are_evicted(builds, monkeypatch):
+    get("c1")
+    entry_bytes = os.path.getsize(get_structure_cache_path(REPO_NAME, "c1"))
+    # room for two entries
+    monkeypatch.setattr(structure_cache, "STRUCTURE_CACHE_MAX_BYTES", entry_bytes * 2 + 1)
+    get("c2")
+    for commit_id, age in (("c1", 20), ("c2", 10)):
+        past = time.time() - age
+        os.utime(get_structure_cache_path(REPO_NAME, commit_id), (past, past))
+    # a hit makes c1 the most recently used entry
+    get("c1")
+    get("c3")
+    assert builds == ["c1", "c2", "c3"]
+    assert os.path.exists(get_structure_cache_path(REPO_NAME, "c1"))
+    assert not os.path.exists(get_structure_cache_path(REPO_NAME, "c2"))
+    assert os.path.exists(get_structure_cache_path(REPO_NAME, "c3"))
+
+    get("c2")
+    assert builds == ["c1", "c2", "c3", "c2"]
+
+
+def test_cache_is_only_measured_when_it_may_be_full(tmp_path, monkeypatch):
+    scans = []
+    monkeypatch.setattr(structure_cache, "_cache_sizes", {})
+    monkeypatch.setattr(
+        structure_cache,
+        "evict_structure_cache",
+        lambda cache_dir, max_bytes: scans.append(cache_dir) or 0,
+    )
+    cache_dir = str(tmp_path)
+    # the first write measures the cache
+    track_structure_cache_write(100, cache_dir, max_bytes=16000)
+    assert len(scans) == 1
+    for _ in range(9):
+        track_structure_cache_write(100, cache_dir, max_bytes=16000)
+    assert len(scans) == 1
+    # this process wrote more than a sixteenth of the limit since it measured
+    track_structure_cache_write(200, cache_dir, max_bytes=16000)
+    assert len(scans) == 2
+    # the estimate is over the limit
+    track_structure_cache_write(20000, cache_dir, max_bytes=16000)
+    assert len(scans) == 3
@@ -0,0 +1,114 @@
+import copy
+
+import pytest
+
+from get_repo_structure.get_repo_structure import (
+    apply_hunks,
+    apply_patch,
+    create_structure,
+    parse_patch_files,
+    update_structure_with_patch,
+)
+
+REPO_NAME = "django/django"
+
+BASE = {
+    "setup.py": "import os\n",
+    "pkg/__init__.py": "",
+    "pkg/mod.py": "class A:\n    def f(self):\n        return 1\n\n\ndef g():\n    pass\n",
+    "pkg/old.py": "def old():\n    return 0\n",
+    "pkg/sub/only.py": "X = 1\n",
+    "pkg/tail.py": "def tail():\n    return 2",
+    "docs/index.rst": "docs\n",
+}
+
+CHANGES = {
+    "add": {**BASE, "pkg/new.py": "def new():\n    return 3\n", "pkg/deep/er/x.py": "Y = 2\n"},
+    "delete": {key: value for key, value in BASE.items() if key != "pkg/sub/only.py"},
+    "rename": {
+        **{key: value for key, value in BASE.items() if key != "pkg/old.py"},
+        "pkg/renamed.py": BASE["pkg/old.py"],
+    },
+    "modify": {
+        **BASE,
+        "pkg/mod.py": "class A:\n    def f(self):\n        return 1\n\n    def h(self):\n"
+        "        return 4\n\n\ndef g():\n    return 5\n",
+        "setup.py": "import os\nimport sys\n",
+    },
+    "no newline": {
+        **BASE,
+        "pkg/tail.py": "def tail():\n    return 3",
+        "pkg/old.py": "def old():\n    return 0",
+    },
+}
+
+
+def rebuild(git_repo, base_commit, patch):
+    """The structure of a checkout of base_commit with the patch applied by git."""
+    git_repo.git("checkout", "-qf", base_commit)
+    git_repo.git("clean", "-qfdx")
+    apply_patch(str(git_repo.path), patch)
+    return create_structure(str(git_repo.path), num_workers=1)
+
+
+@pytest.mark.parametrize("files", CHANGES.values(), ids=CHANGES.keys())
+def test_patched_structure_matches_rebuild(git_repo, files):
+    base_commit = git_repo.commit(BASE)
+    base_structure = create_structure(str(git_repo.path), num_workers=1)
+    original_base = copy.deepcopy(base_structure)
+    target_commit = git_repo.commit(files)
+    # renames are split into a deletion and an addition, which are applied incrementally
+    patch = git_repo.git("diff", "--no-renames", base_commit, target_commit)
+
+    structure = update_structure_with_patch(base_structure, REPO_NAME, patch)
+    assert structure is not None
+    assert structure == rebuild(git_repo, base_commit, patch)
+    # the base structure is left untouched
+    assert base_structure == original_base
+
+
+def test_rename_patch_falls_back_to_git(git_repo):
+    base_commit = git_repo.commit(BASE)
+    base_structure = create_structure(str(git_repo.path), num_workers=1)
+    target_commit = git_repo.commit(CHANGES["rename"])
+    patch = git_repo.git("diff", "-M", base_commit, target_commit)
+    assert "rename from" in patch
+    assert parse_patch_files(patch) is None
+    assert update_structure_with_patch(base_structure, REPO_NAME, patch) is None
+
+
+def test_parse_patch_files_no_newline():
+    patch = (
+        "diff --git a/pkg/tail.py b/pkg/tail.py\n"
+        "--- a/pkg/tail.py\n"
+        "+++ b/pkg/tail.py\n"
+        "@@ -1,2 +1,2 @@\n"
+        " def tail():\n"
+        "-    return 2\n"
+        "\\ No newline at end of file\n"
+        "+    return 3\n"
+        "\\ No newline at end of file\n"
+    )
+    [file_patch] = parse_patch_files(patch)
+    assert (file_patch["old_path"], file_patch["new_path"]) == ("pkg/tail.py", "pkg/tail.py")
+    [hunk] = file_patch["hunks"]
+    assert hunk["old_lines"] == ["def tail():", "    return 2"]
+    assert hunk["new_lines"] == ["def tail():", "    return 3"]
+    assert apply_hunks(["def tail():", "    return 2"], file_patch["hunks"]) == [
+        "def tail():",
+        "    return 3",
+    ]
+
+
+def test_apply_hunks_at_offset():
+    lines = ["a", "b", "c", "d", "e", "f"]
+    # the header says line 2, the context is found two lines further down
+    hunk = {
+        "old_start": 2,
+        "new_start": 2,
+        "old_lines": ["c", "d", "e"],
+        "new_lines": ["c", "D", "e"],
+        "trailing": 1,
+    }
+    assert apply_hunks(lines, [hunk]) == ["a", "b", "c", "D", "e", "f"]
+    assert apply_hunks(lines, [dict(hunk, old_lines=["c", "x", "e"])]) is None
@@ -0,0 +1,53 @@
+import argparse
+import time
+
+from get_repo_structure.get_repo_structure import parse_python_file
+
+
+def make_module(num_defs):
+    """Generate a module with num_defs top level definitions, every fourth one a class with methods."""
+    lines = ["import os", "from collections import OrderedDict", ""]
+    for i in range(num_defs // 10):
+        lines.append(f"CONST_{i} = {i}")
+    lines.append("")
+    for i in range(num_defs):
+        if i % 4 == 0:
+            lines.append(f"class Class{i}:")
+            for j in range(3):
+                lines.append(f"    def method_{j}(self, x):")
+                lines.append(f"        y = x + CONST_{i % max(1, num_defs // 10)}")
+                lines.append("        return y")
+        else:
+            lines.append(f"def func_{i}(a, b):")
+            lines.append(f"    total = a + b + CONST_{i % max(1, num_defs // 10)}")
+            lines.append("    for k in range(total):")
+            lines.append("        total += k")
+            lines.append("    return total")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[500, 1000, 2000, 4000, 8000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'defs':>8} {'lines':>8} {'seconds':>10} {'us/def':>10}")
+    for num_defs in args.sizes:
+        content = make_module(num_defs)
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            parse_python_file(f"synthetic_{num_defs}.py", content)
+            best = min(best, time.perf_counter() - start)
+        # time per definition stays flat when parsing scales linearly
+        print(
+            f"{num_defs:>8} {content.count(chr(10)) + 1:>8} {best:>10.3f} {best / num_defs * 1e6:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import glob
+import os
+import time
+
+import libcst as cst
+from libcst.metadata import MetadataWrapper
+
+from get_repo_structure.get_repo_structure import parse_python_file
+from patchpilot.util import source_model
+from patchpilot.util.compress_file import compress_module
+from patchpilot.util.get_function_interval import collect_function_intervals
+from patchpilot.util.parse_global_var import collect_global_vars
+from useful_scripts.benchmark_parse_python_file import make_module
+
+
+def analyze_separately(content):
+    """What localization and repair ran per file before the source model: one parse per analyzer."""
+    compress_module(MetadataWrapper(cst.parse_module(content)))
+    collect_function_intervals(MetadataWrapper(cst.parse_module(content)))
+    collect_global_vars(MetadataWrapper(cst.parse_module(content)))
+    parse_python_file("", content, with_text=False)
+
+
+def analyze_with_model(content):
+    model = source_model.get_source_model(content)
+    model.get_skeleton()
+    model.get_function_intervals()
+    model.get_global_vars()
+    model.get_definitions()
+
+
+def run_instance(contents, analyze, rounds):
+    """One instance analyzes its candidate files again for every sample and round."""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for content in contents:
+            analyze(content)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--repo_dir", type=str, default=None, help="analyze the Python files of this directory"
+    )
+    parser.add_argument("--num_files", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.repo_dir:
+        paths = sorted(glob.glob(os.path.join(args.repo_dir, "**", "*.py"), recursive=True))
+        contents = []
+        for path in paths[: args.num_files]:
+            with open(path, errors="replace") as f:
+                contents.append(f.read())
+    else:
+        contents = [make_module(200 + 20 * i) for i in range(args.num_files)]
+
+    separate = run_instance(contents, analyze_separately, args.rounds)
+    source_model._source_models.clear()
+    shared = run_instance(contents, analyze_with_model, args.rounds)
+    print(f"{len(contents)} files, {args.rounds} rounds per instance")
+    print(f"{'one parse per analyzer':>24} {separate:>8.2f} s")
+    print(f"{'shared source model':>24} {shared:>8.2f} s  ({separate / shared:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
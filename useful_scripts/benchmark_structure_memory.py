@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from get_repo_structure.get_repo_structure import create_structure, expand_structure
+
+
+def make_repo(repo_dir, num_packages, files_per_package, classes_per_file):
+    """Write a synthetic repository of packages full of classes with a few methods each."""
+    for p in range(num_packages):
+        package_dir = os.path.join(repo_dir, f"package_{p}")
+        os.makedirs(package_dir, exist_ok=True)
+        open(os.path.join(package_dir, "__init__.py"), "w").close()
+        for f in range(files_per_package):
+            lines = ["import os", "", "LIMIT = 10", ""]
+            for c in range(classes_per_file):
+                lines.append(f"class Class{c}:")
+                lines.append(f'    """Docstring of class {c} in module {f}."""')
+                for m in range(4):
+                    lines.append(f"    def method_{m}(self, value):")
+                    lines.append(f"        result = value * {m} + LIMIT")
+                    lines.append("        if result > os.getpid():")
+                    lines.append("            return result")
+                    lines.append("        return None")
+                lines.append("")
+                lines.append(f"def helper_{c}(x):")
+                lines.append("    return x + LIMIT")
+                lines.append("")
+            with open(os.path.join(package_dir, f"module_{f}.py"), "w") as fp:
+                fp.write("\n".join(lines))
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    structure = build()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return structure, current, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_packages", type=int, default=20)
+    parser.add_argument("--files_per_package", type=int, default=50)
+    parser.add_argument("--classes_per_file", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        repo_dir = os.path.join(tmp_dir, "synthetic")
+        make_repo(
+            repo_dir, args.num_packages, args.files_per_package, args.classes_per_file
+        )
+        compact, compact_current, compact_peak, compact_time = measure(
+            lambda: create_structure(repo_dir, num_workers=1)
+        )
+        compact_json = json.dumps(compact)
+        del compact
+        # the full format of the old create_structure, every symbol repeats its lines
+        full, full_current, full_peak, full_time = measure(
+            lambda: expand_structure(create_structure(repo_dir, num_workers=1))
+        )
+        full_json = json.dumps(full)
+        del full
+
+    # structures read back from the cache or PROJECT_FILE_LOC no longer share the line strings
+    _, full_loaded, _, full_load_time = measure(lambda: json.loads(full_json))
+    _, compact_loaded, _, compact_load_time = measure(lambda: json.loads(compact_json))
+
+    mb = 1024 * 1024
+    print(
+        f"{'format':>8} {'built MB':>9} {'peak MB':>8} {'build s':>8} "
+        f"{'json MB':>8} {'loaded MB':>10} {'load s':>7}"
+    )
+    for name, current, peak, build_time, dumped, loaded, load_time in [
+        ("full", full_current, full_peak, full_time, full_json, full_loaded, full_load_time),
+        ("compact", compact_current, compact_peak, compact_time, compact_json, compact_loaded, compact_load_time),
+    ]:
+        print(
+            f"{name:>8} {current / mb:>9.1f} {peak / mb:>8.1f} {build_time:>8.2f} "
+            f"{len(dumped) / mb:>8.1f} {loaded / mb:>10.1f} {load_time:>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import glob
+import os
+import random
+import time
+
+import libcst as cst
+from libcst.metadata import MetadataWrapper
+
+from patchpilot.util.compress_file import compress_module, compress_source
+from patchpilot.util.get_function_interval import collect_function_intervals
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that the ast skeleton backend reproduces CompressTransformer on the "
+        "Python files of a directory, and time both."
+    )
+    parser.add_argument("--repo_dir", type=str, required=True)
+    parser.add_argument("--num_deleted", type=int, default=3, help="functions left out per file")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--show", action="store_true", help="print the differing skeletons")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    paths = sorted(glob.glob(os.path.join(args.repo_dir, "**", "*.py"), recursive=True))
+    libcst_time = ast_time = 0.0
+    compared = unparsable = 0
+    mismatches = []
+    for path in paths:
+        with open(path, errors="replace") as f:
+            content = f.read()
+        start = time.perf_counter()
+        try:
+            wrapper = MetadataWrapper(cst.parse_module(content))
+        except Exception:
+            unparsable += 1
+            continue
+        libcst_time += time.perf_counter() - start
+        start_lines = [interval[0] for interval in collect_function_intervals(wrapper).values()]
+        deleted = rng.sample(start_lines, min(args.num_deleted, len(start_lines)))
+        # the options FL uses: all constants kept, then the functions already shown left out
+        for keep_constant, delete_func_start_lines in ((True, []), (False, deleted)):
+            start = time.perf_counter()
+            expected = compress_module(wrapper, keep_constant, delete_func_start_lines)
+            libcst_time += time.perf_counter() - start
+            start = time.perf_counter()
+            try:
+                skeleton = compress_source(content, keep_constant, delete_func_start_lines)
+            except Exception as e:
+                skeleton = f"{type(e).__name__}: {e}"
+            ast_time += time.perf_counter() - start
+            compared += 1
+            if skeleton != expected:
+                mismatches.append(path)
+                if args.show:
+                    print(f"==== {path} keep_constant={keep_constant}")
+                    print(f"---- libcst\n{expected}\n---- ast\n{skeleton}")
+
+    print(f"{len(paths)} files, {unparsable} not parsed by libcst, {compared} skeletons compared")
+    print(f"{len(mismatches)} differ" + "".join(f"\n  {path}" for path in sorted(set(mismatches))))
+    print(f"{'libcst (parse + compress)':>26} {libcst_time:>8.2f} s")
+    print(f"{'ast':>26} {ast_time:>8.2f} s  ({libcst_time / max(ast_time, 1e-9):.1f}x)")
+
+
+if __name__ == "__main__":
+    main()